@@ -8,13 +8,15 @@
 # we need to do our work.
 from __future__ import absolute_import
 
+# Only cheap modules are imported here, so starting the motw command
+# or importing the package stays fast. pydoc and webbrowser are
+# imported by the functions that use them.
 import os
-import pydoc
-import sys
 import types
-import webbrowser
 
 DOCS_DIR = 'docs'
+DOC_ARCHIVE = 'docs.pack'
+DOC_INDEX = 'docs.index'
 
 def get_doc_dir(module_name):
     """Return the local directory containing documentation for the module."""
@@ -23,13 +25,65 @@ def get_doc_dir(module_name):
     doc_dir = os.path.join(package_path, DOCS_DIR, module_name)
     return doc_dir
 
-def show_text(module_name):
-    """How help text for the named module."""
-    print >>sys.stderr, 'os', os
+_archive = None
+
+def get_archive():
+    """Return the packed text documentation, or None if it is not installed."""
+    global _archive
+    if _archive is None:
+        import PyMOTW
+        from PyMOTW import docarchive
+        filename = os.path.join(PyMOTW.__path__[0], DOC_ARCHIVE)
+        if os.path.exists(filename):
+            _archive = docarchive.DocArchive(filename)
+    return _archive
+
+def get_text(module_name):
+    """Return the help text for the named module."""
+    archive = get_archive()
+    if archive is not None:
+        try:
+            return archive.get(module_name.replace('.', '/'))
+        except KeyError:
+            pass
     filename = os.path.join(get_doc_dir(module_name), 'index.txt')
     with open(filename, 'rt') as f:
-        text = f.read()
-    pydoc.pager(text)
+        return f.read()
+
+_index = None
+
+def get_index():
+    """Return the full-text search index, or None if it is not installed."""
+    global _index
+    if _index is None:
+        import PyMOTW
+        from PyMOTW import docsearch
+        filename = os.path.join(PyMOTW.__path__[0], DOC_INDEX)
+        if os.path.exists(filename):
+            _index = docsearch.SearchIndex(filename)
+    return _index
+
+def search(query, limit=10):
+    """Return (score, module name, title) for the docs best matching query."""
+    index = get_index()
+    if index is None:
+        raise RuntimeError('The search index is not installed.')
+    return [(score, name.replace('/', '.'), title)
+            for score, name, title in index.search(query, limit)]
+
+def show_search(query):
+    """Print the modules whose help best matches the query."""
+    results = search(query)
+    if not results:
+        print 'No matches for %r' % query
+    for score, name, title in results:
+        print '%6.2f  %-20s  %s' % (score, name, title)
+    return
+
+def show_text(module_name):
+    """Show help text for the named module."""
+    import pydoc
+    pydoc.pager(get_text(module_name))
     return
     
 def motw(module):
@@ -42,6 +96,7 @@ __builtins__['motw'] = motw
 
 def show_html(module_name):
     """Show the HTML version of the help for the named module."""
+    import webbrowser
     module_path = os.path.join(get_doc_dir(module_name))
     url = 'file://localhost' + module_path + '/index.html'
     webbrowser.open(url)
@@ -49,6 +104,7 @@ def show_html(module_name):
 
 def show_webpage(module_name):
     """Open the remote web page with help for the named module."""
+    import webbrowser
     url = 'http://www.doughellmann.com/PyMOTW/' + module_name + '/'
     webbrowser.open(url)
     return
@@ -0,0 +1,133 @@
+#
+#  Copyright 2011 Doug Hellmann. All rights reserved.
+#
+"""Pack the plain text documentation into a single archive file.
+
+The archive starts with a header and a table of fixed-size entries
+sorted by name, followed by the names and the text of each document.
+Readers memory-map the file and binary search the table, so looking
+up a document only touches the few pages it needs, however many
+documents there are.
+"""
+
+# We need absolute imports because otherwise the module
+# inside our package will replace the stdlib modules
+# we need to do our work.
+from __future__ import absolute_import
+
+import mmap
+import os
+import struct
+
+MAGIC = 'PyMOTWdp'
+VERSION = 1
+
+# magic, version, number of entries
+HEADER = struct.Struct('>8sII')
+# name offset, name length, text offset, text length
+ENTRY = struct.Struct('>IIII')
+
+
+def doc_name(relname):
+    """Return the archive name for a file under the docs directory.
+
+    The text for a module is in <module>/index.txt, so that is stored
+    under the module's path ('os', 'xml/etree/ElementTree'). Other
+    files are stored under their path without the extension.
+    """
+    name = os.path.splitext(relname)[0].replace(os.sep, '/')
+    if name.endswith('/index'):
+        name = name[:-len('/index')]
+    return name
+
+
+def find_docs(docs_dir):
+    """Return (name, filename) for the text files under docs_dir, sorted by name.
+
+    Directories starting with '_' (_sources, _static) belong to the
+    HTML output and are skipped.
+    """
+    docs = []
+    for dirpath, dirnames, filenames in os.walk(docs_dir):
+        dirnames[:] = [d for d in dirnames if not d.startswith('_')]
+        for filename in filenames:
+            if not filename.endswith('.txt'):
+                continue
+            fullname = os.path.join(dirpath, filename)
+            relname = os.path.relpath(fullname, docs_dir)
+            docs.append((doc_name(relname), fullname))
+    docs.sort()
+    return docs
+
+
+def write_archive(docs_dir, archive_filename):
+    """Pack the text files under docs_dir into archive_filename.
+
+    Returns the number of documents written.
+    """
+    docs = find_docs(docs_dir)
+    names_start = HEADER.size + ENTRY.size * len(docs)
+    texts_start = names_start + sum(len(name) for name, fullname in docs)
+    entries = []
+    name_offset = names_start
+    text_offset = texts_start
+    for name, fullname in docs:
+        size = os.path.getsize(fullname)
+        entries.append(ENTRY.pack(name_offset, len(name), text_offset, size))
+        name_offset += len(name)
+        text_offset += size
+    tmp_filename = archive_filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(docs)))
+        f.write(''.join(entries))
+        for name, fullname in docs:
+            f.write(name)
+        for name, fullname in docs:
+            with open(fullname, 'rb') as doc:
+                f.write(doc.read())
+    os.rename(tmp_filename, archive_filename)
+    return len(docs)
+
+
+class DocArchive(object):
+    """Read documents from a file made by write_archive().
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError('%s is not a documentation archive' % filename)
+
+    def _entry(self, i):
+        """Return the name of the i'th entry and its (offset, length)."""
+        name_offset, name_len, text_offset, text_len = ENTRY.unpack_from(
+            self._map, HEADER.size + ENTRY.size * i)
+        name = self._map[name_offset:name_offset + name_len]
+        return name, (text_offset, text_len)
+
+    def names(self):
+        """Return the names of all of the documents, in sorted order."""
+        return [self._entry(i)[0] for i in xrange(self._count)]
+
+    def get(self, name):
+        """Return the text of the named document.
+
+        Raises KeyError if there is no such document.
+        """
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry_name, (offset, length) = self._entry(mid)
+            if entry_name < name:
+                lo = mid + 1
+            elif entry_name > name:
+                hi = mid
+            else:
+                return self._map[offset:offset + length]
+        raise KeyError(name)
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,267 @@
+#
+#  Copyright 2011 Doug Hellmann. All rights reserved.
+#
+"""Full-text search over the plain text documentation.
+
+The index is built from the same text files as the archive in
+docarchive. It starts with a header, a table of documents and a table
+of terms sorted by spelling, followed by the names and titles of the
+documents, the terms, and the postings for each term. The postings
+list every document a term appears in and the positions where it
+appears, packed as variable-length integers, each relative to the
+one before.
+
+Searching memory-maps the file, binary searches the term table for
+the words in the query and decodes only their postings. Documents are
+ranked with BM25, plus a boost for each place the query words appear
+together, in order.
+"""
+
+# We need absolute imports because otherwise the module
+# inside our package will replace the stdlib modules
+# we need to do our work.
+from __future__ import absolute_import
+
+import math
+import mmap
+import os
+import re
+import struct
+
+from PyMOTW import docarchive
+
+MAGIC = 'PyMOTWsi'
+VERSION = 1
+
+# magic, version, number of documents, number of terms, total tokens
+HEADER = struct.Struct('>8sIIII')
+# name offset, name length, title offset, title length, tokens
+DOC_ENTRY = struct.Struct('>IIIII')
+# term offset, term length, postings offset, postings length,
+# number of documents
+TERM_ENTRY = struct.Struct('>IIIII')
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Added to the score for each time the whole query appears as a phrase
+PHRASE_BOOST = 2.0
+
+_word = re.compile(r'[a-z0-9_]+(?:-[a-z0-9_]+)*')
+
+
+def tokenize(text):
+    """Return the words in text, lowercased, skipping single characters."""
+    return [w for w, position in words_at(text, compounds=False)]
+
+
+def words_at(text, compounds=True):
+    """Return (word, position) for the words in text.
+
+    With compounds, a hyphenated word is also indexed with the hyphens
+    removed, at the position of its last part, so "nonblocking socket"
+    finds "non-blocking socket".
+    """
+    result = []
+    position = 0
+    for match in _word.findall(text.lower()):
+        parts = [p for p in match.split('-') if len(p) > 1]
+        for part in parts:
+            result.append((part, position))
+            position += 1
+        if compounds and len(parts) > 1:
+            result.append((''.join(parts), position - 1))
+    return result
+
+
+def encode_varint(value, out):
+    """Append value to the list of bytes out, 7 bits at a time."""
+    while value >= 0x80:
+        out.append(chr((value & 0x7f) | 0x80))
+        value >>= 7
+    out.append(chr(value))
+    return
+
+
+def decode_varints(data):
+    """Return the list of integers packed into data by encode_varint()."""
+    values = []
+    value = shift = 0
+    for c in data:
+        byte = ord(c)
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = shift = 0
+    return values
+
+
+def write_index(docs_dir, index_filename):
+    """Index the text files under docs_dir into index_filename.
+
+    Returns the number of (documents, terms) indexed.
+    """
+    docs = []
+    postings = {}
+    total = 0
+    for docid, (name, fullname) in enumerate(docarchive.find_docs(docs_dir)):
+        with open(fullname, 'rb') as f:
+            text = f.read()
+        lines = text.lstrip().splitlines()
+        title = lines[0].strip() if lines else name
+        words = words_at(text)
+        docs.append((name, title, len(words)))
+        total += len(words)
+        for word, position in words:
+            positions = postings.setdefault(word, {}).setdefault(docid, [])
+            positions.append(position)
+    terms = sorted(postings)
+
+    # Pack the postings for each term
+    packed = []
+    for term in terms:
+        out = []
+        last_doc = 0
+        for docid in sorted(postings[term]):
+            positions = postings[term][docid]
+            encode_varint(docid - last_doc, out)
+            encode_varint(len(positions), out)
+            last_position = 0
+            for position in positions:
+                encode_varint(position - last_position, out)
+                last_position = position
+            last_doc = docid
+        packed.append(''.join(out))
+
+    # Lay out the variable-length parts after the tables
+    offset = HEADER.size + DOC_ENTRY.size * len(docs) + TERM_ENTRY.size * len(terms)
+    doc_entries = []
+    for name, title, length in docs:
+        doc_entries.append(DOC_ENTRY.pack(offset, len(name),
+                                          offset + len(name), len(title),
+                                          length))
+        offset += len(name) + len(title)
+    term_entries = []
+    for term in terms:
+        term_entries.append((offset, len(term)))
+        offset += len(term)
+    for i, term in enumerate(terms):
+        term_entries[i] = TERM_ENTRY.pack(term_entries[i][0], term_entries[i][1],
+                                          offset, len(packed[i]),
+                                          len(postings[term]))
+        offset += len(packed[i])
+
+    tmp_filename = index_filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(docs), len(terms), total))
+        f.write(''.join(doc_entries))
+        f.write(''.join(term_entries))
+        for name, title, length in docs:
+            f.write(name)
+            f.write(title)
+        for term in terms:
+            f.write(term)
+        for p in packed:
+            f.write(p)
+    os.rename(tmp_filename, index_filename)
+    return len(docs), len(terms)
+
+
+class SearchIndex(object):
+    """Answer queries from a file made by write_index().
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self._num_docs, self._num_terms,
+         total) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self._map.close()
+            raise ValueError('%s is not a search index' % filename)
+        self._avg_length = float(total) / (self._num_docs or 1)
+        self._terms_start = HEADER.size + DOC_ENTRY.size * self._num_docs
+
+    def document(self, docid):
+        """Return the (name, title, number of words) of a document."""
+        (name_offset, name_len, title_offset, title_len,
+         length) = DOC_ENTRY.unpack_from(self._map,
+                                         HEADER.size + DOC_ENTRY.size * docid)
+        return (self._map[name_offset:name_offset + name_len],
+                self._map[title_offset:title_offset + title_len],
+                length)
+
+    def postings(self, term):
+        """Return a dictionary mapping docid to the positions of term."""
+        lo, hi = 0, self._num_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (term_offset, term_len, offset, length,
+             num_docs) = TERM_ENTRY.unpack_from(
+                self._map, self._terms_start + TERM_ENTRY.size * mid)
+            found = self._map[term_offset:term_offset + term_len]
+            if found < term:
+                lo = mid + 1
+            elif found > term:
+                hi = mid
+            else:
+                break
+        else:
+            return {}
+        values = decode_varints(self._map[offset:offset + length])
+        result = {}
+        i = 0
+        docid = 0
+        while i < len(values):
+            docid += values[i]
+            count = values[i + 1]
+            positions = []
+            position = 0
+            for delta in values[i + 2:i + 2 + count]:
+                position += delta
+                positions.append(position)
+            result[docid] = positions
+            i += 2 + count
+        return result
+
+    def search(self, query, limit=10):
+        """Return up to limit (score, name, title) for the best matches.
+
+        Documents with every word of the query rank above those with
+        only some of them.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        postings = dict((w, self.postings(w)) for w in set(words))
+        matching = [set(p) for p in postings.values()]
+        candidates = set.intersection(*matching)
+        if not candidates:
+            candidates = set.union(*matching)
+
+        results = []
+        for docid in candidates:
+            name, title, length = self.document(docid)
+            score = 0.0
+            for word, docs in postings.items():
+                if docid not in docs:
+                    continue
+                tf = len(docs[docid])
+                idf = math.log(1 + (self._num_docs - len(docs) + 0.5) /
+                               (len(docs) + 0.5))
+                score += idf * tf * (K1 + 1) / (
+                    tf + K1 * (1 - B + B * length / self._avg_length))
+            if len(words) > 1 and all(docid in postings[w] for w in words):
+                starts = set(postings[words[0]][docid])
+                for offset, word in enumerate(words[1:], 1):
+                    starts &= set(p - offset for p in postings[word][docid])
+                score += PHRASE_BOOST * len(starts)
+            results.append((score, name, title))
+        results.sort(key=lambda r: (-r[0], r[1]))
+        return results[:limit]
+
+    def close(self):
+        self._map.close()
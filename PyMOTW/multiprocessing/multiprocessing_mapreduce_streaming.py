@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""
+"""
+#end_pymotw_header
+import collections
+import cPickle as pickle
+import heapq
+import itertools
+import multiprocessing
+import operator
+import os
+import shutil
+import tempfile
+
+from multiprocessing_mapreduce import SimpleMapReduce
+
+# The most spill files a reducer reads at one time.
+MAX_OPEN_RUNS = 64
+
+def combine(partition, combine_func):
+    """Apply the combine_func to the values for each key in one
+    partition, if there is one.
+    """
+    if combine_func is not None:
+        for key, values in partition.items():
+            partition[key] = [combine_func((key, values))[1]]
+    return partition
+
+def map_and_partition(args):
+    """Map one input, then group the intermediate data by key in
+    the worker, into one dictionary per partition. Keys are assigned
+    to partitions by their hash. If a combine_func is given, it is
+    applied to the values for each key before they are returned.
+    """
+    map_func, combine_func, num_partitions, item = args
+    partitions = [collections.defaultdict(list)
+                  for i in range(num_partitions)]
+    for key, value in map_func(item):
+        partitions[hash(key) % num_partitions][key].append(value)
+    return [dict(combine(partition, combine_func))
+            for partition in partitions]
+
+def reduce_partition(args):
+    """Reduce all of the keys in one partition.
+    """
+    reduce_func, items = args
+    return [reduce_func(item) for item in items]
+
+def write_run(items, workdir, partition_num):
+    """Write the (key, values) items, which must be sorted by key,
+    to a new spill file for the partition. Returns the file name.
+    """
+    fd, filename = tempfile.mkstemp(dir=workdir,
+                                    prefix='partition%d-' % partition_num)
+    with os.fdopen(fd, 'wb') as f:
+        for item in items:
+            pickle.dump(item, f, pickle.HIGHEST_PROTOCOL)
+    return filename
+
+def map_and_spill(args):
+    """Map one input, then write the intermediate data to one sorted
+    spill file per partition. When more than spill_limit values have
+    been collected, they are written out and the worker starts over,
+    so a large input may produce several files for each partition.
+    Returns a sequence of (partition number, file name) tuples.
+    """
+    map_func, combine_func, num_partitions, spill_limit, workdir, item = args
+    runs = []
+    def spill(partitions):
+        for partition_num, partition in enumerate(partitions):
+            if partition:
+                combine(partition, combine_func)
+                filename = write_run(sorted(partition.iteritems()),
+                                     workdir, partition_num)
+                runs.append((partition_num, filename))
+    partitions = [collections.defaultdict(list)
+                  for i in range(num_partitions)]
+    buffered = 0
+    for key, value in map_func(item):
+        partitions[hash(key) % num_partitions][key].append(value)
+        buffered += 1
+        if buffered >= spill_limit:
+            spill(partitions)
+            partitions = [collections.defaultdict(list)
+                          for i in range(num_partitions)]
+            buffered = 0
+    spill(partitions)
+    return runs
+
+def read_run(filename, run_num):
+    """Return the (key, run_num, values) items from a spill file.
+    The run_num keeps heapq.merge() from comparing the values of two
+    items with the same key.
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                key, values = pickle.load(f)
+            except EOFError:
+                break
+            yield (key, run_num, values)
+
+def merge_runs(filenames, combine_func=None):
+    """Merge sorted spill files, returning (key, values) items with
+    all of the values for each key, in order by key.
+    """
+    merged = heapq.merge(*[read_run(filename, run_num)
+                           for run_num, filename in enumerate(filenames)])
+    for key, group in itertools.groupby(merged, operator.itemgetter(0)):
+        values = []
+        for key, run_num, run_values in group:
+            values.extend(run_values)
+        if combine_func is not None:
+            values = [combine_func((key, values))[1]]
+        yield (key, values)
+
+def reduce_spilled_partition(args):
+    """Reduce all of the keys in one partition by merging its spill
+    files. If there are more than max_open_runs files they are first
+    merged, in passes, into fewer and larger files.
+    """
+    (reduce_func, combine_func, max_open_runs, workdir,
+     partition_num, filenames) = args
+    while len(filenames) > max_open_runs:
+        merged_filenames = []
+        for i in range(0, len(filenames), max_open_runs):
+            group = filenames[i:i + max_open_runs]
+            merged_filenames.append(
+                write_run(merge_runs(group, combine_func),
+                          workdir, partition_num))
+            for filename in group:
+                os.unlink(filename)
+        filenames = merged_filenames
+    return [reduce_func(item) for item in merge_runs(filenames)]
+
+class StreamingMapReduce(SimpleMapReduce):
+
+    # When a combine_func is given, the values for a key collected
+    # from the workers are combined again once there are this many.
+    combine_limit = 32
+
+    def __init__(self, map_func, reduce_func, num_workers=None,
+                 combine_func=None, num_partitions=None,
+                 spill_dir=None, spill_limit=100000,
+                 max_open_runs=MAX_OPEN_RUNS):
+        """
+        map_func, reduce_func, num_workers
+
+          As for SimpleMapReduce.
+
+        combine_func
+
+          Optional function to pre-aggregate the intermediate data
+          for each key inside the worker that produced it, before it
+          is sent back.  Takes the same arguments and returns the same
+          type of value as reduce_func, so when the reduction can be
+          applied in stages (like a sum) reduce_func can be used.
+
+        num_partitions
+
+          The number of partitions to split the intermediate data
+          into. Defaults to the number of workers.
+
+        spill_dir
+
+          Optional directory for temporary files. If given, the
+          workers write the intermediate data to sorted files for each
+          partition there instead of sending it back to the parent
+          process, and each partition is reduced by merging its files.
+
+        spill_limit
+
+          The number of intermediate values a worker may hold before
+          writing them to the spill files.
+
+        max_open_runs
+
+          The most spill files a reducer reads at one time. Partitions
+          with more files are merged in several passes.
+        """
+        super(StreamingMapReduce, self).__init__(map_func, reduce_func,
+                                                 num_workers)
+        self.combine_func = combine_func
+        self.spill_dir = spill_dir
+        self.spill_limit = spill_limit
+        self.max_open_runs = max_open_runs
+        self.num_partitions = (num_partitions or num_workers
+                               or multiprocessing.cpu_count())
+
+    def partition(self, mapped_partitions):
+        """Merge the partitioned values from each worker as they arrive.
+        Returns a list of dictionaries, one per partition, mapping
+        each key to a sequence of values.
+        """
+        partitioned_data = [collections.defaultdict(list)
+                            for i in range(self.num_partitions)]
+        for worker_partitions in mapped_partitions:
+            for merged, partial in zip(partitioned_data, worker_partitions):
+                for key, values in partial.iteritems():
+                    merged_values = merged[key]
+                    merged_values.extend(values)
+                    if (self.combine_func is not None
+                        and len(merged_values) >= self.combine_limit):
+                        merged[key] = [self.combine_func((key, merged_values))[1]]
+        return partitioned_data
+
+    def __call__(self, inputs, chunksize=1):
+        """Process the inputs through the map and reduce functions given.
+
+        inputs
+          An iterable containing the input data to be processed.
+
+        chunksize=1
+          The portion of the input data to hand to each worker.  This
+          can be used to tune performance during the mapping phase.
+        """
+        if self.spill_dir is not None:
+            return self.spill_and_reduce(inputs, chunksize)
+        map_args = ((self.map_func, self.combine_func, self.num_partitions, item)
+                    for item in inputs)
+        map_responses = self.pool.imap_unordered(map_and_partition, map_args,
+                                                 chunksize=chunksize)
+        partitioned_data = self.partition(map_responses)
+        reduce_args = ((self.reduce_func, partition.items())
+                       for partition in partitioned_data)
+        # Reduce the partitions in order, so the results come back in
+        # the same order every time.
+        reduced_values = list(itertools.chain.from_iterable(
+                self.pool.imap(reduce_partition, reduce_args)))
+        return reduced_values
+
+    def spill_and_reduce(self, inputs, chunksize=1):
+        """Process the inputs, passing the intermediate data through
+        spill files under spill_dir. Only the names of the files are
+        sent back to the parent.
+        """
+        workdir = tempfile.mkdtemp(prefix='mapreduce-', dir=self.spill_dir)
+        try:
+            map_args = ((self.map_func, self.combine_func, self.num_partitions,
+                         self.spill_limit, workdir, item)
+                        for item in inputs)
+            runs = [[] for i in range(self.num_partitions)]
+            for worker_runs in self.pool.imap_unordered(map_and_spill, map_args,
+                                                        chunksize=chunksize):
+                for partition_num, filename in worker_runs:
+                    runs[partition_num].append(filename)
+            reduce_args = ((self.reduce_func, self.combine_func,
+                            self.max_open_runs, workdir,
+                            partition_num, filenames)
+                           for partition_num, filenames in enumerate(runs)
+                           if filenames)
+            reduced_values = list(itertools.chain.from_iterable(
+                    self.pool.imap(reduce_spilled_partition, reduce_args)))
+        finally:
+            shutil.rmtree(workdir)
+        return reduced_values
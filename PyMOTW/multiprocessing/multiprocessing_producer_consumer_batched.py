@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""
+"""
+#end_pymotw_header
+
+import itertools
+import multiprocessing
+import time
+
+from multiprocessing_producer_consumer import Consumer
+
+class BatchConsumer(Consumer):
+    """Takes a list of tasks at a time from the task queue and sends
+    all of their answers back together.
+    """
+
+    def run(self):
+        proc_name = self.name
+        while True:
+            batch = self.task_queue.get()
+            if batch is None:
+                # Poison pill means shutdown
+                break
+            start = time.time()
+            answers = [task() for task in batch]
+            self.result_queue.put((proc_name, answers, time.time() - start))
+        return
+
+
+class ConsumerPool(object):
+    """Runs tasks in a set of BatchConsumers, batch_size at a time.
+
+    No more than max_pending batches are queued or being worked on at
+    once, so the tasks can come from a generator that is too large to
+    queue all at once.
+    """
+
+    def __init__(self, num_consumers=None, batch_size=100, max_pending=None):
+        self.num_consumers = num_consumers or multiprocessing.cpu_count()
+        self.batch_size = batch_size
+        self.max_pending = max_pending or self.num_consumers * 2
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.consumers = [ BatchConsumer(self.tasks, self.results)
+                           for i in xrange(self.num_consumers) ]
+        for w in self.consumers:
+            w.start()
+        # Consumer name -> [tasks, batches, seconds spent working]
+        self.worker_stats = {}
+        # Batches waiting or being worked on, sampled before each
+        # batch of answers is received
+        self.depth_samples = []
+        # When the first batch was sent and the last answers received
+        self.started = self.finished = None
+
+    def imap_unordered(self, tasks):
+        """Run the tasks, returning the answers as each batch is finished.
+        """
+        tasks = iter(tasks)
+        pending = 0
+        if self.started is None:
+            self.started = time.time()
+        while True:
+            while pending < self.max_pending:
+                batch = list(itertools.islice(tasks, self.batch_size))
+                if not batch:
+                    break
+                self.tasks.put(batch)
+                pending += 1
+            if not pending:
+                break
+            self.depth_samples.append(pending)
+            name, answers, busy = self.results.get()
+            self.finished = time.time()
+            pending -= 1
+            stats = self.worker_stats.setdefault(name, [0, 0, 0.0])
+            stats[0] += len(answers)
+            stats[1] += 1
+            stats[2] += busy
+            for answer in answers:
+                yield answer
+
+    def close(self):
+        """Stop the consumers and wait for them to exit.
+        """
+        for w in self.consumers:
+            self.tasks.put(None)
+        for w in self.consumers:
+            w.join()
+
+    def report(self):
+        """Print the queue depth and how much work each consumer did.
+        """
+        if self.depth_samples:
+            print 'Queue depth: average %.1f, maximum %d batches' % (
+                float(sum(self.depth_samples)) / len(self.depth_samples),
+                max(self.depth_samples))
+        if self.finished is None:
+            return
+        elapsed = self.finished - self.started
+        for name, (num_tasks, num_batches, busy) in sorted(self.worker_stats.items()):
+            print '%s: %d tasks in %d batches, %.0f tasks/sec, busy %d%%' % (
+                name, num_tasks, num_batches, num_tasks / elapsed,
+                100 * busy / elapsed)
+
+
+class Multiply(object):
+    """A task that takes almost no time, so the cost of sending it
+    to a consumer and getting the answer back is what matters.
+    """
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+    def __call__(self):
+        return self.a * self.b
+
+
+if __name__ == '__main__':
+    import sys
+    show_report = '--report' in sys.argv[1:]
+    num_jobs = 20000
+    expected = sum(i * i for i in xrange(num_jobs))
+
+    for batch_size in [1, 100]:
+        pool = ConsumerPool(num_consumers=2, batch_size=batch_size)
+        print 'Batches of %d' % batch_size
+        start = time.time()
+        total = sum(pool.imap_unordered(Multiply(i, i)
+                                        for i in xrange(num_jobs)))
+        elapsed = time.time() - start
+        pool.close()
+        num_batches = sum(stats[1] for stats in pool.worker_stats.values())
+        print '%d tasks in %d batches, correct: %s' % (
+            num_jobs, num_batches, total == expected)
+        if show_report:
+            print '%.2f seconds' % elapsed
+            pool.report()
+        print
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""
+"""
+#end_pymotw_header
+
+import array
+import ctypes
+import multiprocessing
+
+class SharedResults(object):
+    """A block of shared memory that workers write numeric results
+    into, so only the location of the results has to be sent back to
+    the parent process.
+    """
+
+    def __init__(self, typecode, size):
+        self.typecode = typecode
+        self.itemsize = array.array(typecode).itemsize
+        self.buffer = multiprocessing.Array(typecode, size, lock=False)
+
+    def write(self, offset, values):
+        """Copy an array of values into the buffer, starting at
+        offset. Returns the offset and the number of values.
+        """
+        if values.typecode != self.typecode:
+            raise TypeError('expected an array of %r, got %r'
+                            % (self.typecode, values.typecode))
+        if offset + len(values) > len(self.buffer):
+            raise ValueError('%d values at %d do not fit in %d'
+                             % (len(values), offset, len(self.buffer)))
+        address, count = values.buffer_info()
+        ctypes.memmove(ctypes.addressof(self.buffer) + offset * self.itemsize,
+                       address, count * self.itemsize)
+        return (offset, count)
+
+    def read(self, offset, count):
+        """Return a copy of count values starting at offset, as an array.
+        """
+        start = offset * self.itemsize
+        return array.array(self.typecode,
+                           buffer(self.buffer)[start:start + count * self.itemsize])
+
+# The SharedResults for the current pool worker
+shared_results = None
+
+def install(results):
+    """Pool initializer to give each worker the SharedResults. The
+    shared memory cannot be passed to the workers as an argument of a
+    task, so it is inherited when the pool starts the worker.
+    """
+    global shared_results
+    shared_results = results
+
+def calculate(args):
+    offset, count = args
+    values = array.array('d', (i * 0.5 for i in xrange(offset, offset + count)))
+    return shared_results.write(offset, values)
+
+if __name__ == '__main__':
+    num_tasks = 5
+    values_per_task = 1000
+    results = SharedResults('d', num_tasks * values_per_task)
+
+    pool = multiprocessing.Pool(initializer=install, initargs=(results,))
+    tasks = [ (i * values_per_task, values_per_task)
+              for i in range(num_tasks) ]
+    for offset, count in pool.imap(calculate, tasks):
+        values = results.read(offset, count)
+        print 'Values %4d to %4d: %6.1f ... %6.1f' % (
+            offset, offset + count - 1, values[0], values[-1])
+    pool.close()
+    pool.join()
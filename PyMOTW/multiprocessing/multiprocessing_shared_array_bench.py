@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""
+"""
+#end_pymotw_header
+
+import array
+import multiprocessing
+import time
+
+from multiprocessing_shared_array import SharedResults, install, calculate
+
+NUM_TASKS = 8
+NUM_WORKERS = 2
+
+def make_values(offset, count):
+    return array.array('d', (i * 0.5 for i in xrange(offset, offset + count)))
+
+def pickled(args):
+    """Send the whole result back through the pool's result queue."""
+    return make_values(*args)
+
+def queue_worker(tasks, results):
+    for offset, count in iter(tasks.get, None):
+        results.put((offset, make_values(offset, count)))
+
+def manager_worker(tasks, d):
+    for offset, count in iter(tasks.get, None):
+        d[offset] = make_values(offset, count)
+
+# Each of the by_*() functions starts its workers before it starts
+# timing, and stops once it has all of the results, so only sending
+# the work out and the results back is measured.
+
+def by_pool(count):
+    pool = multiprocessing.Pool(NUM_WORKERS)
+    start = time.time()
+    total = sum(sum(values) for values in
+                pool.imap_unordered(pickled, tasks(count)))
+    elapsed = time.time() - start
+    pool.close()
+    pool.join()
+    return total, elapsed
+
+def start_workers(worker, results):
+    """Start NUM_WORKERS processes running worker, which takes tasks
+    from the queue returned and sends its answers through results.
+    """
+    task_queue = multiprocessing.Queue()
+    workers = [ multiprocessing.Process(target=worker,
+                                        args=(task_queue, results))
+                for i in range(NUM_WORKERS) ]
+    for w in workers:
+        w.start()
+    return task_queue, workers
+
+def send_tasks(task_queue, count):
+    for t in tasks(count):
+        task_queue.put(t)
+    for i in range(NUM_WORKERS):
+        task_queue.put(None)
+
+def by_queue(count):
+    results = multiprocessing.Queue()
+    task_queue, workers = start_workers(queue_worker, results)
+    start = time.time()
+    send_tasks(task_queue, count)
+    total = sum(sum(results.get()[1]) for i in range(NUM_TASKS))
+    elapsed = time.time() - start
+    for w in workers:
+        w.join()
+    return total, elapsed
+
+def by_manager(count):
+    mgr = multiprocessing.Manager()
+    try:
+        results = mgr.dict()
+        task_queue, workers = start_workers(manager_worker, results)
+        start = time.time()
+        send_tasks(task_queue, count)
+        for w in workers:
+            w.join()
+        total = sum(sum(values) for values in results.values())
+        elapsed = time.time() - start
+    finally:
+        mgr.shutdown()
+    return total, elapsed
+
+def by_shared_array(count):
+    results = SharedResults('d', NUM_TASKS * count)
+    pool = multiprocessing.Pool(NUM_WORKERS, initializer=install,
+                                initargs=(results,))
+    start = time.time()
+    total = sum(sum(results.read(offset, n)) for offset, n in
+                pool.imap_unordered(calculate, tasks(count)))
+    elapsed = time.time() - start
+    pool.close()
+    pool.join()
+    return total, elapsed
+
+def tasks(count):
+    return [ (i * count, count) for i in range(NUM_TASKS) ]
+
+if __name__ == '__main__':
+    methods = [ ('Pool', by_pool),
+                ('Queue', by_queue),
+                ('Manager', by_manager),
+                ('Shared', by_shared_array),
+                ]
+    print '%8s %8s' % ('Values', 'MB') + ''.join('%9s' % name
+                                              for name, method in methods)
+    for count in [1000, 10000, 100000]:
+        n = NUM_TASKS * count
+        expected = sum(i * 0.5 for i in xrange(n))
+        line = '%8d %8.1f' % (count, n * 8 / 1024.0 / 1024.0)
+        for name, method in methods:
+            total, elapsed = method(count)
+            if total != expected:
+                raise RuntimeError('%s got the wrong answer' % name)
+            line += '%9.3f' % elapsed
+        print line
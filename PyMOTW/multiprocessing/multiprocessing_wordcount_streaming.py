@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""
+"""
+#end_pymotw_header
+import collections
+import mmap
+import os
+import string
+
+from multiprocessing_mapreduce_streaming import StreamingMapReduce
+from multiprocessing_wordcount import count_words
+
+# Files larger than this are split into several map tasks.
+CHUNK_SIZE = 1024 * 1024
+
+def split_file(filename, chunk_size=CHUNK_SIZE):
+    """Return a sequence of (filename, start, end) tuples dividing the
+    file into byte ranges of about chunk_size, ending at line breaks.
+    """
+    size = os.path.getsize(filename)
+    if size <= chunk_size:
+        return [(filename, 0, size)]
+    ranges = []
+    with open(filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start = 0
+            while start < size:
+                end = data.find('\n', start + chunk_size)
+                if end == -1:
+                    end = size
+                else:
+                    end += 1
+                ranges.append((filename, start, end))
+                start = end
+        finally:
+            data.close()
+    return ranges
+
+def file_to_words(file_range):
+    """Read part of a file and return a sequence of (word, occurances)
+    values, with one value for each distinct word.
+    """
+    STOP_WORDS = set([
+            'a', 'an', 'and', 'are', 'as', 'be', 'by', 'for', 'if', 'in',
+            'is', 'it', 'of', 'or', 'py', 'rst', 'that', 'the', 'to', 'with',
+            ])
+    TR = string.maketrans(string.punctuation, ' ' * len(string.punctuation))
+
+    filename, start, end = file_range
+    if start == end:
+        return []
+
+    counts = collections.Counter()
+
+    with open(filename, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            data.seek(start)
+            while data.tell() < end:
+                line = data.readline()
+                if line.lstrip().startswith('..'): # Skip rst comment lines
+                    continue
+                line = line.translate(TR) # Strip punctuation
+                for word in line.split():
+                    word = word.lower()
+                    if word.isalpha() and word not in STOP_WORDS:
+                        counts[word] += 1
+        finally:
+            data.close()
+    return counts.items()
+
+
+if __name__ == '__main__':
+    import operator
+    import glob
+    import sys
+    import tempfile
+
+    input_files = sys.argv[1:] or glob.glob('*.rst')
+    inputs = [file_range
+              for filename in input_files
+              for file_range in split_file(filename)]
+
+    # The limits are kept small so that even these few files are
+    # spilled in several runs, and merged in more than one pass.
+    mapper = StreamingMapReduce(file_to_words, count_words,
+                                combine_func=count_words,
+                                spill_dir=tempfile.gettempdir(),
+                                spill_limit=100,
+                                max_open_runs=4,
+                                )
+    word_counts = mapper(inputs)
+    # Sort by word first so words with the same count are always
+    # listed in the same order.
+    word_counts.sort()
+    word_counts.sort(key=operator.itemgetter(1), reverse=True)
+
+    print 'TOP 20 WORDS BY FREQUENCY\n'
+    top20 = word_counts[:20]
+    longest = max(len(word) for word, count in top20)
+    for word, count in top20:
+        print '%-*s: %5s' % (longest+1, word, count)
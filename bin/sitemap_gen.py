@@ -59,18 +59,27 @@ if sys.hexversion < 0x02020000:
   print 'Currently run with version: %s' % sys.version
   sys.exit(1)
 
+import array
+import bisect
 import fnmatch
 import glob
 import gzip
+import heapq
+import itertools
+import marshal
 import md5
+import mmap
 import os
 import re
 import stat
+import struct
+import tempfile
 import time
 import types
 import urllib
 import urlparse
 import xml.sax
+import xml.sax.saxutils
 
 # True and False were introduced in Python2.2.2
 try:
@@ -92,14 +101,59 @@ ENC_DEFAULT_LIST = ['ISO-8859-1', 'ISO-8859-2', 'ISO-8859-5']
 # Maximum number of urls in each sitemap, before next Sitemap is created
 MAXURLS_PER_SITEMAP = 50000
 
+# Maximum number of urls held in memory by an external sort before a
+# sorted run is written to a temporary file
+MAXURLS_PER_RUN = 100000
+
+# Maximum number of sorted runs an external sort merges at once
+MAXRUNS_PER_MERGE = 64
+
+# URLs that have been written out are remembered by an integer key made
+# from the front of their hash, kept in sorted arrays.  Keys are 64 bits
+# where a long holds them, otherwise the 48 bits a double holds exactly.
+if array.array('l').itemsize >= 8:
+  KEY_TYPECODE = 'l'
+  KEY_BYTES    = 8
+else:
+  KEY_TYPECODE = 'd'
+  KEY_BYTES    = 6
+
 # Suffix on a Sitemap index file
 SITEINDEX_SUFFIX = '_index.xml'
 
+# Format of the state file kept for incremental runs
+SITEMAP_STATE_VERSION = 1
+
 # Regular expressions tried for extracting URLs from access logs.
 ACCESSLOG_CLF_PATTERN = re.compile(
   r'.+\s+"([^\s]+)\s+([^\s]+)\s+HTTP/\d+\.\d+"\s+200\s+.*'
   )
 
+# The same, but finding the successful GET and HEAD requests in a block
+# of lines at once, for reading large logs a chunk at a time.
+ACCESSLOG_CLF_CHUNK_PATTERN = re.compile(
+  r'^.+[ \t]"(?:GET|HEAD)[ \t]+([^\s]+)[ \t]+HTTP/\d+\.\d+"[ \t]+200[ \t]',
+  re.MULTILINE
+  )
+
+# Lines of an Extended Log File Format file worth splitting into fields
+ACCESSLOG_ELF_PREFILTER = re.compile(
+  r'\b(?:GET|HEAD)\b.*\b200\b|\b200\b.*\b(?:GET|HEAD)\b'
+  )
+
+# Size of the pieces large access logs are split into for the workers
+ACCESSLOG_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Added to the offset file name for the file of URLs already read
+ACCESSLOG_URLS_SUFFIX = '.urls'
+
+# How much of the start of an access log is checked to see whether the
+# log was replaced or truncated since the offset was saved
+ACCESSLOG_HEAD_BYTES = 4096
+
+# Number of directories scanned ahead of the one being consumed
+DIRECTORY_SCAN_AHEAD = 16
+
 # Match patterns for lastmod attributes
 LASTMOD_PATTERNS = map(re.compile, [
   r'^\d\d\d\d$',
@@ -608,6 +662,15 @@ class URL(object):
     return md5.new(self.loc).digest()
   #end def MakeHash
 
+  def MakeKey(self):
+    """ Provides a fixed-width integer form of MakeHash, which takes less
+    memory to store """
+    hash = self.MakeHash()
+    if not hash:
+      return None
+    return struct.unpack('>q', '\0' * (8 - KEY_BYTES) + hash[:KEY_BYTES])[0]
+  #end def MakeKey
+
   def Log(self, prefix='URL', level=3):
     """ Dump the contents, empty or not, to the log. """
     out = prefix + ':'
@@ -847,11 +910,19 @@ class InputDirectory:
     self._path         = None               # The directory
     self._url          = None               # The URL equivelant
     self._default_file = None
+    self._jobs         = 0                  # Threads scanning directories
 
     if not ValidateAttributes('DIRECTORY', attributes, ('path', 'url',
-                                                           'default_file')):
+                                                 'default_file', 'jobs')):
       return
 
+    jobs = attributes.get('jobs')
+    if jobs:
+      try:
+        self._jobs = int(jobs)
+      except ValueError:
+        output.Error('The "jobs" attribute must be a number: %s' % jobs)
+
     # Prep the path -- it MUST end in a sep
     path = attributes.get('path')
     if not path:
@@ -902,83 +973,138 @@ class InputDirectory:
   #end def __init__
 
   def ProduceURLs(self, consumer):
-    """ Produces URLs from our data source, hands them in to the consumer. """
+    """
+    Produces URLs from our data source, hands them in to the consumer.
+
+    The directories are visited in the same order os.path.walk would use.
+    With more than one job, a pool of threads lists and stats the next
+    few directories while the URLs from the current one are consumed.
+    """
     if not self._path:
       return
 
-    root_path = self._path
-    root_URL  = self._url
-    root_file = self._default_file
-
-    def PerFile(dirpath, name):
-      """
-      Called once per file.
-      Note that 'name' will occasionally be None -- for a directory itself
-      """
-      # Pull a timestamp
-      url           = URL()
-      isdir         = False
+    output.Log('Walking DIRECTORY "%s"' % self._path, 1)
+    (isdir, time, recurse) = StatDirectoryEntry(self._path,
+                                                self._default_file)
+    self.ConsumeEntry(consumer, self._path, None, isdir, time)
+
+    pool = None
+    if self._jobs > 1:
       try:
-        if name:
-          path      = os.path.join(dirpath, name)
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self._jobs)
+      except ImportError:
+        output.Warn('Walking directories in one thread, multiprocessing'
+                    ' is not available.')
+
+    # A stack of [dirpath, pending scan] with the next directory on top
+    stack = [[self._path, None]]
+    try:
+      while stack:
+        if pool:
+          for next in stack[-DIRECTORY_SCAN_AHEAD:]:
+            if next[1] is None:
+              next[1] = pool.apply_async(ScanDirectory,
+                                         (next[0], self._default_file))
+        (dirpath, scan) = stack.pop()
+        if scan:
+          entries = scan.get()
         else:
-          path      = dirpath
-        isdir       = os.path.isdir(path)
-        time        = None
-        if isdir and root_file:
-          file      = os.path.join(path, root_file)
-          try:
-            time    = os.stat(file)[stat.ST_MTIME];
-          except OSError:
-            pass
-        if not time:
-          time      = os.stat(path)[stat.ST_MTIME];
+          entries = ScanDirectory(dirpath, self._default_file)
+
+        subdirs = []
+        for (name, isdir, time, recurse) in entries:
+          self.ConsumeEntry(consumer, dirpath, name, isdir, time)
+          if recurse:
+            subdirs.append([os.path.join(dirpath, name), None])
+        subdirs.reverse()
+        stack.extend(subdirs)
+    finally:
+      if pool:
+        pool.terminate()
+  #end def ProduceURLs
+
+  def ConsumeEntry(self, consumer, dirpath, name, isdir, time):
+    """
+    Builds the URL for one entry and hands it to the consumer.
+    Note that 'name' will be None for the root directory itself
+    """
+    url           = URL()
+    if time is not None:
+      try:
         url.lastmod = TimestampISO8601(time)
-      except OSError:
-        pass
       except ValueError:
         pass
 
-      # Build a URL
-      middle        = dirpath[len(root_path):]
-      if os.sep != '/':
-        middle = middle.replace(os.sep, '/')
-      if middle:
-        middle      = middle + '/'
-      if name:
-        middle      = middle + name
-        if isdir:
-          middle    = middle + '/'
-      url.TrySetAttribute('loc', root_URL + encoder.WidenText(middle, None))
-
-      # Suppress default files.  (All the way down here so we can log it.)
-      if name and (root_file == name):
-        url.Log(prefix='IGNORED (default file)', level=2)
-        return
+    # Build a URL
+    middle        = dirpath[len(self._path):]
+    if os.sep != '/':
+      middle = middle.replace(os.sep, '/')
+    if middle:
+      middle      = middle + '/'
+    if name:
+      middle      = middle + name
+      if isdir:
+        middle    = middle + '/'
+    url.TrySetAttribute('loc', self._url + encoder.WidenText(middle, None))
+
+    # Suppress default files.  (All the way down here so we can log it.)
+    if name and (self._default_file == name):
+      url.Log(prefix='IGNORED (default file)', level=2)
+      return
 
-      consumer(url, False)
-    #end def PerFile
+    consumer(url, False)
+  #end def ConsumeEntry
+#end class InputDirectory
 
-    def PerDirectory(ignore, dirpath, namelist):
-      """
-      Called once per directory with a list of all the contained files/dirs.
-      """
-      ignore = ignore  # Avoid warnings of an unused parameter
 
-      if not dirpath.startswith(root_path):
-        output.Warn('Unable to decide what the root path is for directory: '
-                    '%s' % dirpath)
-        return
+def StatDirectoryEntry(path, default_file):
+  """
+  Returns (isdir, time, recurse) for a path found by InputDirectory.
+  isdir is True for directories and links to them, time is the
+  modification time of the default file in a directory, or of the path
+  itself, or None if neither could be read, and recurse is True if the
+  walk should descend into the path, which is not done for links.
+  """
+  isdir   = False
+  time    = None
+  recurse = False
+  try:
+    st      = os.lstat(path)
+    recurse = stat.S_ISDIR(st[stat.ST_MODE])
+    if stat.S_ISLNK(st[stat.ST_MODE]):
+      st    = os.stat(path)
+    isdir   = stat.S_ISDIR(st[stat.ST_MODE])
+    if isdir and default_file:
+      try:
+        time = os.stat(os.path.join(path, default_file))[stat.ST_MTIME]
+      except OSError:
+        pass
+    if not time:
+      time  = st[stat.ST_MTIME]
+  except OSError:
+    pass
+  return (isdir, time, recurse)
+#end def StatDirectoryEntry
 
-      for name in namelist:
-        PerFile(dirpath, name)
-    #end def PerDirectory
 
-    output.Log('Walking DIRECTORY "%s"' % self._path, 1)
-    PerFile(self._path, None)
-    os.path.walk(self._path, PerDirectory, None)
-  #end def ProduceURLs
-#end class InputDirectory
+def ScanDirectory(dirpath, default_file):
+  """
+  Lists a directory and stats everything in it, returning a list of
+  (name, isdir, time, recurse) in the order the names were listed.
+  Unreadable directories are treated as empty.
+  """
+  try:
+    names = os.listdir(dirpath)
+  except OSError:
+    return []
+  entries = []
+  for name in names:
+    (isdir, time, recurse) = StatDirectoryEntry(os.path.join(dirpath, name),
+                                                default_file)
+    entries.append((name, isdir, time, recurse))
+  return entries
+#end def ScanDirectory
 
 
 class InputAccessLog:
@@ -1001,12 +1127,26 @@ class InputAccessLog:
     self._elf_uri      = -1                 # ELF field: '/foo?bar=1'
     self._elf_urifrag1 = -1                 # ELF field: '/foo'
     self._elf_urifrag2 = -1                 # ELF field: 'bar=1'
+    self._jobs         = 0                  # Worker processes for chunks
+    self._offset_file  = None               # Where read offsets are kept
+    self._offset       = None               # (inode, offset, size, head)
+    self._counts       = None               # URL: sightings, read up to there
 
-    if not ValidateAttributes('ACCESSLOG', attributes, ('path', 'encoding')):
+    if not ValidateAttributes('ACCESSLOG', attributes,
+                              ('path', 'encoding', 'jobs', 'offset_file')):
       return
 
     self._path      = attributes.get('path')
     self._encoding  = attributes.get('encoding', ENC_UTF8)
+    self._offset_file = attributes.get('offset_file')
+    jobs            = attributes.get('jobs')
+    if jobs:
+      try:
+        self._jobs  = int(jobs)
+      except ValueError:
+        output.Error('The "jobs" attribute must be a number: %s' % jobs)
+    if self._offset_file and not self._jobs:
+      self._jobs    = 1
     if self._path:
       self._path    = encoder.MaybeNarrowPath(self._path)
       if os.path.isfile(self._path):
@@ -1106,6 +1246,10 @@ class InputAccessLog:
   def ProduceURLs(self, consumer):
     """ Produces URLs from our data source, hands them in to the consumer. """
 
+    if self._jobs and self._path and not self._path.endswith('.gz'):
+      self.ProduceURLsInChunks(consumer)
+      return
+
     # Open the file
     (frame, file) = OpenFileForRead(self._path, 'ACCESSLOG')
     if not file:
@@ -1140,9 +1284,254 @@ class InputAccessLog:
     if frame:
       frame.close()
   #end def ProduceURLs
+
+  def ProduceURLsInChunks(self, consumer):
+    """
+    Produces URLs from a large log by mapping it into memory and handing
+    pieces of it, split on line boundaries, to a pool of worker
+    processes.  If there is an offset file, only the lines added since
+    the last run are read, and the URLs found in the older lines, with the
+    number of times each was seen, are replayed from the file next to it.
+    A partial line at the end of the log is left for the next run.
+    """
+    try:
+      file = open(self._path, 'rb')
+    except IOError:
+      output.Error('Can not open file: %s' % self._path)
+      return
+    output.Log('Opened ACCESSLOG file: %s' % self._path, 1)
+    inode = os.fstat(file.fileno())[stat.ST_INO]
+    size  = os.fstat(file.fileno())[stat.ST_SIZE]
+    if not size:
+      file.close()
+      return
+    data  = mmap.mmap(file.fileno(), size, access=mmap.ACCESS_READ)
+
+    # Pick up where the last run stopped, unless the log was replaced or
+    # truncated (even if it has grown again since), or the URLs read up
+    # to there were lost
+    start = 0
+    if self._offset_file:
+      offset = ReadAccessLogOffsets(self._offset_file).get(self._path)
+      if (offset and offset[0] == inode and offset[1] <= size
+          and offset[2] <= size
+          and offset[3] == AccessLogHead(data, offset[1])
+          and os.path.exists(self._offset_file + ACCESSLOG_URLS_SUFFIX)):
+        start = offset[1]
+        output.Log('Skipping %d bytes read by an earlier run.' % start, 2)
+      elif offset:
+        output.Log('ACCESSLOG file changed since the last run, reading'
+                   ' all of it: %s' % self._path, 1)
+    old_counts = {}
+    if start:
+      old_counts = ReadAccessLogURLs(self._offset_file).get(self._path, {})
+
+    # Find the format in the head of the file, then split the new lines
+    self.RecognizeFormat(data)
+    end = max(start, data.rfind('\n', start) + 1)
+    chunks = []
+    pos = start
+    while pos < end:
+      next = data.find('\n', min(pos + ACCESSLOG_CHUNK_BYTES, end) - 1) + 1
+      chunks.append((self, pos, next))
+      pos = next
+    if end > start:
+      self._offset = (inode, end, size, AccessLogHead(data, end))
+    data.close()
+    file.close()
+    counts = {}
+    if not (self._is_elf or self._is_clf):
+      chunks = []
+    output.Log('Reading %d bytes in %d chunks.' % (end - start, len(chunks)), 2)
+
+    # Results come back in the order of the chunks
+    pool = None
+    if (self._jobs > 1) and (len(chunks) > 1):
+      try:
+        import multiprocessing
+        pool = multiprocessing.Pool(min(self._jobs, len(chunks)))
+      except ImportError:
+        output.Warn('Reading access logs in one process, multiprocessing'
+                    ' is not available.')
+    if pool:
+      results = pool.imap(ScanAccessLogChunk, chunks)
+    else:
+      results = itertools.imap(ScanAccessLogChunk, chunks)
+    try:
+      for matches in results:
+        for match in matches:
+          counts[match] = counts.get(match, 0) + 1
+          url = URL()
+          url.TrySetAttribute('loc', match)
+          consumer(url, True)
+    finally:
+      if pool:
+        pool.terminate()
+
+    # Then the URLs from the lines read by earlier runs, as often as they
+    # were seen, so the output is the same as reading the whole log
+    if old_counts:
+      output.Log('Replaying %d URLs read by an earlier run.' %
+                 len(old_counts), 2)
+    for (loc, count) in old_counts.items():
+      for i in xrange(count):
+        url = URL()
+        url.TrySetAttribute('loc', loc)
+        consumer(url, True)
+      counts[loc] = counts.get(loc, 0) + count
+    if self._offset_file:
+      self._counts = counts
+  #end def ProduceURLsInChunks
+
+  def RecognizeFormat(self, data):
+    """ Try the lines at the start of the mapped log until one is
+    recognized """
+    pos = 0
+    while (not self._is_clf) and (not self._is_elf) and (pos < len(data)):
+      next = data.find('\n', pos)
+      if next < 0:
+        next = len(data)
+      line = data[pos:next]
+      if self._encoding:
+        line = encoder.WidenText(line, self._encoding)
+      line = line.strip()
+      self._is_elf = self.RecognizeELFLine(line)
+      self._is_clf = self.RecognizeCLFLine(line)
+      pos = next + 1
+  #end def RecognizeFormat
+
+  def ScanChunk(self, start, end):
+    """ Returns the URLs of the successful GET and HEAD requests in the
+    lines between two byte offsets of the log """
+    file = open(self._path, 'rb')
+    data = mmap.mmap(file.fileno(), end, access=mmap.ACCESS_READ)
+    matches = []
+    if self._is_clf:
+      for match in ACCESSLOG_CLF_CHUNK_PATTERN.finditer(data, start, end):
+        url = match.group(1)
+        if self._encoding:
+          url = encoder.WidenText(url, self._encoding)
+        matches.append(url)
+    elif self._is_elf:
+      for line in data[start:end].split('\n'):
+        if not ACCESSLOG_ELF_PREFILTER.search(line):
+          continue
+        if self._encoding:
+          line = encoder.WidenText(line, self._encoding)
+        match = self.GetELFLine(line.strip())
+        if match:
+          matches.append(match)
+    data.close()
+    file.close()
+    return matches
+  #end def ScanChunk
+
+  def SaveState(self):
+    """ Remember how far into the log this run read, and the URLs found
+    up to there """
+    if self._offset_file and self._offset:
+      urls = ReadAccessLogURLs(self._offset_file)
+      urls[self._path] = self._counts or {}
+      WriteAccessLogURLs(self._offset_file, urls)
+      offsets = ReadAccessLogOffsets(self._offset_file)
+      offsets[self._path] = self._offset
+      WriteAccessLogOffsets(self._offset_file, offsets)
+  #end def SaveState
 #end class InputAccessLog
 
 
+def ScanAccessLogChunk(args):
+  """ Worker process entry point, for InputAccessLog.ScanChunk """
+  (input, start, end) = args
+  return input.ScanChunk(start, end)
+#end def ScanAccessLogChunk
+
+
+def AccessLogHead(data, offset):
+  """ Returns a checksum of the start of a mapped access log, up to
+  ACCESSLOG_HEAD_BYTES but not past offset """
+  return md5.new(data[:min(offset, ACCESSLOG_HEAD_BYTES)]).hexdigest()
+#end def AccessLogHead
+
+
+def ReadAccessLogOffsets(path):
+  """ Returns a dictionary mapping access log paths to the (inode, offset,
+  size, head) they were read up to, from a file written by
+  WriteAccessLogOffsets.  The size is how big the log was then, and the
+  head is the AccessLogHead checksum of its start.  Lines in an older
+  format are left out, so those logs are read from the start. """
+  offsets = {}
+  try:
+    file = open(path, 'rt')
+  except IOError:
+    return offsets
+  for line in file.readlines():
+    fields = line.rstrip('\n').split(' ', 4)
+    if len(fields) == 5:
+      offsets[fields[4]] = (int(fields[0]), int(fields[1]), int(fields[2]),
+                            fields[3])
+  file.close()
+  return offsets
+#end def ReadAccessLogOffsets
+
+
+def WriteAccessLogOffsets(path, offsets):
+  """ Saves the offsets read by ReadAccessLogOffsets """
+  paths = offsets.keys()
+  paths.sort()
+  try:
+    file = open(path + '.tmp', 'wt')
+    for logpath in paths:
+      file.write('%d %d %d %s %s\n' % (offsets[logpath] + (logpath,)))
+    file.close()
+    os.rename(path + '.tmp', path)
+  except (IOError, OSError):
+    output.Error('Couldn\'t write out to file: %s' % path)
+#end def WriteAccessLogOffsets
+
+
+def ReadAccessLogURLs(path):
+  """ Returns a dictionary mapping access log paths to dictionaries of
+  the URLs found in them and how many times each was seen, from the file
+  next to the offset file at 'path' """
+  urls = {}
+  try:
+    file = open(path + ACCESSLOG_URLS_SUFFIX, 'rt')
+  except IOError:
+    return urls
+  for line in file.readlines():
+    fields = line.rstrip('\n').split('\t', 2)
+    if len(fields) == 3:
+      counts = urls.setdefault(fields[1], {})
+      counts[fields[2].decode(ENC_UTF8)] = int(fields[0])
+  file.close()
+  return urls
+#end def ReadAccessLogURLs
+
+
+def WriteAccessLogURLs(path, urls):
+  """ Saves the URLs read by ReadAccessLogURLs """
+  filename = path + ACCESSLOG_URLS_SUFFIX
+  logpaths = urls.keys()
+  logpaths.sort()
+  try:
+    file = open(filename + '.tmp', 'wt')
+    for logpath in logpaths:
+      locs = urls[logpath].keys()
+      locs.sort()
+      for loc in locs:
+        if type(loc) == types.UnicodeType:
+          text = loc.encode(ENC_UTF8)
+        else:
+          text = loc
+        file.write('%d\t%s\t%s\n' % (urls[logpath][loc], logpath, text))
+    file.close()
+    os.rename(filename + '.tmp', filename)
+  except (IOError, OSError):
+    output.Error('Couldn\'t write out to file: %s' % filename)
+#end def WriteAccessLogURLs
+
+
 class InputSitemap(xml.sax.handler.ContentHandler):
 
   """
@@ -1633,6 +2022,137 @@ class FilePathGenerator:
 #end class FilePathGenerator
 
 
+class RunMerger:
+  """
+  Reads the records from a set of sorted run files in order, by keeping
+  the next record from each file in a heap.
+  """
+
+  def __init__(self, files):
+    self._heap = []                         # (record, file) pairs
+    for file in files:
+      self._Push(file)
+  #end def __init__
+
+  def _Push(self, file):
+    """ Move the next record of the file onto the heap. """
+    try:
+      record = marshal.load(file)
+    except EOFError:
+      file.close()
+      return
+    heapq.heappush(self._heap, (record, file))
+  #end def _Push
+
+  def Next(self):
+    """ Returns the smallest record left, or None at the end. """
+    if not self._heap:
+      return None
+    (record, file) = heapq.heappop(self._heap)
+    self._Push(file)
+    return record
+  #end def Next
+#end class RunMerger
+
+
+class URLSorter:
+  """
+  Sorts a stream of URLs too large to hold in memory.  The URLs are
+  collected into runs of MAXURLS_PER_RUN, each of which is sorted and
+  written to a temporary file, and the runs are merged back together
+  when they are read.
+
+  The records are sorted by the same key URL.MakeHash uses, so all of
+  the sightings of a URL come out of the merge next to each other, in
+  the order they were added.  That lets the Sitemap find duplicates
+  without keeping a record of every URL it has seen.
+  """
+
+  def __init__(self):
+    self._run      = []                     # Records not yet written
+    self._files    = []                     # Temporary files of sorted runs
+    self._count    = 0                      # Sequence number of next URL
+  #end def __init__
+
+  def Add(self, url):
+    """ Adds the URL to the current run, spilling the run if it is full. """
+    key = url.loc
+    if key.endswith('/'):
+      key = key[:-1]
+    self._run.append((key, self._count, url.loc, url.lastmod,
+                      url.changefreq, url.priority))
+    self._count = self._count + 1
+    if len(self._run) >= MAXURLS_PER_RUN:
+      self._SpillRun()
+  #end def Add
+
+  def _SpillRun(self):
+    """ Sort the current run and write it to a temporary file. """
+    self._run.sort()
+    output.Log('Writing sorted run of %d URLs to a temporary file.' %
+               len(self._run), 2)
+    self._files.append(self._WriteRun(self._run))
+    self._run = []
+  #end def _SpillRun
+
+  def _WriteRun(self, records):
+    """ Write the sorted records to a new temporary file. """
+    file = tempfile.TemporaryFile()
+    for record in records:
+      marshal.dump(record, file)
+    file.seek(0)
+    return file
+  #end def _WriteRun
+
+  def Merge(self):
+    """
+    Returns a RunMerger over everything added so far.  If there are too
+    many runs to keep them all open, groups of them are merged into
+    longer runs first.
+    """
+    if self._run:
+      self._SpillRun()
+    files = self._files
+    self._files = []
+    while len(files) > MAXRUNS_PER_MERGE:
+      merger = RunMerger(files[:MAXRUNS_PER_MERGE])
+      merged = tempfile.TemporaryFile()
+      record = merger.Next()
+      while record is not None:
+        marshal.dump(record, merged)
+        record = merger.Next()
+      merged.seek(0)
+      files = files[MAXRUNS_PER_MERGE:] + [merged]
+    return RunMerger(files)
+  #end def Merge
+#end class URLSorter
+
+
+class DigestFile:
+  """ A write-only file that keeps an MD5 digest of what is written """
+
+  def __init__(self):
+    self._md5 = md5.new()
+  #end def __init__
+
+  def write(self, text):
+    self._md5.update(text)
+  #end def write
+
+  def digest(self):
+    return self._md5.digest()
+  #end def digest
+#end class DigestFile
+
+
+def URLFromRecord(record):
+  """ Rebuild a URL from the (loc, lastmod, changefreq, priority) record. """
+  url = URL()
+  (url.loc, url.lastmod, url.changefreq, url.priority) = record
+  return url
+#end def URLFromRecord
+
+
 class PerURLStatistics:
   """ Keep track of some simple per-URL statistics, like file extension. """
 
@@ -1699,8 +2219,9 @@ class Sitemap(xml.sax.handler.ContentHandler):
     xml.sax.handler.ContentHandler.__init__(self)
     self._filters      = []                  # Filter objects
     self._inputs       = []                  # Input objects
-    self._urls         = {}                  # Maps URLs to count of dups
+    self._urls         = {}                  # Maps keys in set to dup counts
     self._set          = []                  # Current set of URLs
+    self._written      = []                  # Sorted key arrays, one per file
     self._filegen      = None                # Path generator for output files
     self._wildurl1     = None                # Sitemap URLs to filter out
     self._wildurl2     = None                # Sitemap URLs to filter out
@@ -1715,6 +2236,15 @@ class Sitemap(xml.sax.handler.ContentHandler):
     self._base_url     = None                # Prefix to all valid URLs
     self._store_into   = None                # Output filepath
     self._suppress     = suppress_notify     # Suppress notify of servers
+    self._external     = False               # Sort URLs on disk?
+    self._sorter       = None                # URLSorter for external sorts
+    self._state_file   = None                # Where incremental state is kept
+    self._state        = None                # (shards, urls) state to save
+    self._lastmods     = {}                  # Maps file number to lastmod
+    self._unchanged    = False               # Were no files rewritten?
+    self._write_jobs   = 0                   # Threads writing Sitemap files
+    self._writer       = None                # ThreadPool of those threads
+    self._writes       = []                  # (filename, result) in progress
   #end def __init__
 
   def ValidateBasicConfig(self):
@@ -1754,6 +2284,15 @@ class Sitemap(xml.sax.handler.ContentHandler):
       self._wildurl2 = self._filegen.GenerateURL(SITEINDEX_SUFFIX,
                                                  self._base_url)
 
+    # Count the writer threads
+    if all_good and self._write_jobs:
+      try:
+        self._write_jobs = int(self._write_jobs)
+      except ValueError:
+        output.Error('The "write_jobs" attribute must be a number: %s' %
+                     self._write_jobs)
+        all_good = False
+
     # Unify various forms of False
     if all_good:
       if self._suppress:
@@ -1761,6 +2300,18 @@ class Sitemap(xml.sax.handler.ContentHandler):
                                  == types.UnicodeType):
           if (self._suppress == '0') or (self._suppress.lower() == 'false'):
             self._suppress = False
+      if self._external:
+        if (type(self._external) == types.StringType) or (type(self._external)
+                                 == types.UnicodeType):
+          if (self._external == '0') or (self._external.lower() == 'false'):
+            self._external = False
+      if self._external and self._state_file:
+        output.Warn('The "external_sort" attribute is ignored when there is a'
+                    ' "state_file".')
+        self._external = False
+      if self._external:
+        output.Log('Sorting URLs on disk to save memory.', 2)
+        self._sorter = URLSorter()
 
     # Done
     if not all_good:
@@ -1775,18 +2326,35 @@ class Sitemap(xml.sax.handler.ContentHandler):
       input.ProduceURLs(self.ConsumeURL)
 
     # Do last flushes
+    if self._sorter:
+      self.FlushSorted()
+    if self._state_file:
+      self.FlushIncremental()
     if len(self._set):
       self.FlushSet()
     if not self._sitemaps:
       output.Warn('No URLs were recorded, writing an empty sitemap.')
       self.FlushSet()
 
+    # The index and state can only be written after all of the files
+    self.FinishWrites(close=True)
+
     # Write an index as needed
     if self._sitemaps > 1:
       self.WriteIndex()
 
-    # Notify
-    self.NotifySearch()
+    # Now the output is safe, remember what was read and written
+    for input in self._inputs:
+      if hasattr(input, 'SaveState'):
+        input.SaveState()
+    if self._state:
+      WriteSitemapState(self._state_file, self._store_into, self._state)
+
+    # Notify, unless an incremental run found nothing new to tell
+    if self._unchanged:
+      output.Log('No Sitemap files changed, not notifying search engines.', 1)
+    else:
+      self.NotifySearch()
 
     # Dump stats
     self._stat.Log()
@@ -1820,26 +2388,33 @@ class Sitemap(xml.sax.handler.ContentHandler):
       url.Log(prefix='IGNORED (output file)', level=2)
       return
 
+    # Duplicates are found when the sorted URLs are merged
+    if self._sorter:
+      self._sorter.Add(url)
+      url.Log()
+      return
+
     # Note the sighting
-    hash = url.MakeHash()
-    if self._urls.has_key(hash):
-      dup = self._urls[hash]
-      if dup > 0:
-        dup = dup + 1
-        self._urls[hash] = dup
-        if self._dup_max < dup:
-          self._dup_max = dup
+    key = url.MakeKey()
+    if self._urls.has_key(key):
+      dup = self._urls[key] + 1
+      self._urls[key] = dup
+      if self._dup_max < dup:
+        self._dup_max = dup
+      url.Log(prefix='DUPLICATE')
+      return
+    if self.IsWritten(key):
       url.Log(prefix='DUPLICATE')
       return
 
     # Acceptance -- add to set
-    self._urls[hash] = 1
+    self._urls[key] = 1
     self._set.append(url)
     self._stat.Consume(url)
     url.Log()
 
     # Flush the set if needed
-    if len(self._set) >= MAXURLS_PER_SITEMAP:
+    if len(self._set) >= MAXURLS_PER_SITEMAP and not self._state_file:
       self.FlushSet()
   #end def ConsumeURL
 
@@ -1854,51 +2429,222 @@ class Sitemap(xml.sax.handler.ContentHandler):
     output.Log('Sorting and normalizing collected URLs.', 1)
     self._set.sort()
     for url in self._set:
-      hash = url.MakeHash()
-      dup = self._urls[hash]
-      if dup > 0:
-        self._urls[hash] = -1
-        if not url.priority:
-          url.priority = '%.4f' % (float(dup) / float(self._dup_max))
+      if not url.priority:
+        dup = self._urls[url.MakeKey()]
+        url.priority = '%.4f' % (float(dup) / float(self._dup_max))
+
+    # Write and flush
+    self.WriteSitemapFile(self._set)
+    self._set = []
+
+    # Only remember that the URLs were written, not their counts
+    keys = self._urls.keys()
+    keys.sort()
+    self._written.append(array.array(KEY_TYPECODE, keys))
+    self._urls = {}
+  #end def FlushSet
+
+  def IsWritten(self, key):
+    """ Has a URL with this key already been written to a Sitemap file? """
+    for written in self._written:
+      i = bisect.bisect_left(written, key)
+      if i < len(written) and written[i] == key:
+        return True
+    return False
+  #end def IsWritten
+
+  def FlushSorted(self):
+    """
+    Flush the URLs collected by an external sort to the output.  The
+    sorted runs are merged twice.  The first pass counts the duplicates
+    of each URL, which sit next to each other in the merge, and writes
+    out one record per URL.  Once the highest duplicate count is known,
+    the second pass reads those records back and writes them out as
+    Sitemap files.  Only one Sitemap file's worth of URLs is in memory
+    at a time.
+    """
+    output.Log('Merging sorted URLs.', 1)
+    merger = self._sorter.Merge()
+    self._sorter = None
+    unique = tempfile.TemporaryFile()
+    last = None
+    dup = 0
+    record = merger.Next()
+    while record is not None:
+      if record[0] != last:
+        if last is not None:
+          marshal.dump((dup, first), unique)
+        last = record[0]
+        first = record[2:]
+        dup = 1
+      else:
+        dup = dup + 1
+        if self._dup_max < dup:
+          self._dup_max = dup
+        URLFromRecord(record[2:]).Log(prefix='DUPLICATE')
+      record = merger.Next()
+    if last is not None:
+      marshal.dump((dup, first), unique)
+    unique.seek(0)
+
+    output.Log('Normalizing sorted URLs.', 1)
+    urls = []
+    while True:
+      try:
+        (dup, record) = marshal.load(unique)
+      except EOFError:
+        break
+      url = URLFromRecord(record)
+      if not url.priority:
+        url.priority = '%.4f' % (float(dup) / float(self._dup_max))
+      self._stat.Consume(url)
+      urls.append(url)
+      if len(urls) >= MAXURLS_PER_SITEMAP:
+        self.WriteSitemapFile(urls)
+        urls = []
+    unique.close()
+    if urls:
+      self.WriteSitemapFile(urls)
+  #end def FlushSorted
+
+  def FlushIncremental(self):
+    """
+    Flush all of the URLs to the output, rewriting only the Sitemap files
+    whose contents changed since the last run.  The state file remembers
+    which file each URL went into, so URLs stay in the same file from run
+    to run and adding or removing a page only changes the file it is in.
+    New URLs fill the files with room first.
+    """
+    (old_shards, old_urls) = ReadSitemapState(self._state_file,
+                                              self._store_into)
+    if not self._set:
+      output.Warn('No URLs were recorded, writing an empty sitemap.')
+
+    # Put each URL back in its old file, or aside if it is new
+    output.Log('Assigning %d URLs to Sitemap files.' % len(self._set), 1)
+    shards = []
+    for i in range(len(old_shards)):
+      shards.append([])
+    new  = []
+    urls = {}
+    for url in self._set:
+      key = url.MakeKey()
+      if not url.priority:
+        url.priority = '%.4f' % (float(self._urls[key]) /
+                                 float(self._dup_max))
+      shard = old_urls.get(key)
+      if shard is None or shard >= len(shards):
+        new.append(url)
+      else:
+        shards[shard].append(url)
+        urls[key] = shard
+    self._set = []
 
+    # Fill in the gaps with the new URLs
+    new.sort()
+    shard = 0
+    for url in new:
+      while shard < len(shards) and len(shards[shard]) >= MAXURLS_PER_SITEMAP:
+        shard = shard + 1
+      if shard == len(shards):
+        shards.append([])
+      shards[shard].append(url)
+      urls[url.MakeKey()] = shard
+    while len(shards) > 1 and not shards[-1]:
+      del shards[-1]
+    if not shards:
+      shards.append([])
+
+    # Write the files that are different
+    now = TimestampISO8601(time.time())
+    state_shards = []
+    changed = len(shards) != len(old_shards)
+    for i in range(len(shards)):
+      shards[i].sort()
+      digest = DigestFile()
+      for url in shards[i]:
+        url.WriteXML(digest)
+      digest = digest.digest()
+      filename = self._filegen.GeneratePath(i)
+      if i < len(old_shards) and old_shards[i][0] == digest:
+        # The contents have not changed, even if the file has to be
+        # written again because it was removed
+        lastmod = old_shards[i][1]
+        if os.path.isfile(filename):
+          self._sitemaps = self._sitemaps + 1
+          output.Log('Sitemap file "%s" is unchanged.' % filename, 2)
+        else:
+          self.WriteSitemapFile(shards[i])
+      else:
+        lastmod = now
+        changed = True
+        self.WriteSitemapFile(shards[i])
+      self._lastmods[i] = lastmod
+      state_shards.append((digest, lastmod))
+
+    # Remove the files left over from when there were more of them
+    i = len(shards)
+    while (i < len(old_shards)
+           or os.path.isfile(self._filegen.GeneratePath(i))):
+      filename = self._filegen.GeneratePath(i)
+      if os.path.isfile(filename):
+        output.Log('Removing unused Sitemap file "%s"' % filename, 1)
+        os.remove(filename)
+      i = i + 1
+    if len(shards) == 1:
+      filename = self._filegen.GeneratePath(SITEINDEX_SUFFIX)
+      if os.path.isfile(filename):
+        output.Log('Removing unused index file "%s"' % filename, 1)
+        os.remove(filename)
+
+    self._unchanged = not changed
+    self._state     = (state_shards, urls)
+  #end def FlushIncremental
+
+  def WriteSitemapFile(self, urls):
+    """ Write the URLs, which must already be sorted, to a Sitemap file """
     # Get the filename we're going to write to
     filename = self._filegen.GeneratePath(self._sitemaps)
     if not filename:
       output.Fatal('Unexpected: Couldn\'t generate output filename.')
     self._sitemaps = self._sitemaps + 1
     output.Log('Writing Sitemap file "%s" with %d URLs' %
-        (filename, len(self._set)), 1)
-
-    # Write to it
-    frame = None
-    file  = None
-
-    try:
-      if self._filegen.is_gzip:
-        basename = os.path.basename(filename);
-        frame = open(filename, 'wb')
-        file = gzip.GzipFile(fileobj=frame, filename=basename, mode='wt')
-      else:
-        file = open(filename, 'wt')
+        (filename, len(urls)), 1)
 
-      file.write(SITEMAP_HEADER)
-      for url in self._set:
-        url.WriteXML(file)
-      file.write(SITEMAP_FOOTER)
-
-      file.close()
-      if frame:
-        frame.close()
-
-      frame = None
-      file  = None
-    except IOError:
+    # Hand it to a writer thread, if there are any, so the caller can go
+    # on collecting URLs while the file is written and compressed
+    if self._write_jobs and not self._writer:
+      try:
+        from multiprocessing.pool import ThreadPool
+        self._writer = ThreadPool(self._write_jobs)
+      except ImportError:
+        output.Warn('Writing Sitemap files in one thread, multiprocessing'
+                    ' is not available.')
+        self._write_jobs = 0
+    if self._writer:
+      self.FinishWrites(self._write_jobs - 1)
+      result = self._writer.apply_async(WriteSitemapURLs,
+                                        (filename, urls,
+                                         self._filegen.is_gzip))
+      self._writes.append((filename, result))
+    elif not WriteSitemapURLs(filename, urls, self._filegen.is_gzip):
       output.Fatal('Couldn\'t write out to file: %s' % filename)
-    os.chmod(filename, 0644)
+  #end def WriteSitemapFile
 
-    # Flush
-    self._set = []
-  #end def FlushSet
+  def FinishWrites(self, limit=0, close=False):
+    """
+    Wait until no more than 'limit' Sitemap files are being written.
+    With 'close', also stop the writer threads once they are done.
+    """
+    while len(self._writes) > limit:
+      (filename, result) = self._writes.pop(0)
+      if not result.get():
+        output.Fatal('Couldn\'t write out to file: %s' % filename)
+    if close and self._writer:
+      self._writer.close()
+      self._writer.join()
+      self._writer = None
+  #end def FinishWrites
 
   def WriteIndex(self):
     """ Write the master index of all Sitemap files """
@@ -1906,11 +2652,14 @@ class Sitemap(xml.sax.handler.ContentHandler):
     filename = self._filegen.GeneratePath(SITEINDEX_SUFFIX)
     if not filename:
       output.Fatal('Unexpected: Couldn\'t generate output index filename.')
+    if self._unchanged and os.path.isfile(filename):
+      output.Log('Index file "%s" is unchanged.' % filename, 1)
+      return
     output.Log('Writing index file "%s" with %d Sitemaps' %
         (filename, self._sitemaps), 1)
 
     # Make a lastmod time
-    lastmod = TimestampISO8601(time.time())
+    now = TimestampISO8601(time.time())
 
     # Write to it
     try:
@@ -1920,6 +2669,7 @@ class Sitemap(xml.sax.handler.ContentHandler):
       for mapnumber in range(0,self._sitemaps):
         # Write the entry
         mapurl = self._filegen.GenerateURL(mapnumber, self._base_url)
+        lastmod = self._lastmods.get(mapnumber, now)
         mapattributes = { 'loc' : mapurl, 'lastmod' : lastmod }
         fd.write(SITEINDEX_ENTRY % mapattributes)
 
@@ -2002,7 +2752,8 @@ class Sitemap(xml.sax.handler.ContentHandler):
 
         if not ValidateAttributes('SITE', attributes,
           ('verbose', 'default_encoding', 'base_url', 'store_into',
-           'suppress_search_engine_notify')):
+           'suppress_search_engine_notify', 'external_sort',
+           'state_file', 'write_jobs')):
           return
 
         verbose           = attributes.get('verbose', 0)
@@ -2012,6 +2763,9 @@ class Sitemap(xml.sax.handler.ContentHandler):
         self._default_enc = attributes.get('default_encoding')
         self._base_url    = attributes.get('base_url')
         self._store_into  = attributes.get('store_into')
+        self._external    = attributes.get('external_sort', False)
+        self._state_file  = attributes.get('state_file')
+        self._write_jobs  = attributes.get('write_jobs', 0)
         if not self._suppress:
           self._suppress  = attributes.get('suppress_search_engine_notify',
                                             False)
@@ -2129,6 +2883,76 @@ def OpenFileForRead(path, logtext):
   return (frame, file)
 #end def OpenFileForRead
 
+def WriteSitemapURLs(filename, urls, is_gzip):
+  """ Writes the URLs to a Sitemap file.  Returns False if the file could
+  not be written.  This is called from the writer threads, so it must not
+  stop the program itself. """
+  frame = None
+  file  = None
+
+  try:
+    if is_gzip:
+      basename = os.path.basename(filename);
+      frame = open(filename, 'wb')
+      file = gzip.GzipFile(fileobj=frame, filename=basename, mode='wt')
+    else:
+      file = open(filename, 'wt')
+
+    file.write(SITEMAP_HEADER)
+    for url in urls:
+      url.WriteXML(file)
+    file.write(SITEMAP_FOOTER)
+
+    file.close()
+    if frame:
+      frame.close()
+
+    frame = None
+    file  = None
+  except IOError:
+    return False
+  os.chmod(filename, 0644)
+  return True
+#end def WriteSitemapURLs
+
+def ReadSitemapState(path, store_into):
+  """
+  Returns the (shards, urls) saved by WriteSitemapState, or empty state
+  if there is none or it was written for a different output.  shards is
+  a list of (digest, lastmod) pairs, one per Sitemap file, and urls maps
+  the key of each URL to the number of the file holding it.
+  """
+  try:
+    file = open(path, 'rb')
+  except IOError:
+    return ([], {})
+  try:
+    try:
+      (version, saved_store_into, shards, urls) = marshal.load(file)
+    except (EOFError, ValueError, TypeError):
+      output.Warn('Ignoring unreadable state file: %s' % path)
+      return ([], {})
+  finally:
+    file.close()
+  if version != SITEMAP_STATE_VERSION or saved_store_into != store_into:
+    return ([], {})
+  output.Log('Read state of %d Sitemap files from: %s' % (len(shards), path),
+             2)
+  return (shards, urls)
+#end def ReadSitemapState
+
+def WriteSitemapState(path, store_into, state):
+  """ Saves the (shards, urls) state for ReadSitemapState """
+  (shards, urls) = state
+  try:
+    file = open(path + '.tmp', 'wb')
+    marshal.dump((SITEMAP_STATE_VERSION, store_into, shards, urls), file)
+    file.close()
+    os.rename(path + '.tmp', path)
+  except (IOError, OSError):
+    output.Error('Couldn\'t write out to file: %s' % path)
+#end def WriteSitemapState
+
 def TimestampISO8601(t):
   """Seconds since epoch (1970-01-01) --> ISO 8601 time string."""
   return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
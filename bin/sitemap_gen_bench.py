@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Measure the memory sitemap_gen.py uses per URL.
+
+Usage: python sitemap_gen_bench.py [--urls=N] [--duplicates=PCT] [--external]
+                                   [--write-jobs=N]
+
+A synthetic site of N URLs (1,000,000 by default) is fed through a
+Sitemap, with PCT percent (10 by default) of the sightings repeating
+an earlier URL, and the Sitemap files are written to a temporary
+directory.  The growth in peak resident memory and the size of the
+structure used to find duplicates are reported in bytes per URL.
+"""
+
+import optparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sitemap_gen
+
+BASE_URL = 'http://example.com/'
+
+
+class SyntheticInput:
+  """ Produces URLs shaped like the ones for a documentation site """
+
+  def __init__(self, count, duplicates):
+    self._count      = count
+    self._duplicates = duplicates
+  #end def __init__
+
+  def ProduceURLs(self, consumer):
+    unique = 0
+    for i in xrange(self._count):
+      if unique and (i * 7919) % 100 < self._duplicates:
+        n = (i * 104729) % unique
+      else:
+        n = unique
+        unique = unique + 1
+      url = sitemap_gen.URL()
+      url.loc = '%smodule%d/section%d/page%d.html' % (
+        BASE_URL, n % 1000, (n // 1000) % 100, n)
+      url.lastmod = '2011-%02d-%02dT12:00:00Z' % (1 + n % 12, 1 + n % 28)
+      consumer(url, False)
+  #end def ProduceURLs
+#end class SyntheticInput
+
+
+def DeepSize(obj):
+  """ Returns the size of a container and the objects directly in it """
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    for key, value in obj.iteritems():
+      size = size + sys.getsizeof(key) + sys.getsizeof(value)
+  elif isinstance(obj, list):
+    for item in obj:
+      size = size + sys.getsizeof(item)
+  return size
+#end def DeepSize
+
+
+def MaxRSS():
+  """ Returns the peak resident memory of the process in bytes """
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin':
+    return rss
+  return rss * 1024
+#end def MaxRSS
+
+
+def main():
+  parser = optparse.OptionParser(usage=__doc__.strip())
+  parser.add_option('--urls', type='int', default=1000000)
+  parser.add_option('--duplicates', type='int', default=10)
+  parser.add_option('--external', action='store_true', default=False)
+  parser.add_option('--write-jobs', type='int', default=0)
+  (options, args) = parser.parse_args()
+
+  outdir = tempfile.mkdtemp()
+  try:
+    sitemap_gen.output.SetVerbose(0)
+    sitemap = sitemap_gen.Sitemap(True)
+    sitemap._base_url   = BASE_URL
+    sitemap._store_into = os.path.join(outdir, 'sitemap.xml.gz')
+    sitemap._external   = options.external
+    sitemap._write_jobs = options.write_jobs
+    if not sitemap.ValidateBasicConfig():
+      return 1
+    sitemap._inputs.append(SyntheticInput(options.urls, options.duplicates))
+
+    before = MaxRSS()
+    start = time.time()
+    sitemap.Generate()
+    elapsed = time.time() - start
+    after = MaxRSS()
+
+    index = DeepSize(sitemap._urls) + DeepSize(getattr(sitemap, '_written', []))
+    print '%d URLs in %d Sitemap files, %.1f seconds' % (
+      options.urls, sitemap._sitemaps, elapsed)
+    print 'peak memory growth: %7.1f bytes per URL' % (
+      float(after - before) / options.urls)
+    print 'duplicate index:    %7.1f bytes per URL' % (
+      float(index) / options.urls)
+  finally:
+    shutil.rmtree(outdir)
+  return 0
+#end def main
+
+
+if __name__ == '__main__':
+  sys.exit(main())
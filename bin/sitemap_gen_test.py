@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Tests for sitemap_gen.py.
+
+Usage: python sitemap_gen_test.py
+"""
+
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sitemap_gen
+
+BASE_URL = 'http://example.com/'
+
+
+class ListInput:
+  """ Produces one URL for each page number given """
+
+  def __init__(self, pages):
+    self._pages = pages
+  #end def __init__
+
+  def ProduceURLs(self, consumer):
+    for n in self._pages:
+      url = sitemap_gen.URL()
+      url.loc = '%spage%d.html' % (BASE_URL, n)
+      consumer(url, False)
+  #end def ProduceURLs
+#end class ListInput
+
+
+class SitemapTestCase(unittest.TestCase):
+  """ Writes the Sitemap files to a temporary directory """
+
+  def setUp(self):
+    sitemap_gen.output.SetVerbose(0)
+    self._outdir  = tempfile.mkdtemp()
+    self._maxurls = sitemap_gen.MAXURLS_PER_SITEMAP
+    sitemap_gen.MAXURLS_PER_SITEMAP = 10
+  #end def setUp
+
+  def tearDown(self):
+    sitemap_gen.MAXURLS_PER_SITEMAP = self._maxurls
+    shutil.rmtree(self._outdir)
+  #end def tearDown
+
+  def Generate(self, pages, write_jobs=0, incremental=False):
+    sitemap = sitemap_gen.Sitemap(True)
+    sitemap._base_url   = BASE_URL
+    sitemap._store_into = os.path.join(self._outdir, 'sitemap.xml')
+    sitemap._write_jobs = write_jobs
+    if incremental:
+      sitemap._state_file = os.path.join(self._outdir, 'sitemap.state')
+    self.assertTrue(sitemap.ValidateBasicConfig())
+    sitemap._inputs.append(ListInput(pages))
+    sitemap.Generate()
+    return sitemap
+  #end def Generate
+
+  def SitemapFiles(self):
+    files = glob.glob(os.path.join(self._outdir, 'sitemap*.xml'))
+    return sorted(os.path.basename(f) for f in files)
+  #end def SitemapFiles
+#end class SitemapTestCase
+
+
+class WriteJobsTest(SitemapTestCase):
+
+  def testOneWriteJob(self):
+    sitemap = self.Generate(range(35), write_jobs='1')
+    self.assertEqual(sitemap._sitemaps, 4)
+    self.assertEqual(sitemap._writer, None)
+    self.assertEqual(len(self.SitemapFiles()), 5)  # Four files and the index
+  #end def testOneWriteJob
+
+  def testSeveralWriteJobs(self):
+    sitemap = self.Generate(range(35), write_jobs='3')
+    self.assertEqual(sitemap._sitemaps, 4)
+    self.assertEqual(sitemap._writer, None)
+  #end def testSeveralWriteJobs
+#end class WriteJobsTest
+
+
+class IncrementalTest(SitemapTestCase):
+
+  def testMissingFilesKeepLastmod(self):
+    first = self.Generate(range(35), incremental=True)
+    for filename in self.SitemapFiles():
+      os.remove(os.path.join(self._outdir, filename))
+    second = self.Generate(range(35), incremental=True)
+    self.assertTrue(second._unchanged)
+    self.assertEqual(second._lastmods, first._lastmods)
+    self.assertEqual(len(self.SitemapFiles()), 5)
+  #end def testMissingFilesKeepLastmod
+
+  def testFewerFilesRemovesStale(self):
+    # URLs stay in the files they were first written to, and these
+    # pages sort into the first two
+    self.Generate(range(35), incremental=True)
+    self.Generate([0, 1, 2] + range(10, 27), incremental=True)
+    self.assertEqual(self.SitemapFiles(),
+                     ['sitemap.xml', 'sitemap1.xml', 'sitemap_index.xml'])
+    self.Generate([0, 1] + range(10, 18), incremental=True)
+    self.assertEqual(self.SitemapFiles(), ['sitemap.xml'])
+  #end def testFewerFilesRemovesStale
+
+  def testUnchangedDoesNotNotify(self):
+    notified = []
+    original = sitemap_gen.Sitemap.NotifySearch
+    sitemap_gen.Sitemap.NotifySearch = lambda sitemap: notified.append(sitemap)
+    try:
+      first  = self.Generate(range(35), incremental=True)
+      second = self.Generate(range(35), incremental=True)
+      third  = self.Generate(range(36), incremental=True)
+    finally:
+      sitemap_gen.Sitemap.NotifySearch = original
+    self.assertTrue(second._unchanged)
+    self.assertEqual(notified, [first, third])
+  #end def testUnchangedDoesNotNotify
+#end class IncrementalTest
+
+
+class AccessLogTest(SitemapTestCase):
+
+  def WriteLog(self, filename, pages):
+    log = open(os.path.join(self._outdir, filename), 'at')
+    for n in pages:
+      log.write('127.0.0.1 - - [01/Jan/2011:00:00:00 +0000] '
+                '"GET /page%d.html HTTP/1.1" 200 100\n' % n)
+    log.close()
+  #end def WriteLog
+
+  def GenerateFromLog(self, filename, attributes):
+    attributes = dict(attributes, path=os.path.join(self._outdir, filename))
+    sitemap = sitemap_gen.Sitemap(True)
+    sitemap._base_url   = BASE_URL
+    sitemap._store_into = os.path.join(self._outdir, 'sitemap.xml')
+    self.assertTrue(sitemap.ValidateBasicConfig())
+    sitemap._inputs.append(sitemap_gen.InputAccessLog(attributes))
+    sitemap.Generate()
+    return open(sitemap._store_into).read()
+  #end def GenerateFromLog
+
+  def testOffsetFileKeepsEarlierURLs(self):
+    offsets = {'offset_file': os.path.join(self._outdir, 'offsets')}
+    self.WriteLog('incremental.log', [1, 2, 2, 3, 3, 3])
+    self.GenerateFromLog('incremental.log', offsets)
+    self.WriteLog('incremental.log', [4, 1, 1, 1])
+    incremental = self.GenerateFromLog('incremental.log', offsets)
+    self.WriteLog('full.log', [1, 2, 2, 3, 3, 3, 4, 1, 1, 1])
+    full = self.GenerateFromLog('full.log', {})
+    self.assertEqual(incremental, full)
+    self.assertTrue('page4.html' in full)
+  #end def testOffsetFileKeepsEarlierURLs
+
+  def testTruncatedLogIsReadAgain(self):
+    # As logrotate's copytruncate leaves it, grown past the old offset
+    offsets = {'offset_file': os.path.join(self._outdir, 'offsets')}
+    self.WriteLog('rotated.log', [1, 2, 3])
+    self.GenerateFromLog('rotated.log', offsets)
+    open(os.path.join(self._outdir, 'rotated.log'), 'w').close()
+    self.WriteLog('rotated.log', [5, 6, 6, 7, 7, 7])
+    rotated = self.GenerateFromLog('rotated.log', offsets)
+    self.WriteLog('full.log', [5, 6, 6, 7, 7, 7])
+    full = self.GenerateFromLog('full.log', {})
+    self.assertEqual(rotated, full)
+    self.assertFalse('page1.html' in rotated)
+  #end def testTruncatedLogIsReadAgain
+
+  def testMissingURLsFileReadsWholeLog(self):
+    offsets = {'offset_file': os.path.join(self._outdir, 'offsets')}
+    self.WriteLog('incremental.log', [1, 2, 2, 3, 3, 3])
+    self.GenerateFromLog('incremental.log', offsets)
+    os.remove(offsets['offset_file'] + sitemap_gen.ACCESSLOG_URLS_SUFFIX)
+    self.WriteLog('incremental.log', [4, 1, 1, 1])
+    incremental = self.GenerateFromLog('incremental.log', offsets)
+    self.WriteLog('full.log', [1, 2, 2, 3, 3, 3, 4, 1, 1, 1])
+    full = self.GenerateFromLog('full.log', {})
+    self.assertEqual(incremental, full)
+  #end def testMissingURLsFileReadsWholeLog
+#end class AccessLogTest
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,9 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Helpers for the tasks in pavement.py.
+
+The pieces that need to be importable from worker processes, or that
+are big enough to clutter the pavement file, live here.
+"""
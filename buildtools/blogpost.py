@@ -0,0 +1,181 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Pull the title and intro paragraph out of a rendered page for a blog post.
+
+The page is fed to an incremental HTML parser a piece at a time, and
+reading stops as soon as the first <h1> and the first <p> have been
+seen, so only the top of each page is read. Links in the intro are
+replaced with <span> tags as the paragraph is copied.
+"""
+
+from __future__ import absolute_import
+
+import HTMLParser
+import os
+
+# How much of the page to read at a time
+CHUNK_SIZE = 8192
+
+# Tags that never have an end tag
+VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'hr', 'img', 'input',
+                       'link', 'meta', 'param'])
+
+POST_TEMPLATE = '''%(intro)s
+<p><a href="%(canonical_url)s">Read more...</a></p>
+'''
+
+
+class IntroParser(HTMLParser.HTMLParser):
+    """Find the text of the first <h1> and the HTML of the first <p>.
+
+    Only the text directly inside the <h1> is kept, so the permalink
+    Sphinx adds to headings is left out.
+    """
+
+    def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.title = None
+        self.intro = None
+        # Set while inside the heading or paragraph we want
+        self._title_parts = None
+        self._title_depth = 0
+        self._title_join = False
+        self._intro_parts = None
+        self._intro_depth = 0
+
+    @property
+    def done(self):
+        return self.title is not None and self.intro is not None
+
+    def handle_starttag(self, tag, attrs):
+        if self._title_parts is not None:
+            if tag not in VOID_TAGS:
+                self._title_depth += 1
+            self._title_join = False
+        elif tag == 'h1' and self.title is None:
+            self._title_parts = []
+            self._title_depth = 0
+            self._title_join = False
+
+        if self._intro_parts is not None:
+            if tag == 'a':
+                self._intro_parts.append('<span>')
+            else:
+                self._intro_parts.append(self.get_starttag_text())
+            if tag not in VOID_TAGS:
+                self._intro_depth += 1
+        elif tag == 'p' and self.intro is None:
+            self._intro_parts = [self.get_starttag_text()]
+            self._intro_depth = 0
+
+    def handle_startendtag(self, tag, attrs):
+        if self._title_parts is not None:
+            self._title_join = False
+        if self._intro_parts is not None:
+            self._intro_parts.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self._title_parts is not None:
+            if self._title_depth:
+                self._title_depth -= 1
+                self._title_join = False
+            elif tag == 'h1':
+                self.title = ' '.join(self._title_parts)
+                self._title_parts = None
+
+        if self._intro_parts is not None:
+            if tag in VOID_TAGS:
+                return
+            if tag == 'a':
+                self._intro_parts.append('</span>')
+            else:
+                self._intro_parts.append('</%s>' % tag)
+            if self._intro_depth:
+                self._intro_depth -= 1
+            elif tag == 'p':
+                self.intro = ''.join(self._intro_parts)
+                self._intro_parts = None
+
+    def _text(self, text):
+        if self._title_parts is not None and not self._title_depth:
+            if self._title_join:
+                self._title_parts[-1] += text
+            else:
+                self._title_parts.append(text)
+                self._title_join = True
+        if self._intro_parts is not None:
+            self._intro_parts.append(text)
+
+    def handle_data(self, data):
+        self._text(data)
+
+    def handle_entityref(self, name):
+        self._text('&%s;' % name)
+
+    def handle_charref(self, name):
+        self._text('&#%s;' % name)
+
+
+def extract(filename, chunk_size=CHUNK_SIZE):
+    """Return the title and intro paragraph of the HTML page in filename.
+
+    Raises ValueError if the page does not have both.
+    """
+    parser = IntroParser()
+    with open(filename, 'rb') as f:
+        while not parser.done:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                parser.close()
+                break
+            parser.feed(chunk)
+    if not parser.done:
+        raise ValueError('Could not find the title and intro paragraph in %s'
+                         % filename)
+    return parser.title, parser.intro
+
+
+def canonical_url(url_base, input_base):
+    """Return the address of the page on the web site."""
+    url = 'http://www.doughellmann.com/' + url_base
+    if not url.endswith('/'):
+        url += '/'
+    if input_base != 'index.html':
+        url += input_base
+    return url
+
+
+def write_post(input_file, blog_file, url_base, input_base='index.html'):
+    """Write the blog post body for the page in input_file to blog_file.
+
+    Returns the title of the page.
+    """
+    title, intro = extract(input_file)
+    body = POST_TEMPLATE % {'intro': intro,
+                            'canonical_url': canonical_url(url_base,
+                                                           input_base),
+                            }
+    with open(blog_file, 'wb') as f:
+        f.write(body)
+    return title
+
+
+def write_all_posts(outdir, url_prefix, blog_base):
+    """Write a blog post body next to every module's index.html under outdir.
+
+    Returns the number of posts written.
+    """
+    count = 0
+    for dirpath, dirnames, filenames in os.walk(outdir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('_'))
+        if dirpath == outdir or 'index.html' not in filenames:
+            continue
+        relpath = os.path.relpath(dirpath, outdir).replace(os.sep, '/')
+        write_post(os.path.join(dirpath, 'index.html'),
+                   os.path.join(dirpath, blog_base),
+                   url_prefix + '/' + relpath,
+                   )
+        count += 1
+    return count
@@ -0,0 +1,266 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Time the stages of the build and keep a history of the results.
+
+Each stage is a paver task run in a scratch copy of the source tree,
+so the results do not depend on what is left over from the last
+build in the working tree and the working tree is not changed. The
+copy holds either a fixed subset of the modules or all of them. The
+copy leaves out build output and saved state (doctrees, the cog
+cache, the dependency graph), so every run starts cold.
+
+For each stage the wall time, the CPU time and the peak memory of
+the paver process and everything it waited for are recorded, along
+with the number of files it created or changed in the copy. The
+results are added to a JSON history file, and compared with the
+baseline saved there.
+"""
+
+from __future__ import absolute_import
+
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Bump this when the format of the saved history changes.
+HISTORY_FORMAT = 2
+
+# Files and directories left out of the scratch copy wherever they are
+IGNORE = ['.git', '.hg', '*.pyc']
+
+# Build output and saved state left out of the scratch copy, relative
+# to the top of the tree
+IGNORE_PATHS = ['web', 'blog_posts', 'sphinx/doctrees', 'sphinx/cogcache',
+                'sphinx/depgraph.json', 'sphinx/cogtimes.*',
+                'sphinx/tabcheck.json', 'sphinx/sitemap_gen.state',
+                'sphinx/publish_manifest.json', 'sphinx/benchmark.*',
+                '%(project)s/docs.pack', '%(project)s/docs.index',
+                '%(project)s/docs',
+                ]
+
+# The measurements compared with the baseline
+MEASUREMENTS = ['wall', 'cpu', 'maxrss']
+
+
+def copy_tree(src, dest, project, modules=None):
+    """Copy the source tree for a build from src to dest.
+
+    With modules, only those module directories of the project are
+    copied, along with the other files at the top of the project.
+    """
+    paths = [p % {'project':project} for p in IGNORE_PATHS]
+    def ignore(dirname, names):
+        ignored = set()
+        for pattern in IGNORE:
+            ignored.update(fnmatch.filter(names, pattern))
+        reldir = os.path.relpath(dirname, src)
+        for name in names:
+            relname = os.path.normpath(os.path.join(reldir, name))
+            if any(fnmatch.fnmatch(relname, p) for p in paths):
+                ignored.add(name)
+        if modules is not None and os.path.abspath(dirname) == project_dir:
+            ignored.update(n for n in names
+                           if os.path.isdir(os.path.join(dirname, n))
+                           and n not in modules)
+        return ignored
+    project_dir = os.path.abspath(os.path.join(src, project))
+    shutil.copytree(src, dest, ignore=ignore)
+    return
+
+
+def _snapshot(root):
+    """Return the modification time of every file under root."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            fullname = os.path.join(dirpath, name)
+            try:
+                files[fullname] = os.path.getmtime(fullname)
+            except OSError:
+                pass
+    return files
+
+
+def run_stage(workdir, task, log):
+    """Run a paver task in workdir and measure it.
+
+    The output of the task goes to the open file log. Returns a
+    dictionary with the measurements and the exit status.
+    """
+    before = _snapshot(workdir)
+    cmd = [sys.executable, '-c', 'import paver.tasks; paver.tasks.main()', task]
+    start = time.time()
+    proc = subprocess.Popen(cmd, cwd=workdir, stdout=log,
+                            stderr=subprocess.STDOUT)
+    # wait4() reports the resources used by the paver process and
+    # every process it waited for, and nothing else.
+    pid, status, usage = os.wait4(proc.pid, 0)
+    wall = time.time() - start
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+    after = _snapshot(workdir)
+    maxrss = usage.ru_maxrss
+    if sys.platform != 'darwin':
+        # Linux reports kilobytes, Mac OS X bytes
+        maxrss *= 1024
+    return {'wall':wall,
+            'cpu':usage.ru_utime + usage.ru_stime,
+            'maxrss':maxrss,
+            'files':sum(1 for name, mtime in after.items()
+                        if before.get(name) != mtime),
+            'status':proc.returncode,
+            }
+
+
+def load_history(filename):
+    """Return the saved history, or an empty one."""
+    if os.path.exists(filename):
+        with open(filename, 'rt') as f:
+            data = json.load(f)
+        if data.get('format') == HISTORY_FORMAT:
+            return data
+    return {'format':HISTORY_FORMAT, 'baseline':{}, 'runs':[]}
+
+
+def save_history(filename, history):
+    """Write the history to its file."""
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wt') as f:
+        json.dump(history, f, indent=1, sort_keys=True)
+    os.rename(tmpname, filename)
+    return
+
+
+def compare(result, baseline, threshold):
+    """Return descriptions of the measurements that regressed.
+
+    A measurement has regressed when it is more than threshold (a
+    fraction, 0.1 for 10%) above the baseline.
+    """
+    regressions = []
+    for name in MEASUREMENTS:
+        old = baseline.get(name)
+        new = result.get(name)
+        if old and new > old * (1 + threshold):
+            regressions.append('%s %s -> %s (+%.0f%%)' % (
+                name, format_value(name, old), format_value(name, new),
+                (new - old) * 100.0 / old))
+    return regressions
+
+
+def format_value(name, value):
+    """Return the measurement as text."""
+    if name == 'maxrss':
+        return '%.1fMB' % (value / (1024.0 * 1024.0))
+    if name in ('wall', 'cpu'):
+        return '%.1fs' % value
+    return str(value)
+
+
+def baseline_key(key, scope, modules):
+    """Return the key of the baseline for the results of a stage.
+
+    A run is only compared with a baseline from the same host, and
+    for the subset scope, with the same modules.
+    """
+    parts = [key, platform.node()]
+    if scope == 'subset':
+        parts.append(','.join(sorted(modules or [])))
+    return ' '.join(parts)
+
+
+def run(src, project, stages, scopes, modules, history_file, threshold,
+        log, set_baseline=False):
+    """Run the stages for each scope and record the results.
+
+    scopes is a list containing 'subset' (just the modules) and/or
+    'full' (the whole tree). The stages for a scope run one after the
+    other in the same copy, the way a build would run them. The
+    results are saved as the baseline if set_baseline is true or
+    there is no baseline for them yet. Baselines are kept separately
+    for each host and set of modules (see baseline_key()).
+
+    The output of the stages is written to the open file log.
+    Returns the results of this run, keyed by "<stage>/<scope>", and
+    a list of problems (stages that failed or regressed).
+    """
+    history = load_history(history_file)
+    results = {}
+    problems = []
+    for scope in scopes:
+        workdir = tempfile.mkdtemp(prefix='benchmark-')
+        try:
+            tree = os.path.join(workdir, 'src')
+            copy_tree(src, tree, project,
+                      modules if scope == 'subset' else None)
+            for stage in stages:
+                key = '%s/%s' % (stage, scope)
+                print 'benchmark %s' % key
+                log.write('---> benchmark %s\n' % key)
+                log.flush()
+                result = run_stage(tree, stage, log)
+                results[key] = result
+                if result['status']:
+                    problems.append('%s failed with status %s'
+                                    % (key, result['status']))
+                    continue
+                base_key = baseline_key(key, scope, modules)
+                baseline = history['baseline'].get(base_key)
+                if baseline is None or set_baseline:
+                    history['baseline'][base_key] = result
+                    continue
+                regressions = compare(result, baseline, threshold)
+                if regressions:
+                    problems.append('%s regressed: %s'
+                                    % (key, ', '.join(regressions)))
+        finally:
+            shutil.rmtree(workdir)
+    history['runs'].append({
+        'date':datetime.datetime.now().isoformat(),
+        'host':platform.node(),
+        'python':platform.python_version(),
+        'modules':modules,
+        'results':results,
+        })
+    save_history(history_file, history)
+    return results, problems
+
+
+def format_report(results, history_file, modules):
+    """Return a table of the results, compared with the baseline."""
+    baseline = load_history(history_file)['baseline']
+    lines = ['%-16s %8s %8s %9s %6s %8s' % ('stage', 'wall', 'cpu',
+                                            'memory', 'files', 'vs base')]
+    for key in sorted(results):
+        result = results[key]
+        base = baseline.get(baseline_key(key, key.split('/')[-1], modules))
+        if result['status']:
+            change = 'failed'
+        elif base and base.get('wall'):
+            change = '%+.0f%%' % ((result['wall'] - base['wall']) * 100.0
+                                  / base['wall'])
+        else:
+            change = ''
+        lines.append('%-16s %8s %8s %9s %6d %8s' % (
+            key,
+            format_value('wall', result['wall']),
+            format_value('cpu', result['cpu']),
+            format_value('maxrss', result['maxrss']),
+            result['files'],
+            change,
+            ))
+    return '\n'.join(lines)
@@ -0,0 +1,293 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Run cog over the rst sources, optionally in several processes.
+"""
+
+from __future__ import absolute_import
+
+import functools
+import multiprocessing
+import os
+import sys
+import traceback
+from cStringIO import StringIO
+
+from paver.cog import Cog
+from paver.doctools import Includer, _cogsh
+from paver.easy import BuildFailure
+
+from buildtools import runscript, scheduler, timings
+from buildtools.scriptcache import ScriptCache
+
+
+def _configure_cog(settings):
+    """Return a Cog with the markers and include() from the settings."""
+    c = Cog()
+    if settings.get('uncog'):
+        c.options.bNoGenerate = True
+    c.options.bReplace = True
+    c.options.bDeleteCode = settings.get('delete_code', False)
+    includedir = settings.get('includedir')
+    if includedir:
+        include = Includer(includedir, cog=c,
+                           include_markers=settings.get('include_markers'))
+        # load cog's namespace with our convenience functions.
+        c.options.defines['include'] = include
+        c.options.defines['sh'] = _cogsh(c)
+    c.sBeginSpec = settings.get('beginspec', '[[[cog')
+    c.sEndSpec = settings.get('endspec', ']]]')
+    c.sEndOutput = settings.get('endoutput', '[[[end]]]')
+    return c
+
+
+def new_cog(settings):
+    """Return a Cog instance configured from the settings dictionary.
+
+    The settings are a plain dictionary instead of the paver options
+    so they can be passed to worker processes.
+
+    The run_script() function seen by the cog blocks runs the examples
+    with the executor named in the settings ('subprocess' or 'fork'),
+    stopping any that run longer than example_timeout seconds. With
+    background_jobs set, the executor is wrapped by a
+    ScheduledExecutor (see schedule_slow_examples()). When a cache_dir
+    is given, it replays cached output for examples that have not
+    changed. Each example that is run is timed. The executor, cache
+    and timer are available as the executor, script_cache and timer
+    attributes of the new object. Call finish_cog() when done with it.
+    """
+    c = _configure_cog(settings)
+
+    if settings.get('executor') == 'fork':
+        c.executor = runscript.ForkServerExecutor(
+            verify=settings.get('verify_fork_server', False))
+    else:
+        c.executor = runscript.SubprocessExecutor()
+    timeout = settings.get('example_timeout') or None
+    if settings.get('background_jobs'):
+        c.executor = scheduler.ScheduledExecutor(
+            c.executor,
+            settings['background_jobs'],
+            timeout=timeout,
+            slow=settings.get('slow_example', 1.0),
+            previous=timings.load_times(_report_base(settings) + '.json'),
+            )
+    c.timer = timings.ExampleTimer()
+    run_script = functools.partial(runscript.run_script,
+                                   executor=c.executor,
+                                   timer=c.timer,
+                                   timeout=timeout,
+                                   )
+
+    c.script_cache = None
+    cache_dir = settings.get('cache_dir')
+    if cache_dir:
+        c.script_cache = ScriptCache(cache_dir,
+                                     read=settings.get('use_cache', True))
+        run_script = c.script_cache.wrap(run_script)
+    c.options.defines['run_script'] = run_script
+    return c
+
+
+def find_calls(settings, files):
+    """Return the run_script() calls made by the cog blocks in files.
+
+    The blocks are evaluated with a run_script() that records its
+    arguments instead of running anything, so this is quick. Each call
+    is returned as (input_file, script_name, interpreter, kwds). Files
+    whose blocks fail are skipped, since cogging them for real will
+    report the error.
+    """
+    calls = []
+    def record(input_file, script_name, interpreter='python', **kwds):
+        calls.append((input_file, script_name, interpreter, kwds))
+        return ''
+    # Each Cog installs its own "cog" module for the blocks to import,
+    # so put back the one used by the real run when we are done.
+    cog_module = sys.modules.get('cog')
+    try:
+        c = _configure_cog(settings)
+        c.options.defines['run_script'] = record
+        c.options.defines['sh'] = lambda *args, **kwds: ''
+        for f in files:
+            try:
+                with open(f, 'rt') as fobj:
+                    c.processString(fobj.read(), fname=f)
+            except Exception:
+                continue
+    finally:
+        if cog_module is not None:
+            sys.modules['cog'] = cog_module
+    return calls
+
+
+def schedule_slow_examples(c, settings, files):
+    """Start the slow examples used by files in the background.
+
+    Does nothing unless c was made with background_jobs set. Documents
+    with the output of every example in the cache are left alone,
+    since they will not be run. Every example in any other document
+    is run (see ScriptCache.wrap()), so they are all scheduled.
+    """
+    if not isinstance(c.executor, scheduler.ScheduledExecutor):
+        return
+    calls = find_calls(settings, files)
+    if c.script_cache is not None:
+        cache = c.script_cache
+        run_files = set(call[0] for call in calls
+                        if not cache.contains(cache.key(*call)))
+        calls = [call for call in calls if call[0] in run_files]
+    c.executor.schedule(calls)
+    return
+
+
+def finish_cog(c):
+    """Shut down the executor and return the statistics for the run.
+
+    The statistics are a dictionary with the cache 'hits' and
+    'misses' and the example 'timings', suitable for report().
+    """
+    c.executor.report()
+    c.executor.close()
+    stats = {'hits':0, 'misses':0, 'timings':c.timer.entries}
+    if c.script_cache is not None:
+        stats['hits'] = c.script_cache.hits
+        stats['misses'] = c.script_cache.misses
+    return stats
+
+
+def merge_stats(all_stats):
+    """Combine the statistics from several finish_cog() calls."""
+    merged = {'hits':0, 'misses':0, 'timings':[]}
+    for stats in all_stats:
+        merged['hits'] += stats['hits']
+        merged['misses'] += stats['misses']
+        merged['timings'].extend(stats['timings'])
+    return merged
+
+
+def _report_base(settings):
+    """Return the timing report filename without the extension."""
+    return os.path.splitext(settings.get('timing_report') or '')[0]
+
+
+def report(settings, stats):
+    """Report on a cog run.
+
+    Adds the times to the timing report, if one is configured, and
+    raises BuildFailure if any example run this time took longer than
+    the time_budget.
+    """
+    if stats['hits'] or stats['misses']:
+        print 'cog cache: %d hits, %d misses' % (stats['hits'], stats['misses'])
+    entries = stats['timings']
+    base = _report_base(settings)
+    if base and entries:
+        all_entries = timings.merge_entries(
+            timings.load_report(base + '.json'), entries)
+        timings.write_report(all_entries, base + '.json', base + '.txt',
+                             top=settings.get('timing_report_top', 20))
+        print 'cog: timed %d examples, report in %s.txt' % (len(entries), base)
+    budget = settings.get('time_budget')
+    slow = timings.over_budget(entries, budget)
+    if slow:
+        print 'cog: %d examples took longer than %.1f seconds:' % (len(slow), budget)
+        for entry in sorted(slow, key=lambda e: e['wall'], reverse=True):
+            print '  ' + timings.format_entry(entry)
+        raise BuildFailure('%d examples went over the time budget' % len(slow))
+    return
+
+
+def group_by_directory(files):
+    """Group the files by the directory containing them.
+
+    Examples in the same directory may share data files or write
+    output next to themselves, so they are never run concurrently.
+    Returns a list of (dirname, [filenames]) pairs sorted by dirname,
+    with the files kept in the order they were given.
+    """
+    groups = {}
+    for f in files:
+        groups.setdefault(os.path.dirname(f), []).append(f)
+    return sorted(groups.items())
+
+
+def _cog_group(args):
+    """Worker function: cog all of the files in one directory.
+
+    Returns (dirname, log_text, error_text, stats). The error text is
+    None if every file was processed successfully.
+    """
+    settings, dirname, files = args
+    log = StringIO()
+    real_stdout = sys.stdout
+    sys.stdout = log
+    error = None
+    stats = {'hits':0, 'misses':0, 'timings':[]}
+    try:
+        try:
+            # Cog remembers sys.stdout when it is created, so build
+            # it after the output is redirected.
+            c = new_cog(settings)
+            try:
+                schedule_slow_examples(c, settings, files)
+                for f in files:
+                    print 'cog %s' % f
+                    c.processOneFile(f)
+            finally:
+                stats = finish_cog(c)
+        except Exception:
+            error = traceback.format_exc()
+    finally:
+        sys.stdout = real_stdout
+    return (dirname, log.getvalue(), error, stats)
+
+
+def cog_parallel(settings, files, jobs):
+    """Cog the files using a pool of worker processes.
+
+    Each module directory is handled by a single worker. The
+    directories whose examples took longest in the last timing report
+    are started first, so a slow directory does not end up running
+    alone at the end of the build. The log output from each directory
+    is printed as a unit, in the order the directories were started,
+    so the output of a run does not depend on how the work was
+    scheduled.
+    """
+    groups = group_by_directory(str(f) for f in files)
+    if not groups:
+        return
+    previous = timings.load_times(_report_base(settings) + '.json')
+    cost = {}
+    for (input_file, command), wall in previous.items():
+        dirname = os.path.dirname(input_file)
+        cost[dirname] = cost.get(dirname, 0) + wall
+    # Directories that have not been timed go first, since they could
+    # be slow.
+    groups.sort(key=lambda g: -cost.get(g[0], float('inf')))
+    pool = multiprocessing.Pool(min(jobs, len(groups)))
+    failures = []
+    all_stats = []
+    try:
+        work = [(settings, dirname, group_files)
+                for dirname, group_files in groups]
+        # imap returns the results in the order of the inputs, even
+        # when the workers finish in a different order.
+        for dirname, log_text, error, stats in pool.imap(_cog_group, work):
+            sys.stdout.write(log_text)
+            if error:
+                sys.stdout.write(error)
+                failures.append(dirname)
+            all_stats.append(stats)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    report(settings, merge_stats(all_stats))
+    if failures:
+        raise BuildFailure('cog failed in %s' % ', '.join(failures))
+    return
@@ -0,0 +1,225 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Publish a built tree by sending only the files whose contents changed.
+
+Sphinx rewrites every output file on each build, so comparing sizes
+and timestamps (as rsync does by default) finds everything different.
+Instead, a manifest with the hash and size of each file is saved when
+the tree is published, and the next publish sends only the files whose
+hash is new and removes the ones that are gone. The first publish to
+a target, and a full publish, make the whole target match the tree
+instead, removing anything else found there.
+
+Sending to a remote target uses rsync's --delete-missing-args option,
+which needs rsync 3.1 or later on both ends.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+
+from paver.easy import BuildFailure
+
+# Bump this to make the next publish send everything.
+MANIFEST_FORMAT = 1
+
+
+def hash_file(filename, blocksize=65536):
+    """Return the SHA-1 hex digest of the contents of filename."""
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_manifest(root):
+    """Return a manifest for the files under root.
+
+    The manifest maps the path of each file, relative to root and
+    using '/' as the separator, to a [digest, size] pair.
+    """
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            filename = os.path.join(dirpath, name)
+            relname = os.path.relpath(filename, root).replace(os.sep, '/')
+            manifest[relname] = [hash_file(filename),
+                                 os.path.getsize(filename)]
+    return manifest
+
+
+def load_manifest(filename, target):
+    """Return the manifest saved when target was last published.
+
+    An empty manifest is returned if there is none, or if the saved
+    one was for a different target, so everything is sent.
+    """
+    try:
+        with open(filename, 'rt') as f:
+            saved = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if saved.get('format') != MANIFEST_FORMAT or saved.get('target') != target:
+        return {}
+    return saved.get('files', {})
+
+
+def save_manifest(manifest, filename, target):
+    """Save the manifest of the tree just published to target."""
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(filename + '.tmp', 'wt') as f:
+        json.dump({'format':MANIFEST_FORMAT,
+                   'target':target,
+                   'files':manifest,
+                   },
+                  f, indent=1, sort_keys=True)
+    os.rename(filename + '.tmp', filename)
+    return
+
+
+def compare(old, new):
+    """Return the (changed, removed) filenames between two manifests.
+
+    Files are changed if they are new or their digest differs.
+    """
+    changed = sorted(name for name, (digest, size) in new.items()
+                     if name not in old or old[name][0] != digest)
+    removed = sorted(name for name in old if name not in new)
+    return changed, removed
+
+
+def is_remote(target):
+    """Is target an rsync-style host:path destination?"""
+    if ':' not in target:
+        return False
+    return '/' not in target.split(':', 1)[0]
+
+
+def list_files(root):
+    """Return the paths of the files under root, relative to root and
+    using '/' as the separator.
+    """
+    names = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            filename = os.path.join(dirpath, name)
+            names.append(os.path.relpath(filename, root).replace(os.sep, '/'))
+    return names
+
+
+def copy_local(root, target, changed, removed):
+    """Update the target directory from root."""
+    for name in changed:
+        dest = os.path.join(target, name)
+        dirname = os.path.dirname(dest)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        shutil.copy2(os.path.join(root, name), dest)
+    for name in removed:
+        dest = os.path.join(target, name)
+        if os.path.exists(dest):
+            os.remove(dest)
+        # Clean up the directories that are now empty, like
+        # rsync --delete would.
+        dirname = os.path.dirname(dest)
+        while (dirname != target.rstrip(os.sep)
+               and os.path.isdir(dirname)
+               and not os.listdir(dirname)):
+            os.rmdir(dirname)
+            dirname = os.path.dirname(dirname)
+    return
+
+
+def rsync_remote(root, target, changed, removed):
+    """Update the host:path target from root using rsync.
+
+    Only the listed files are sent. The removed ones are listed too,
+    and rsync deletes them from the target because they are missing
+    from root. Directories left empty on the target are removed by the
+    next full publish.
+    """
+    with tempfile.NamedTemporaryFile(mode='wt', suffix='.txt') as files_from:
+        for name in changed + removed:
+            files_from.write(name + '\n')
+        files_from.flush()
+        cmd = ['rsync', '--archive', '--verbose',
+               '--files-from=' + files_from.name,
+               '--delete-missing-args',
+               '.', target,
+               ]
+        if subprocess.call(cmd, cwd=root):
+            raise BuildFailure('rsync to %s failed' % target)
+    return
+
+
+def rsync_tree(root, target):
+    """Make the host:path target match root using rsync, deleting
+    everything on the target that is not under root.
+    """
+    cmd = ['rsync', '--archive', '--delete', '--verbose', '.', target]
+    if subprocess.call(cmd, cwd=root):
+        raise BuildFailure('rsync to %s failed' % target)
+    return
+
+
+def publish(root, target, manifest_file, full=False):
+    """Send the files under root that changed since the last publish.
+
+    target is a local directory or an rsync host:path. With full set,
+    or when there is no saved manifest for target, every file is sent
+    and anything on the target that is not under root is removed. The
+    manifest is only saved once the target has been updated. Returns
+    a dictionary with the number of 'files', 'changed' and 'removed'
+    files, the bytes 'sent', and the 'total' bytes a full sync would
+    send. The files removed from a remote target by a full sync are
+    not counted.
+    """
+    old = {}
+    if not full:
+        old = load_manifest(manifest_file, target)
+    new = build_manifest(root)
+    changed, removed = compare(old, new)
+    if not old:
+        if is_remote(target):
+            rsync_tree(root, target)
+        else:
+            if os.path.isdir(target):
+                removed = sorted(name for name in list_files(target)
+                                 if name not in new)
+            copy_local(root, target, changed, removed)
+    elif changed or removed:
+        if is_remote(target):
+            rsync_remote(root, target, changed, removed)
+        else:
+            copy_local(root, target, changed, removed)
+    save_manifest(new, manifest_file, target)
+    return {'files':len(new),
+            'changed':len(changed),
+            'removed':len(removed),
+            'sent':sum(new[name][1] for name in changed),
+            'total':sum(size for digest, size in new.values()),
+            }
+
+
+def format_report(stats):
+    """Describe the result of publish() for the build log."""
+    saved = stats['total'] - stats['sent']
+    percent = 100.0 * saved / (stats['total'] or 1)
+    return ('publish: sent %d of %d files (%d bytes), removed %d; '
+            'a full sync would send %d bytes, saved %d (%.1f%%)'
+            % (stats['changed'], stats['files'], stats['sent'],
+               stats['removed'], stats['total'], saved, percent))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Tests for deltapublish.py.
+
+Usage: python deltapublish_test.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from buildtools import deltapublish
+
+
+def write_file(filename, text):
+    dirname = os.path.dirname(filename)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    with open(filename, 'wt') as f:
+        f.write(text)
+    return
+
+
+class CompareTest(unittest.TestCase):
+
+    def test_compare(self):
+        old = {'same.html':['aaa', 3],
+               'edited.html':['bbb', 3],
+               'gone.html':['ccc', 3],
+               }
+        new = {'same.html':['aaa', 3],
+               'edited.html':['ddd', 3],
+               'added.html':['eee', 3],
+               }
+        self.assertEqual(deltapublish.compare(old, new),
+                         (['added.html', 'edited.html'], ['gone.html']))
+
+    def test_compare_empty(self):
+        new = {'b.html':['aaa', 3], 'a.html':['bbb', 3]}
+        self.assertEqual(deltapublish.compare({}, new),
+                         (['a.html', 'b.html'], []))
+
+    def test_is_remote(self):
+        self.assertTrue(deltapublish.is_remote('host:/var/www'))
+        self.assertTrue(deltapublish.is_remote('user@host:www'))
+        self.assertFalse(deltapublish.is_remote('/var/www'))
+        self.assertFalse(deltapublish.is_remote('./dir:name'))
+
+
+class PublishTest(unittest.TestCase):
+    """Publishes a small tree to a local directory."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'built')
+        self.target = os.path.join(self.tmpdir, 'site')
+        self.manifest_file = os.path.join(self.tmpdir, 'manifest.json')
+        write_file(os.path.join(self.root, 'index.html'), 'index\n')
+        write_file(os.path.join(self.root, 'atexit', 'index.html'), 'atexit\n')
+        write_file(os.path.join(self.root, 'glob', 'index.html'), 'glob\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def publish(self, full=False):
+        return deltapublish.publish(self.root, self.target,
+                                    self.manifest_file, full)
+
+    def target_files(self):
+        return sorted(deltapublish.list_files(self.target))
+
+    def test_first_publish_sends_everything(self):
+        write_file(os.path.join(self.target, 'stale', 'old.html'), 'old\n')
+        stats = self.publish()
+        self.assertEqual(self.target_files(),
+                         ['atexit/index.html', 'glob/index.html', 'index.html'])
+        self.assertFalse(os.path.exists(os.path.join(self.target, 'stale')))
+        self.assertEqual((stats['files'], stats['changed'], stats['removed']),
+                         (3, 3, 1))
+        self.assertEqual(stats['sent'], stats['total'])
+
+    def test_unchanged_sends_nothing(self):
+        self.publish()
+        # Rewritten with the same contents, as sphinx does.
+        write_file(os.path.join(self.root, 'index.html'), 'index\n')
+        stats = self.publish()
+        self.assertEqual((stats['changed'], stats['removed'], stats['sent']),
+                         (0, 0, 0))
+
+    def test_changed_and_removed_files(self):
+        self.publish()
+        write_file(os.path.join(self.root, 'index.html'), 'new index\n')
+        shutil.rmtree(os.path.join(self.root, 'glob'))
+        stats = self.publish()
+        self.assertEqual((stats['changed'], stats['removed']), (1, 1))
+        self.assertEqual(self.target_files(),
+                         ['atexit/index.html', 'index.html'])
+        # The directory left empty is removed as well.
+        self.assertFalse(os.path.exists(os.path.join(self.target, 'glob')))
+        with open(os.path.join(self.target, 'index.html'), 'rt') as f:
+            self.assertEqual(f.read(), 'new index\n')
+
+    def test_full_publish_removes_extra_files(self):
+        self.publish()
+        write_file(os.path.join(self.target, 'extra.html'), 'extra\n')
+        self.publish()
+        self.assertTrue('extra.html' in self.target_files())
+        stats = self.publish(full=True)
+        self.assertEqual(self.target_files(),
+                         ['atexit/index.html', 'glob/index.html', 'index.html'])
+        self.assertEqual((stats['changed'], stats['removed']), (3, 1))
+
+    def test_manifest_for_other_target_is_ignored(self):
+        self.publish()
+        other = os.path.join(self.tmpdir, 'other')
+        stats = deltapublish.publish(self.root, other, self.manifest_file)
+        self.assertEqual(stats['changed'], 3)
+        self.assertEqual(sorted(deltapublish.list_files(other)),
+                         self.target_files())
+
+
+if __name__ == '__main__':
+    unittest.main()
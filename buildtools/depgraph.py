@@ -0,0 +1,129 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Track which files each rst document depends on.
+
+The dependencies come from the cog blocks (``include()`` and
+``run_script()`` calls) and from the ``include`` and
+``literalinclude`` directives. The graph is saved with the size and
+modification time of every file so finding the documents that need
+to be rebuilt is just a stat() of each dependency.
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import re
+
+from buildtools.scriptcache import referenced_files
+
+# Bump this when the format of the saved graph changes.
+GRAPH_FORMAT = 1
+
+_cog_include = re.compile(r'''\binclude\(\s*['"]([^'"]+)['"]''')
+_run_script = re.compile(r'''\brun_script\(\s*cog\.inFile\s*,\s*(\[[^\]]*\]|'[^']*'|"[^"]*")''')
+_server = re.compile(r'''\bserver\s*=\s*('[^']*'|"[^"]*")''')
+_directive = re.compile(r'^\s*\.\.\s+(?:literal)?include::\s*(\S+)', re.MULTILINE)
+
+
+def file_signature(filename):
+    """Return the (mtime, size) of the file, or None if it is missing."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def find_dependencies(rst_filename, includedir):
+    """Return the set of files the rst document depends on.
+
+    The document itself is always included, so edits to the rst
+    cause it to be rescanned and rebuilt.
+    """
+    rundir = os.path.dirname(rst_filename)
+    with open(rst_filename, 'rt') as f:
+        body = f.read()
+    deps = set([rst_filename])
+    for name in _cog_include.findall(body):
+        deps.add(os.path.normpath(os.path.join(includedir, name)))
+    for name in _directive.findall(body):
+        deps.add(os.path.normpath(os.path.join(rundir, name)))
+    for command in _run_script.findall(body) + _server.findall(body):
+        # Covers the script (or the server run with it), its
+        # arguments, and the data files and helper modules named in
+        # the scripts themselves.
+        for name in referenced_files(rundir, command):
+            deps.add(os.path.join(rundir, name))
+    return deps
+
+
+class DependencyGraph(object):
+    """Map rst documents to the files they depend on.
+    """
+
+    def __init__(self, filename, includedir):
+        self.filename = filename
+        self.includedir = includedir
+        self.documents = {}
+        if os.path.exists(filename):
+            with open(filename, 'rt') as f:
+                data = json.load(f)
+            if data.get('format') == GRAPH_FORMAT:
+                self.documents = data['documents']
+
+    def save(self):
+        """Write the graph to its file."""
+        dirname = os.path.dirname(self.filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmpname = self.filename + '.tmp'
+        with open(tmpname, 'wt') as f:
+            json.dump({'format':GRAPH_FORMAT,
+                       'documents':self.documents,
+                       },
+                      f, indent=1, sort_keys=True)
+        os.rename(tmpname, self.filename)
+        return
+
+    def changed_dependencies(self, rst_filename):
+        """Return the dependencies of the document that have changed.
+
+        Documents that are not in the graph yet are treated as having
+        changed themselves.
+        """
+        deps = self.documents.get(rst_filename)
+        if deps is None:
+            return [rst_filename]
+        return sorted(name for name, signature in deps.items()
+                      if file_signature(name) != signature)
+
+    def outdated(self, rst_filenames):
+        """Return a dictionary mapping outdated documents to the changes.
+        """
+        outdated = {}
+        for rst_filename in rst_filenames:
+            changes = self.changed_dependencies(rst_filename)
+            if changes:
+                outdated[rst_filename] = changes
+        return outdated
+
+    def users_of(self, filename):
+        """Return the documents that depend on the file."""
+        return sorted(rst_filename
+                      for rst_filename, deps in self.documents.items()
+                      if filename in deps)
+
+    def update(self, rst_filename):
+        """Rescan the document and record the current state of its deps.
+
+        Call this after the document has been cogged, since cog
+        changes the rst file.
+        """
+        self.documents[rst_filename] = dict(
+            (name, file_signature(name))
+            for name in find_dependencies(rst_filename, self.includedir)
+            )
+        return
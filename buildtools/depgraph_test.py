@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Tests for depgraph.py.
+
+Usage: python depgraph_test.py
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from buildtools import depgraph
+
+DOCUMENT = """
+.. include:: shown.py
+    :literal:
+
+.. literalinclude:: other.py
+
+.. {{{cog
+.. cog.out(include('common.txt'))
+.. cog.out(run_script(cog.inFile, 'example.py'))
+.. cog.out(run_script(cog.inFile, 'client.py', server='server.py'))
+.. }}}
+.. {{{end}}}
+"""
+
+
+def write_file(filename, text):
+    with open(filename, 'wt') as f:
+        f.write(text)
+    return
+
+
+class DependencyTestCase(unittest.TestCase):
+    """Creates a module directory with one document using every kind
+    of dependency.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.includedir = os.path.join(self.tmpdir, 'include')
+        self.rundir = os.path.join(self.tmpdir, 'module')
+        os.mkdir(self.includedir)
+        os.mkdir(self.rundir)
+        self.rst = os.path.join(self.rundir, 'index.rst')
+        write_file(self.rst, DOCUMENT)
+        write_file(os.path.join(self.includedir, 'common.txt'), 'common\n')
+        for name in ('shown.py', 'other.py', 'client.py', 'server.py',
+                     'unused.py'):
+            write_file(self.path(name), 'pass\n')
+        write_file(self.path('example.py'), "print open('data.txt').read()\n")
+        write_file(self.path('data.txt'), 'data\n')
+        self.graph_file = os.path.join(self.tmpdir, 'graph.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.rundir, name)
+
+    def graph(self):
+        return depgraph.DependencyGraph(self.graph_file, self.includedir)
+
+
+class FindDependenciesTest(DependencyTestCase):
+
+    def test_dependencies(self):
+        deps = depgraph.find_dependencies(self.rst, self.includedir)
+        expected = set([self.rst,
+                        os.path.join(self.includedir, 'common.txt'),
+                        ] + [self.path(name)
+                             for name in ('shown.py', 'other.py', 'example.py',
+                                          'data.txt', 'client.py', 'server.py')
+                             ])
+        self.assertEqual(deps, expected)
+
+
+class InvalidationTest(DependencyTestCase):
+
+    def setUp(self):
+        super(InvalidationTest, self).setUp()
+        graph = self.graph()
+        graph.update(self.rst)
+        graph.save()
+
+    def test_unchanged(self):
+        self.assertEqual(self.graph().outdated([self.rst]), {})
+
+    def test_new_document(self):
+        other = self.path('other.rst')
+        write_file(other, 'no examples\n')
+        self.assertEqual(self.graph().outdated([self.rst, other]),
+                         {other:[other]})
+
+    def test_changed_data_file(self):
+        write_file(self.path('data.txt'), 'different data\n')
+        self.assertEqual(self.graph().outdated([self.rst]),
+                         {self.rst:[self.path('data.txt')]})
+
+    def test_changed_server(self):
+        write_file(self.path('server.py'), 'print "changed"\n')
+        self.assertEqual(self.graph().outdated([self.rst]),
+                         {self.rst:[self.path('server.py')]})
+
+    def test_removed_file(self):
+        os.remove(self.path('shown.py'))
+        self.assertEqual(self.graph().outdated([self.rst]),
+                         {self.rst:[self.path('shown.py')]})
+
+    def test_unused_file(self):
+        write_file(self.path('unused.py'), 'print "changed"\n')
+        self.assertEqual(self.graph().outdated([self.rst]), {})
+
+    def test_users_of(self):
+        self.assertEqual(self.graph().users_of(self.path('data.txt')),
+                         [self.rst])
+        self.assertEqual(self.graph().users_of(self.path('unused.py')), [])
+
+    def test_update_records_new_state(self):
+        write_file(self.path('data.txt'), 'different data\n')
+        graph = self.graph()
+        graph.update(self.rst)
+        graph.save()
+        self.assertEqual(self.graph().outdated([self.rst]), {})
+
+    def test_other_format_is_ignored(self):
+        with open(self.graph_file, 'rt') as f:
+            data = json.load(f)
+        data['format'] = depgraph.GRAPH_FORMAT + 1
+        with open(self.graph_file, 'wt') as f:
+            json.dump(data, f)
+        self.assertEqual(self.graph().outdated([self.rst]),
+                         {self.rst:[self.rst]})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Fork server used to run example scripts without starting a new
+interpreter for each one.
+
+This file is run as a program by runscript.ForkServerExecutor, under
+the interpreter used for the examples, so it only uses the standard
+library. The server imports the commonly used modules once, then for
+each request forks a child that sets up the same cwd, argv, sys.path
+and __main__ module the interpreter would, runs the script with
+stdout and stderr sent to one pipe, and reports the output and exit
+code. Each child leads its own process group, which is killed if the
+script runs past the timeout given in the request.
+
+Usage: forkserver.py REQUEST_FD RESPONSE_FD
+"""
+
+import __builtin__
+import cPickle as pickle
+import errno
+import imp
+import os
+import select
+import signal
+import sys
+import time
+
+# Seconds to wait after SIGTERM before using SIGKILL.
+KILL_GRACE = 2.0
+
+# Longest pause between checks for a child that has closed its
+# output but not exited.
+WAIT_INTERVAL = 0.05
+
+# Modules imported before any script runs. Importing them has no
+# visible side-effects, so scripts cannot tell they were loaded
+# early.
+PRELOAD = [
+    'array', 'bisect', 'codecs', 'collections', 'copy', 'datetime',
+    'fnmatch', 'functools', 'glob', 'hashlib', 'heapq', 'itertools',
+    'logging', 'math', 'operator', 'pickle', 'pprint', 'random', 're',
+    'select', 'shutil', 'socket', 'string', 'StringIO', 'cStringIO',
+    'struct', 'subprocess', 'tempfile', 'textwrap', 'threading', 'time',
+    'traceback', 'types', 'urllib', 'urlparse', 'weakref',
+    ]
+
+
+def _exit_status(err):
+    """Convert a SystemExit to an exit code the way the interpreter does."""
+    value = err.code
+    if value is None:
+        return 0
+    if isinstance(value, (int, long)):
+        return int(value)
+    sys.stderr.write('%s\n' % value)
+    return 1
+
+
+def _finish(status):
+    """Run the interpreter shutdown steps scripts can observe."""
+    threading = sys.modules.get('threading')
+    if threading is not None:
+        # Wait for non-daemon threads, like Py_Finalize().
+        try:
+            threading._shutdown()
+        except Exception:
+            pass
+    exitfunc = getattr(sys, 'exitfunc', None)
+    if exitfunc is not None:
+        del sys.exitfunc
+        try:
+            exitfunc()
+        except SystemExit, err:
+            status = _exit_status(err)
+        except:
+            sys.stderr.write('Error in sys.exitfunc:\n')
+            exc_type, exc_value, tb = sys.exc_info()
+            sys.excepthook(exc_type, exc_value, tb.tb_next)
+    for f in (sys.stdout, sys.stderr):
+        try:
+            f.flush()
+        except Exception:
+            pass
+    return status
+
+
+def _run_script(cwd, argv, base_path):
+    """Run the script as __main__. Called in the child process."""
+    os.chdir(cwd)
+    script = argv[0]
+    sys.argv = list(argv)
+    sys.path[:] = [os.path.dirname(os.path.realpath(script))] + base_path
+    main = imp.new_module('__main__')
+    main.__file__ = script
+    main.__builtins__ = __builtin__
+    sys.modules['__main__'] = main
+    if 'random' in sys.modules:
+        # Do not let every child share the server's random state.
+        sys.modules['random'].seed()
+    try:
+        with open(script, 'rU') as f:
+            source = f.read()
+        code = compile(source, script, 'exec', 0, True)
+        exec code in main.__dict__
+    except SystemExit, err:
+        status = _exit_status(err)
+    except:
+        exc_type, exc_value, tb = sys.exc_info()
+        # Drop this frame so the traceback starts at the script.
+        sys.excepthook(exc_type, exc_value, tb.tb_next)
+        status = 1
+    else:
+        status = 0
+    return _finish(status)
+
+
+def _kill_group(pgid, sig):
+    try:
+        os.killpg(pgid, sig)
+    except OSError, err:
+        if err.errno != errno.ESRCH:
+            raise
+    return
+
+
+def _read(fd, deadline):
+    """Read until the end of the file or the deadline.
+
+    Returns the text and a flag that is False if the time ran out.
+    """
+    chunks = []
+    while True:
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return (''.join(chunks), False)
+            try:
+                ready = select.select([fd], [], [], remaining)[0]
+            except select.error, err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                continue
+        data = os.read(fd, 65536)
+        if not data:
+            return (''.join(chunks), True)
+        chunks.append(data)
+
+
+def _wait(pid, deadline):
+    """Wait for the child to exit, without waiting past the deadline.
+
+    Returns the wait4() status and resource usage, and a flag that is
+    True if the child's group had to be killed.
+    """
+    killed = False
+    delay = 0.001
+    while True:
+        wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+        if wpid:
+            return (status, rusage, killed)
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            if killed:
+                _kill_group(pid, signal.SIGKILL)
+                wpid, status, rusage = os.wait4(pid, 0)
+                return (status, rusage, killed)
+            _kill_group(pid, signal.SIGTERM)
+            killed = True
+            deadline = now + KILL_GRACE
+        time.sleep(delay)
+        delay = min(delay * 2, WAIT_INTERVAL)
+
+
+def run(cwd, argv, base_path, server_fds, timeout=None):
+    """Run one script in a child process.
+
+    Returns a tuple with the combined output, the exit code, the
+    resource usage of the child, and a flag that is True if the child
+    was killed because it ran longer than timeout seconds.
+    """
+    read_fd, write_fd = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            os.setsid()
+            os.close(read_fd)
+            for fd in server_fds:
+                os.close(fd)
+            os.dup2(write_fd, 1)
+            os.dup2(write_fd, 2)
+            os.close(write_fd)
+            status = _run_script(cwd, argv, base_path)
+        finally:
+            os._exit(status)
+    os.close(write_fd)
+    if timeout is None:
+        deadline = None
+    else:
+        deadline = time.time() + timeout
+    output, finished = _read(read_fd, deadline)
+    if not finished:
+        _kill_group(pid, signal.SIGTERM)
+        more, done = _read(read_fd, time.time() + KILL_GRACE)
+        output += more
+        if not done:
+            _kill_group(pid, signal.SIGKILL)
+    os.close(read_fd)
+    status, rusage, killed = _wait(pid, deadline)
+    # Clean up anything the script left running.
+    _kill_group(pid, signal.SIGKILL)
+    if os.WIFSIGNALED(status):
+        returncode = -os.WTERMSIG(status)
+    else:
+        returncode = os.WEXITSTATUS(status)
+    return (output, returncode, rusage, not finished or killed)
+
+
+def serve(request_fd, response_fd):
+    for name in PRELOAD:
+        __import__(name)
+    # The first entry is the directory containing this file, which
+    # is replaced by the script directory for each run.
+    base_path = sys.path[1:]
+    requests = os.fdopen(request_fd, 'rb')
+    responses = os.fdopen(response_fd, 'wb')
+    while True:
+        try:
+            request = pickle.load(requests)
+        except EOFError:
+            break
+        start = time.time()
+        output, returncode, rusage, timed_out = run(
+            request['cwd'], request['argv'], base_path,
+            (request_fd, response_fd), request.get('timeout'))
+        pickle.dump({'output':output,
+                     'returncode':returncode,
+                     'timed_out':timed_out,
+                     'elapsed':time.time() - start,
+                     'cpu':rusage.ru_utime + rusage.ru_stime,
+                     'maxrss':rusage.ru_maxrss,
+                     },
+                    responses, 2)
+        responses.flush()
+    return
+
+
+if __name__ == '__main__':
+    serve(int(sys.argv[1]), int(sys.argv[2]))
@@ -0,0 +1,599 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""run_script() for cog blocks, with a pluggable way to run the command.
+
+The formatting matches the version of run_script() in
+sphinxcontrib.paverutils used to produce the existing output, so the
+cogged files do not change just because of the switch. Running the
+command is left to an executor object, so the build can decide how
+the examples are run without touching the rst files.
+"""
+
+from __future__ import absolute_import
+
+import cPickle as pickle
+import errno
+import fcntl
+import os
+import re
+import select
+import shlex
+import signal
+import subprocess
+import tempfile
+import textwrap
+import time
+
+from paver.easy import BuildFailure
+
+from buildtools.forkserver import PRELOAD
+from buildtools.scriptcache import referenced_files
+from buildtools.timings import maxrss_kb
+
+# Width of the "$ command" line before it is continued on the next line.
+COMMAND_LINE_WIDTH = 72
+
+# Seconds to wait after SIGTERM before using SIGKILL.
+KILL_GRACE = 2.0
+
+# Longest pause between checks for a process that has closed its
+# output but not exited.
+WAIT_INTERVAL = 0.05
+
+# Seconds to give a server to start listening before running its client.
+SERVER_STARTUP = 1.0
+
+# The program run by ForkServerExecutor.
+FORK_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'forkserver.py')
+
+# Commands using any of these need a real shell.
+_shell_syntax = re.compile(r'[|&;<>()$`*?\[\]{}~\\]')
+
+# Scripts that look at the interpreter's own state would see the fork
+# server's frames and modules, so they are run the normal way.
+_introspection = re.compile(
+    r'_getframe|currentframe|_current_frames|\bstack\(|_stack\b|outerframes'
+    r'|sys\.modules|settrace|setprofile|get_objects|get_referrers'
+    r'|builtin_module_names|getrefcount|recursionlimit|path_importer_cache'
+    r'|\bgc\.'
+    )
+
+
+def _returncode(status):
+    """Convert a wait() status to a returncode the way subprocess does."""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def command_line(script_name, interpreter):
+    """Return the command line run_script() shows for the script."""
+    if isinstance(script_name, list):
+        script_name = ' '.join(script_name)
+    if interpreter:
+        return '%s %s' % (interpreter, script_name)
+    return script_name
+
+
+def scripts_match(rundir, command, pattern):
+    """Does any python script used by the command match the regex?"""
+    for name in referenced_files(rundir, command):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(rundir, name), 'rt') as f:
+            if pattern.search(f.read()):
+                return True
+    return False
+
+
+def kill_process_group(pgid, sig):
+    """Send the signal to every process in the group, if any are left."""
+    try:
+        os.killpg(pgid, sig)
+    except OSError, err:
+        if err.errno != errno.ESRCH:
+            raise
+    return
+
+
+def read_output(fd, timeout=None):
+    """Read from fd until the end of the file or the timeout.
+
+    Returns the text and a flag that is False if the time ran out
+    before the writers closed the pipe.
+    """
+    chunks = []
+    if timeout is None:
+        deadline = None
+    else:
+        deadline = time.time() + timeout
+    while True:
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return (''.join(chunks), False)
+            try:
+                ready = select.select([fd], [], [], remaining)[0]
+            except select.error, err:
+                if err.args[0] == errno.EINTR:
+                    continue
+                raise
+            if not ready:
+                continue
+        data = os.read(fd, 65536)
+        if not data:
+            return (''.join(chunks), True)
+        chunks.append(data)
+
+
+def read_with_deadline(fd, pgid, timeout):
+    """Read the output of the process group leader pgid.
+
+    When the timeout passes, the group is sent SIGTERM, then SIGKILL
+    if the pipe is still open KILL_GRACE seconds later. Returns the
+    output and a flag that is True if the group had to be killed.
+    """
+    try:
+        output, finished = read_output(fd, timeout)
+        if finished:
+            return (output, False)
+        kill_process_group(pgid, signal.SIGTERM)
+        more, finished = read_output(fd, KILL_GRACE)
+        if not finished:
+            kill_process_group(pgid, signal.SIGKILL)
+        return (output + more, True)
+    except BaseException:
+        # Do not leave the example running if the build is
+        # interrupted.
+        kill_process_group(pgid, signal.SIGKILL)
+        raise
+
+
+def wait_with_deadline(pid, pgid, deadline):
+    """Wait for pid to exit, without waiting past the deadline.
+
+    A process can close its output and keep running, so wait4() is
+    polled. When the deadline passes, the group pgid is sent SIGTERM,
+    then SIGKILL if pid is still running KILL_GRACE seconds later.
+    Returns the wait4() status and resource usage, and a flag that is
+    True if the group had to be killed.
+    """
+    killed = False
+    delay = 0.001
+    try:
+        while True:
+            wpid, status, rusage = os.wait4(pid, os.WNOHANG)
+            if wpid:
+                return (status, rusage, killed)
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                if killed:
+                    kill_process_group(pgid, signal.SIGKILL)
+                    wpid, status, rusage = os.wait4(pid, 0)
+                    return (status, rusage, killed)
+                kill_process_group(pgid, signal.SIGTERM)
+                killed = True
+                deadline = now + KILL_GRACE
+            time.sleep(delay)
+            delay = min(delay * 2, WAIT_INTERVAL)
+    except BaseException:
+        kill_process_group(pgid, signal.SIGKILL)
+        raise
+
+
+class BackgroundServer(object):
+    """Runs a server example while its client is run.
+
+    The server is started in its own process group, given SERVER_STARTUP
+    seconds to start listening, and stopped with the rest of its group
+    by stop(). Its output is discarded.
+    """
+
+    def __init__(self, rundir, interpreter, command):
+        self.output = tempfile.TemporaryFile()
+        self.proc = subprocess.Popen(command_line(command, interpreter),
+                                     shell=True,
+                                     cwd=rundir or None,
+                                     stdout=self.output,
+                                     stderr=subprocess.STDOUT,
+                                     preexec_fn=os.setsid,
+                                     )
+        time.sleep(SERVER_STARTUP)
+
+    def stop(self):
+        kill_process_group(self.proc.pid, signal.SIGTERM)
+        deadline = time.time() + KILL_GRACE
+        while self.proc.poll() is None and time.time() < deadline:
+            time.sleep(0.05)
+        kill_process_group(self.proc.pid, signal.SIGKILL)
+        self.proc.wait()
+        self.output.close()
+        return
+
+
+class SubprocessExecutor(object):
+    """Run each command in a new shell, as a reader would by hand.
+    """
+
+    def run(self, rundir, interpreter, command, timeout=None, server=None):
+        """Run the command in rundir.
+
+        The command runs in its own process group, so if it is still
+        running after timeout seconds the shell and everything it
+        started can be killed together. If a server command is given,
+        it is run in the background for as long as the command runs.
+
+        Returns a tuple with the combined stdout and stderr text, the
+        exit code, and a dictionary with the 'cpu' seconds and peak
+        RSS ('maxrss', in kilobytes) used and whether the command
+        'timed_out'.
+        """
+        background = None
+        if server:
+            background = BackgroundServer(rundir, interpreter, server)
+        try:
+            proc = subprocess.Popen(command_line(command, interpreter),
+                                    shell=True,
+                                    cwd=rundir or None,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    preexec_fn=os.setsid,
+                                    )
+            if timeout is None:
+                deadline = None
+            else:
+                deadline = time.time() + timeout
+            output, timed_out = read_with_deadline(proc.stdout.fileno(),
+                                                   proc.pid, timeout)
+            proc.stdout.close()
+            # Use wait4() instead of communicate() to get the resource
+            # usage of the child, including the processes it waited for.
+            status, rusage, killed = wait_with_deadline(proc.pid, proc.pid,
+                                                        deadline)
+            timed_out = timed_out or killed
+            proc.returncode = _returncode(status)
+            # Clean up anything the example left running.
+            kill_process_group(proc.pid, signal.SIGKILL)
+        finally:
+            if background is not None:
+                background.stop()
+        usage = {'cpu':rusage.ru_utime + rusage.ru_stime,
+                 'maxrss':maxrss_kb(rusage.ru_maxrss),
+                 'timed_out':timed_out,
+                 }
+        return (output, proc.returncode, usage)
+
+    def report(self):
+        return
+
+    def close(self):
+        return
+
+
+class ForkServerExecutor(object):
+    """Run plain python scripts by forking a warm interpreter.
+
+    A server process (see forkserver.py) imports the commonly used
+    modules once and forks a child for each script, which saves the
+    interpreter startup time for each example. Commands that are not
+    "interpreter script.py args", or that need the shell, are run by
+    a SubprocessExecutor instead.
+
+    With verify set, every script is also run the normal way and the
+    subprocess output is used (and a warning printed) whenever the
+    two differ.
+    """
+
+    def __init__(self, interpreter='python', verify=False):
+        self.interpreter = interpreter
+        self.verify = verify
+        self.fallback = SubprocessExecutor()
+        self.server = None
+        self.forked = 0
+        self.total = 0
+        self.mismatches = []
+        self.cold_start = None
+        self.fork_overhead = None
+
+    def _start(self):
+        request_r, request_w = os.pipe()
+        response_r, response_w = os.pipe()
+        # Keep our ends of the pipes out of the server, or it will
+        # never see the end of the requests.
+        for fd in (request_w, response_r):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+            fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+        devnull = open(os.devnull, 'w')
+        try:
+            # stdout goes to a file that is not a tty so the children
+            # buffer their output the same way they do when run with
+            # a pipe by SubprocessExecutor.
+            self.server = subprocess.Popen(
+                [self.interpreter, FORK_SERVER, str(request_r), str(response_w)],
+                stdout=devnull,
+                close_fds=False,
+                )
+        finally:
+            devnull.close()
+            os.close(request_r)
+            os.close(response_w)
+        self.requests = os.fdopen(request_w, 'wb')
+        self.responses = os.fdopen(response_r, 'rb')
+
+        # Measure what a fresh interpreter costs compared to a fork,
+        # so we can report the savings.
+        start = time.time()
+        subprocess.call([self.interpreter, '-c', 'import ' + ', '.join(PRELOAD)])
+        self.cold_start = time.time() - start
+        start = time.time()
+        self._request('/', [os.devnull])
+        self.fork_overhead = time.time() - start
+        return
+
+    def _request(self, cwd, argv, timeout=None):
+        pickle.dump({'cwd':os.path.abspath(cwd),
+                     'argv':argv,
+                     'timeout':timeout,
+                     },
+                    self.requests, 2)
+        self.requests.flush()
+        response = pickle.load(self.responses)
+        usage = {'cpu':response['cpu'],
+                 'maxrss':maxrss_kb(response['maxrss']),
+                 'timed_out':response['timed_out'],
+                 }
+        return (response['output'], response['returncode'], usage)
+
+    def can_fork(self, rundir, interpreter, command):
+        """Can the command be run by the fork server?"""
+        if interpreter != self.interpreter or _shell_syntax.search(command):
+            return False
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            return False
+        if not (argv
+                and argv[0].endswith('.py')
+                and os.path.isfile(os.path.join(rundir, argv[0]))
+                ):
+            return False
+        return not scripts_match(rundir, command, _introspection)
+
+    def run(self, rundir, interpreter, command, timeout=None, server=None):
+        self.total += 1
+        if server or not self.can_fork(rundir, interpreter, command):
+            return self.fallback.run(rundir, interpreter, command,
+                                     timeout=timeout, server=server)
+        if self.server is None:
+            self._start()
+        result = self._request(rundir or '.', shlex.split(command), timeout)
+        self.forked += 1
+        if self.verify:
+            expected = self.fallback.run(rundir, interpreter, command,
+                                         timeout=timeout)
+            if expected[:2] != result[:2]:
+                print '*' * 50
+                print 'WARNING: fork server output differs for %s, using subprocess output' % command
+                print '*' * 50
+                self.mismatches.append(os.path.join(rundir, command))
+                result = expected
+        return result
+
+    def report(self):
+        if not self.forked:
+            return
+        saved = self.forked * max(self.cold_start - self.fork_overhead, 0)
+        print ('fork server: ran %d of %d scripts, saved about %.1fs of startup '
+               '(%.1fms cold start vs. %.1fms fork)' %
+               (self.forked, self.total, saved,
+                self.cold_start * 1000, self.fork_overhead * 1000))
+        for name in self.mismatches:
+            print 'fork server: output did not match for %s' % name
+        return
+
+    def close(self):
+        if self.server is not None:
+            self.requests.close()
+            self.responses.close()
+            self.server.wait()
+            self.server = None
+        return
+
+
+def adjust_line_widths(lines, break_lines_at, line_break_mode):
+    """Break up lines longer than break_lines_at.
+
+    Modes:
+
+      break
+        Insert a hard break
+      continue
+        Insert a hard break with a backslash at the end of the line
+      wrap
+        Use textwrap.fill() to wrap
+      wrap-no-breaks
+        Use textwrap.fill() without breaking on hyphens or long words
+      fill
+        Use textwrap.fill(), maintaining the whitespace prefix
+        on subsequent lines
+      truncate
+        Chop the line at the required width and discard the remainder
+    """
+    broken_lines = []
+    for line in lines:
+        # apparently blank line
+        if not line.strip() or len(line) <= break_lines_at:
+            broken_lines.append(line)
+            continue
+
+        if line_break_mode == 'break':
+            while line:
+                part, line = line[:break_lines_at], line[break_lines_at:]
+                broken_lines.append(part)
+
+        elif line_break_mode == 'continue':
+            while line:
+                part, line = line[:break_lines_at], line[break_lines_at:]
+                if line:
+                    part = part + '\\'
+                broken_lines.append(part)
+
+        elif line_break_mode == 'wrap':
+            broken_lines.extend(
+                textwrap.fill(line, width=break_lines_at).splitlines())
+
+        elif line_break_mode == 'wrap-no-breaks':
+            broken_lines.extend(
+                textwrap.fill(line, width=break_lines_at,
+                              break_long_words=False,
+                              break_on_hyphens=False,
+                              ).splitlines())
+
+        elif line_break_mode == 'fill':
+            prefix = line[:len(line) - len(line.lstrip())]
+            broken_lines.extend(
+                textwrap.fill(line, width=break_lines_at,
+                              subsequent_indent=prefix,
+                              ).splitlines())
+
+        elif line_break_mode == 'truncate':
+            broken_lines.append(line[:break_lines_at])
+
+        else:
+            raise ValueError('Unrecognized line_break_mode "%s"' % line_break_mode)
+
+    return broken_lines
+
+
+def run_script(input_file, script_name,
+               interpreter='python',
+               include_prefix=True,
+               ignore_error=False,
+               trailing_newlines=True,
+               break_lines_at=0,
+               line_break_mode='break',
+               timeout=None,
+               server=None,
+               executor=None,
+               timer=None,
+               ):
+    """Run a script in the context of the input_file's directory,
+    return the text output formatted to be included as an rst
+    literal text block.
+
+    Arguments:
+
+     input_file
+      The name of the file being processed by cog.  Usually passed as
+      cog.inFile.
+
+     script_name
+       The name of the Python script living in the same directory as
+       input_file to be run.  If not using an interpreter, this can be
+       a complete command line.  If using an alternate interpreter, it
+       can be some other type of file. If the command line is very
+       long, this can be a list of parts. They will be joined with a
+       space character into a single string to be executed.
+
+     include_prefix=True
+       Boolean controlling whether the :: prefix is included.
+
+     ignore_error=False
+       Boolean controlling whether errors are ignored.  If not
+       ignored, the error and the output are printed and BuildFailure
+       is raised.
+
+     trailing_newlines=True
+       Boolean controlling whether the trailing newlines are added to
+       the output.  If False, the output is passed to rstrip() then
+       one newline is added.  If True, newlines are added to the
+       output until it ends in 2.
+
+     break_lines_at=0
+       Integer indicating the length where lines should be broken and
+       continued on the next line.  Defaults to 0, meaning no special
+       handling should be done.
+
+     line_break_mode='break'
+       Name of mode to break lines (see adjust_line_widths()).
+
+     timeout=None
+       Number of seconds the example may run before it, and every
+       process it started, is killed. A timeout is an error.
+
+     server=None
+       A server example to run in the background while script_name
+       (its client) runs. The server is stopped when the client
+       finishes, and its output is not included.
+
+     executor=None
+       Object used to run the command. Defaults to a
+       SubprocessExecutor.
+
+     timer=None
+       ExampleTimer used to record how long the command took.
+    """
+    if executor is None:
+        executor = SubprocessExecutor()
+    rundir = os.path.dirname(input_file)
+    if isinstance(script_name, list):
+        script_name = ' '.join(script_name)
+    cmd = command_line(script_name, interpreter)
+    real_cmd = 'cd %s; %s 2>&1' % (rundir, cmd)
+
+    print
+    if server:
+        print 'cd %s; %s &' % (rundir, command_line(server, interpreter))
+    print real_cmd
+    start = time.time()
+    output_text, returncode, usage = executor.run(rundir, interpreter, script_name,
+                                                  timeout=timeout,
+                                                  server=server,
+                                                  )
+    wall = time.time() - start
+    if timer is not None:
+        # Executors that run examples ahead of time report how long
+        # the example took, instead of how long this call waited.
+        timer.record(input_file, cmd, usage.get('wall', wall), usage, returncode)
+    print output_text
+    if usage.get('timed_out'):
+        print '*' * 50
+        print 'ERROR run_script(%s) => timed out after %s seconds' % (real_cmd, timeout)
+        print '*' * 50
+        raise BuildFailure('Subprocess timed out after %s seconds' % timeout)
+    if returncode and not ignore_error:
+        print '*' * 50
+        print 'ERROR run_script(%s) => exit code %s' % (real_cmd, returncode)
+        print '*' * 50
+        raise BuildFailure('Subprocess return code: %s' % returncode)
+
+    if include_prefix:
+        response = '\n::\n\n'
+    else:
+        response = ''
+
+    # Leave room for the continuation marker so the command line is
+    # not broken again below.
+    if break_lines_at:
+        command_width = break_lines_at - 1
+    else:
+        command_width = COMMAND_LINE_WIDTH
+    lines = adjust_line_widths(['$ %s' % cmd], command_width, 'continue')
+    lines.append('')  # a blank line
+    lines.extend(output_text.splitlines())  # the output
+
+    # Deal with lines that might be too long
+    if break_lines_at:
+        lines = adjust_line_widths(lines, break_lines_at, line_break_mode)
+
+    response += '\t' + '\n\t'.join(lines)
+    if trailing_newlines:
+        while not response.endswith('\n\n'):
+            response += '\n'
+    else:
+        response = response.rstrip()
+        response += '\n'
+    return response
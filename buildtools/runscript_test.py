@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Tests for the timeouts in runscript.py.
+
+The examples are run with the "python" found on the PATH, as they
+are by the build.
+
+Usage: python runscript_test.py
+"""
+
+from cStringIO import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from paver.easy import BuildFailure
+from buildtools import runscript
+
+# Seconds the examples are given before they are killed. Anything
+# that is not stopped runs for much longer.
+TIMEOUT = 1
+
+# How long stopping an example that ran out of time may take.
+LIMIT = TIMEOUT + runscript.KILL_GRACE + 2
+
+EXAMPLES = {
+    'quick.py':"""
+print 'hello'
+""",
+    'slow.py':"""
+import sys, time
+print 'started'
+sys.stdout.flush()
+time.sleep(60)
+""",
+    # Stops writing, but does not exit.
+    'closes_output.py':"""
+import os, sys, time
+print 'closing'
+sys.stdout.flush()
+os.close(1)
+os.close(2)
+time.sleep(60)
+""",
+    # Exits, leaving a child holding the output pipe open.
+    'leaves_child.py':"""
+import subprocess
+subprocess.Popen(['sleep', '60'])
+print 'parent done'
+""",
+    }
+
+
+class RunScriptTestCase(unittest.TestCase):
+    """Writes the examples to a temporary directory."""
+
+    def setUp(self):
+        self.rundir = tempfile.mkdtemp()
+        for name, text in EXAMPLES.items():
+            with open(os.path.join(self.rundir, name), 'wt') as f:
+                f.write(text)
+
+    def tearDown(self):
+        shutil.rmtree(self.rundir)
+
+    def run_example(self, executor, name):
+        """Returns the result of running the example, and how long it took."""
+        start = time.time()
+        result = executor.run(self.rundir, 'python', name, timeout=TIMEOUT)
+        return result, time.time() - start
+
+
+class SubprocessTimeoutTest(RunScriptTestCase):
+
+    def setUp(self):
+        super(SubprocessTimeoutTest, self).setUp()
+        self.executor = runscript.SubprocessExecutor()
+
+    def test_finishes_in_time(self):
+        (output, returncode, usage), elapsed = self.run_example(self.executor,
+                                                                'quick.py')
+        self.assertEqual((output, returncode), ('hello\n', 0))
+        self.assertFalse(usage['timed_out'])
+
+    def test_slow(self):
+        (output, returncode, usage), elapsed = self.run_example(self.executor,
+                                                                'slow.py')
+        self.assertEqual(output, 'started\n')
+        self.assertTrue(usage['timed_out'])
+        self.assertTrue(returncode < 0)
+        self.assertTrue(elapsed < LIMIT)
+
+    def test_closes_output(self):
+        (output, returncode, usage), elapsed = self.run_example(self.executor,
+                                                                'closes_output.py')
+        self.assertEqual(output, 'closing\n')
+        self.assertTrue(usage['timed_out'])
+        self.assertTrue(elapsed < LIMIT)
+
+    def test_leaves_child(self):
+        (output, returncode, usage), elapsed = self.run_example(self.executor,
+                                                                'leaves_child.py')
+        self.assertEqual(output, 'parent done\n')
+        self.assertTrue(usage['timed_out'])
+        self.assertTrue(elapsed < LIMIT)
+
+
+class ForkServerTimeoutTest(SubprocessTimeoutTest):
+
+    def setUp(self):
+        super(ForkServerTimeoutTest, self).setUp()
+        self.executor = runscript.ForkServerExecutor()
+
+    def tearDown(self):
+        self.executor.close()
+        super(ForkServerTimeoutTest, self).tearDown()
+
+    def test_forked(self):
+        self.run_example(self.executor, 'slow.py')
+        self.assertEqual(self.executor.forked, 1)
+
+
+class RunScriptTimeoutTest(RunScriptTestCase):
+
+    def run_script(self, name):
+        """Call run_script() for a document in rundir, hiding what it prints."""
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            return runscript.run_script(os.path.join(self.rundir, 'index.rst'),
+                                        name, timeout=TIMEOUT)
+        finally:
+            sys.stdout = stdout
+
+    def test_timeout_is_an_error(self):
+        self.assertRaises(BuildFailure, self.run_script, 'slow.py')
+
+    def test_output(self):
+        self.assertEqual(self.run_script('quick.py'),
+                         '\n::\n\n\t$ python quick.py\n\t\n\thello\n\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Start the slow examples early, in the background, while cog works
+through the fast ones.
+"""
+
+from __future__ import absolute_import
+
+import os
+import re
+import time
+from multiprocessing.pool import ThreadPool
+
+from buildtools import runscript
+
+# Examples that look like servers wait for clients to connect, so
+# they are treated as slow until they have been timed.
+_server = re.compile(
+    r'serve_forever|\.listen\(|asyncore\.loop|handle_request\(')
+
+
+class ScheduledExecutor(object):
+    """Runs the slow examples ahead of time in a pool of threads.
+
+    schedule() is given the run_script() calls cog is about to make.
+    For each directory with a slow example (see is_slow()), the
+    examples up to and including the last slow one are started right
+    away, one at a time and in the order cog would run them, so
+    examples that read the files written by an earlier one still
+    work. Meanwhile run() passes the examples in other directories to
+    the wrapped executor. When cog gets to a directory that has
+    examples running in the background, run() waits for them to
+    finish, then returns their saved results instead of running them
+    again.
+
+    The background examples are run by a SubprocessExecutor, so each
+    one gets its own process group and deadline. The 'wall' time in
+    the usage returned by run() is how long the example itself took,
+    not counting any time spent waiting for the background examples.
+    """
+
+    def __init__(self, executor, jobs, timeout=None, slow=1.0, previous=None):
+        self.executor = executor
+        self.background = runscript.SubprocessExecutor()
+        self.jobs = jobs
+        self.timeout = timeout
+        self.slow = slow
+        # Maps (input_file, command line) to the wall time from the
+        # last timing report.
+        self.previous = previous or {}
+        self.pool = None
+        self.groups = {}
+        self.results = {}
+        self.started = 0
+        self.used = 0
+
+    def is_slow(self, input_file, script_name, interpreter, kwds):
+        """Should the call be run in the background?
+
+        Client/server pairs and examples that took at least slow
+        seconds the last time they were timed are. Examples that have
+        not been timed yet are if they look like servers.
+        """
+        if kwds.get('server'):
+            return True
+        command = runscript.command_line(script_name, interpreter)
+        wall = self.previous.get((input_file, command))
+        if wall is not None:
+            return wall >= self.slow
+        if isinstance(script_name, list):
+            script_name = ' '.join(script_name)
+        rundir = os.path.dirname(input_file) or '.'
+        return runscript.scripts_match(rundir, script_name, _server)
+
+    def schedule(self, calls):
+        """Start the examples in directories with slow calls in the
+        background.
+
+        calls is a sequence of (input_file, script_name, interpreter,
+        kwds) tuples, in the order cog will make them.
+        """
+        by_dir = {}
+        for call in calls:
+            rundir = os.path.dirname(call[0])
+            if rundir not in self.groups:
+                by_dir.setdefault(rundir, []).append(call)
+        started = False
+        for rundir, dir_calls in sorted(by_dir.items()):
+            slow = [i for i, call in enumerate(dir_calls)
+                    if self.is_slow(*call)]
+            if not slow:
+                continue
+            work = []
+            for input_file, script_name, interpreter, kwds in dir_calls[:slow[-1] + 1]:
+                if isinstance(script_name, list):
+                    script_name = ' '.join(script_name)
+                key = (rundir, interpreter, script_name, kwds.get('server'))
+                work.append((key, kwds.get('timeout', self.timeout)))
+            if self.pool is None:
+                self.pool = ThreadPool(self.jobs)
+            self.groups[rundir] = self.pool.apply_async(self._run_group, (work,))
+            self.started += len(work)
+        return
+
+    def _run_group(self, work):
+        """Run the work in order, returning a dictionary that maps each
+        key to the list of results for it.
+        """
+        results = {}
+        for key, timeout in work:
+            rundir, interpreter, command, server = key
+            start = time.time()
+            output, returncode, usage = self.background.run(
+                rundir, interpreter, command,
+                timeout=timeout,
+                server=server,
+                )
+            usage = dict(usage or {}, wall=time.time() - start)
+            results.setdefault(key, []).append((output, returncode, usage))
+        return results
+
+    def run(self, rundir, interpreter, command, timeout=None, server=None):
+        group = self.groups.pop(rundir, None)
+        if group is not None:
+            for key, runs in group.get().items():
+                self.results.setdefault(key, []).extend(runs)
+        key = (rundir, interpreter, command, server)
+        if self.results.get(key):
+            self.used += 1
+            return self.results[key].pop(0)
+        start = time.time()
+        output, returncode, usage = self.executor.run(rundir, interpreter, command,
+                                                      timeout=timeout,
+                                                      server=server,
+                                                      )
+        usage = dict(usage or {}, wall=time.time() - start)
+        return (output, returncode, usage)
+
+    def report(self):
+        if self.started:
+            print ('scheduler: ran %d examples in the background, '
+                   'used %d' % (self.started, self.used))
+        self.executor.report()
+        return
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.executor.close()
+        return
@@ -0,0 +1,227 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Content-addressed cache for the output of run_script() in cog blocks.
+
+The key for each run is a hash of the script, the files in its
+directory that it refers to, the version of the interpreter, and the
+arguments given to run_script(). When nothing in the key has changed
+the stored output is replayed instead of running the example again.
+
+Examples often read files written by the examples before them in the
+same document, so once one example in a document has to be run, the
+ones already replayed from the cache are run again, in order, and the
+rest of the document is run without the cache.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+
+# Bump this to invalidate every existing cache entry.
+CACHE_FORMAT = '1'
+
+# Files that never influence the output of an example.
+IGNORE_EXTENSIONS = ('.rst', '.pyc', '.pyo', '.html', '.orig', '.rej')
+
+
+class ScriptCache(object):
+    """Stores run_script() output in files named by a hash of the inputs.
+    """
+
+    def __init__(self, cache_dir, read=True):
+        self.cache_dir = cache_dir
+        self.read = read
+        self.hits = 0
+        self.misses = 0
+        self._versions = {}
+        self._cacheable = {}
+        # Maps input_file to the (script_name, interpreter, kwds) of
+        # the runs replayed from the cache so far.
+        self._replayed = {}
+        # Input files with a run that was not in the cache.
+        self._uncached = set()
+
+    def interpreter_version(self, interpreter):
+        """Return the full version string of the interpreter."""
+        try:
+            return self._versions[interpreter]
+        except KeyError:
+            pass
+        try:
+            proc = subprocess.Popen(
+                [interpreter, '-c', 'import sys; sys.stdout.write(sys.version)'],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                )
+            version = proc.communicate()[0]
+        except OSError, err:
+            version = 'unknown: %s' % err
+        self._versions[interpreter] = version
+        return version
+
+    def is_cacheable(self, input_file, interpreter):
+        """Can the output of a script run from input_file be cached?
+
+        Commands run without an interpreter (``ls``, ``cat``, ``find``)
+        usually look at files created by earlier examples in the same
+        document, so when a document contains any of them none of its
+        output is cached and every example is run in order.
+        """
+        if not interpreter:
+            return False
+        try:
+            return self._cacheable[input_file]
+        except KeyError:
+            pass
+        with open(input_file, 'rt') as f:
+            cacheable = 'interpreter=None' not in f.read()
+        self._cacheable[input_file] = cacheable
+        return cacheable
+
+    def key(self, input_file, script_name, interpreter, kwds):
+        """Return the cache key for a run, or None if it cannot be cached.
+        """
+        if not self.is_cacheable(input_file, interpreter):
+            return None
+        rundir = os.path.dirname(input_file) or '.'
+        if isinstance(script_name, list):
+            command = ' '.join(script_name)
+        else:
+            command = script_name
+        if kwds.get('server'):
+            # The output depends on the server run with the client.
+            command = '%s %s' % (command, kwds['server'])
+        h = hashlib.sha1()
+        h.update(CACHE_FORMAT)
+        h.update('\0%s\0%s\0' % (interpreter, self.interpreter_version(interpreter)))
+        h.update('%r\0%r\0' % (script_name, sorted(kwds.items())))
+        for name in sorted(referenced_files(rundir, command)):
+            h.update(name)
+            h.update('\0')
+            with open(os.path.join(rundir, name), 'rb') as f:
+                h.update(f.read())
+            h.update('\0')
+        return h.hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, key[:2], key[2:])
+
+    def contains(self, key):
+        """Would get() find output for the key?"""
+        return (key is not None
+                and self.read
+                and os.path.exists(self._filename(key)))
+
+    def get(self, key):
+        """Return the cached output for the key, or None."""
+        if key is None or not self.read:
+            self.misses += 1
+            return None
+        try:
+            with open(self._filename(key), 'rb') as f:
+                output = f.read()
+        except IOError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return output
+
+    def put(self, key, output):
+        """Save the output for the key."""
+        if key is None:
+            return
+        filename = self._filename(key)
+        dirname = os.path.dirname(filename)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Another worker may have created it.
+                if not os.path.isdir(dirname):
+                    raise
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        # Write to a temporary file and rename it into place so
+        # concurrent cog workers never see a partial entry.
+        fd, tmpname = tempfile.mkstemp(dir=dirname)
+        try:
+            os.write(fd, output)
+        finally:
+            os.close(fd)
+        os.rename(tmpname, filename)
+        return
+
+    def wrap(self, run_script):
+        """Return a version of run_script() that uses the cache.
+
+        After the first run in a document that is not in the cache,
+        the runs replayed before it are repeated, to recreate any
+        files they write, and every later run in the document skips
+        the cache.
+        """
+        def cached_run_script(input_file, script_name, interpreter='python', **kwds):
+            key = self.key(input_file, script_name, interpreter, kwds)
+            if input_file in self._uncached:
+                self.misses += 1
+            else:
+                output = self.get(key)
+                if output is not None:
+                    print 'cache hit for %s (%s)' % (script_name, key[:12])
+                    self._replayed.setdefault(input_file, []).append(
+                        (script_name, interpreter, kwds))
+                    return output
+                self._uncached.add(input_file)
+                for args in self._replayed.pop(input_file, []):
+                    print 'running %s again for the files it writes' % (args[0],)
+                    run_script(input_file, args[0], interpreter=args[1], **args[2])
+            output = run_script(input_file, script_name, interpreter=interpreter, **kwds)
+            self.put(key, output)
+            return output
+        return cached_run_script
+
+
+_word = re.compile(r'[A-Za-z0-9_.\-]+')
+
+def referenced_files(rundir, command):
+    """Return the names of the files in rundir that the command uses.
+
+    There is no way to know what an example will read without running
+    it, so look for the names of the files in the directory in the
+    command line and in the text of each script found. That catches
+    the data files (``lorem.txt``, ``testdata.csv``) and helper
+    modules (``import signal_child``) the examples rely on.
+    """
+    try:
+        candidates = [name for name in os.listdir(rundir)
+                      if os.path.isfile(os.path.join(rundir, name))
+                      and not name.endswith(IGNORE_EXTENSIONS)
+                      ]
+    except OSError:
+        return set()
+    by_token = {}
+    for name in candidates:
+        by_token.setdefault(name, set()).add(name)
+        base, ext = os.path.splitext(name)
+        if ext == '.py':
+            # Modules are imported by name, without the extension.
+            by_token.setdefault(base, set()).add(name)
+
+    found = set()
+    to_scan = [command]
+    while to_scan:
+        text = to_scan.pop()
+        for token in set(_word.findall(text)):
+            for name in by_token.get(token, ()):
+                if name in found:
+                    continue
+                found.add(name)
+                if name.endswith('.py'):
+                    with open(os.path.join(rundir, name), 'rt') as f:
+                        to_scan.append(f.read())
+    return found
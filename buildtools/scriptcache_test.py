@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Tests for scriptcache.py.
+
+Usage: python scriptcache_test.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from buildtools import scriptcache
+
+
+def write_file(filename, text):
+    with open(filename, 'wt') as f:
+        f.write(text)
+    return
+
+
+class ScriptCacheTestCase(unittest.TestCase):
+    """Creates a document with three examples and an empty cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.rundir = os.path.join(self.tmpdir, 'module')
+        os.mkdir(self.rundir)
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.input_file = os.path.join(self.rundir, 'index.rst')
+        write_file(self.input_file, 'cogged examples\n')
+        for name in ('first', 'second', 'third'):
+            self.write_example(name, "print '%s'\n" % name)
+        # The names of the examples run, in order.
+        self.runs = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_example(self, name, text):
+        write_file(os.path.join(self.rundir, name + '.py'), text)
+
+    def run_script(self, input_file, script_name, interpreter='python', **kwds):
+        """Stands in for runscript.run_script()."""
+        self.runs.append(script_name)
+        return 'output of %s %r' % (script_name, sorted(kwds.items()))
+
+    def run_document(self, *script_names):
+        """Run the examples through a new cache, as one cog pass would."""
+        cache = scriptcache.ScriptCache(self.cache_dir)
+        cached_run_script = cache.wrap(self.run_script)
+        outputs = [cached_run_script(self.input_file, name)
+                   for name in script_names]
+        return cache, outputs
+
+
+class KeyTest(ScriptCacheTestCase):
+
+    def key(self, script_name, **kwds):
+        cache = scriptcache.ScriptCache(self.cache_dir)
+        return cache.key(self.input_file, script_name, 'python', kwds)
+
+    def test_same_inputs_same_key(self):
+        self.assertEqual(self.key('first.py'), self.key('first.py'))
+
+    def test_script_changes_key(self):
+        before = self.key('first.py')
+        self.write_example('first', "print 'changed'\n")
+        self.assertNotEqual(self.key('first.py'), before)
+
+    def test_unrelated_script_does_not_change_key(self):
+        before = self.key('first.py')
+        self.write_example('second', "print 'changed'\n")
+        self.assertEqual(self.key('first.py'), before)
+
+    def test_data_file_changes_key(self):
+        self.write_example('first', "print open('data.txt').read()\n")
+        write_file(os.path.join(self.rundir, 'data.txt'), 'one\n')
+        before = self.key('first.py')
+        write_file(os.path.join(self.rundir, 'data.txt'), 'two\n')
+        self.assertNotEqual(self.key('first.py'), before)
+
+    def test_arguments_change_key(self):
+        self.assertNotEqual(self.key('first.py', break_lines_at=40),
+                            self.key('first.py'))
+
+    def test_server_changes_key(self):
+        before = self.key('first.py', server='second.py')
+        self.write_example('second', "print 'changed'\n")
+        self.assertNotEqual(self.key('first.py', server='second.py'), before)
+
+    def test_no_interpreter_is_not_cached(self):
+        write_file(self.input_file, "run_script(cog.inFile, 'ls', interpreter=None)\n")
+        self.assertEqual(self.key('first.py'), None)
+
+
+class WrapTest(ScriptCacheTestCase):
+
+    def test_miss_then_hit(self):
+        cache, outputs = self.run_document('first.py', 'second.py')
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(self.runs, ['first.py', 'second.py'])
+
+        self.runs = []
+        cache, replayed = self.run_document('first.py', 'second.py')
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        self.assertEqual(self.runs, [])
+        self.assertEqual(replayed, outputs)
+
+    def test_read_disabled(self):
+        self.run_document('first.py')
+        self.runs = []
+        cache = scriptcache.ScriptCache(self.cache_dir, read=False)
+        cache.wrap(self.run_script)(self.input_file, 'first.py')
+        self.assertEqual(self.runs, ['first.py'])
+        self.assertEqual(cache.hits, 0)
+
+    def test_miss_runs_replayed_examples_again(self):
+        self.run_document('first.py', 'second.py', 'third.py')
+        self.write_example('second', "print 'changed'\n")
+        self.runs = []
+        cache, outputs = self.run_document('first.py', 'second.py', 'third.py')
+        # first.py was replayed, then run again for the files it
+        # writes once second.py missed, and third.py was run even
+        # though it was in the cache.
+        self.assertEqual(self.runs, ['first.py', 'second.py', 'third.py'])
+        self.assertEqual(cache.hits, 1)
+
+    def test_miss_in_one_document_does_not_affect_another(self):
+        other_file = os.path.join(self.rundir, 'other.rst')
+        write_file(other_file, 'more cogged examples\n')
+        cache = scriptcache.ScriptCache(self.cache_dir)
+        cached_run_script = cache.wrap(self.run_script)
+        cached_run_script(other_file, 'third.py')
+        cached_run_script(self.input_file, 'first.py')
+        self.runs = []
+        cache = scriptcache.ScriptCache(self.cache_dir)
+        cached_run_script = cache.wrap(self.run_script)
+        cached_run_script(other_file, 'third.py')
+        cached_run_script(other_file, 'second.py')
+        cached_run_script(self.input_file, 'first.py')
+        # The miss in other.rst only repeats the examples from there.
+        self.assertEqual(self.runs, ['third.py', 'second.py'])
+        self.assertEqual(cache.hits, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
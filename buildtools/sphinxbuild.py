@@ -0,0 +1,161 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Run sphinx-build for cases sphinxcontrib.paverutils does not cover.
+"""
+
+from __future__ import absolute_import
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from paver.easy import Bunch, BuildFailure, dry, path
+
+
+def get_paths(options):
+    """Return a Bunch with the directories sphinx-build should use.
+
+    The options should already be ordered with the option set for
+    the build first. The defaults match sphinxcontrib.paverutils.
+    """
+    docroot = path(options.get('docroot', 'docs'))
+    builddir = docroot / options.get('builddir', '.build')
+    srcdir = docroot / options.get('sourcedir', '')
+    confdir = path(options.get('confdir', srcdir))
+    outdir = options.get('outdir', '')
+    if outdir:
+        outdir = path(outdir)
+    else:
+        outdir = builddir / options.get('builder', 'html')
+    doctrees = options.get('doctrees', '')
+    if doctrees:
+        doctrees = path(doctrees)
+    else:
+        doctrees = builddir / 'doctrees'
+    return Bunch(docroot=docroot, builddir=builddir, srcdir=srcdir,
+                 confdir=confdir, outdir=outdir, doctrees=doctrees)
+
+
+def sphinx_command(options, filenames=()):
+    """Return the sphinx-build command line for the current options.
+
+    The options are the ones run_sphinx() in sphinxcontrib.paverutils
+    reads, including template_args and config_args, so an option set
+    gives the same command line whichever of the two builds it. If
+    filenames are given, only those documents are written.
+    """
+    paths = get_paths(options)
+    for d in (paths.outdir, paths.doctrees):
+        if not d.exists():
+            d.makedirs()
+    cmd = ['sphinx-build',
+           '-b', options.get('builder', 'html'),
+           '-d', paths.doctrees,
+           '-c', paths.confdir,
+           ]
+    if options.get('force_all', False):
+        cmd.append('-a')
+    if options.get('freshenv', False):
+        cmd.append('-E')
+    for name, value in sorted(options.get('template_args', {}).items()):
+        cmd.append('-A%s=%s' % (name, value))
+    for name, value in sorted(options.get('config_args', {}).items()):
+        cmd.append('-D%s=%s' % (name, value))
+    cmd.extend([paths.srcdir, paths.outdir])
+    cmd.extend(filenames)
+    return cmd
+
+
+def _environ(templates):
+    """Return the environment for a build using the templates."""
+    environ = dict(os.environ)
+    if templates:
+        environ['TEMPLATES'] = templates
+    return environ
+
+
+def _run_in_parallel(builds, doctrees):
+    """Run the builds at once, printing the output of each in turn.
+
+    Each build gets its own copy of the doctrees, so the builds
+    cannot see each other's changes to the saved environment if they
+    do find something to read again (such as a document including a
+    file that does not exist). Returns the names of the builds that
+    failed.
+    """
+    running = []
+    workdir = tempfile.mkdtemp(prefix='sphinxbuild-')
+    try:
+        for name, cmd, templates in builds:
+            copy = os.path.join(workdir, name)
+            shutil.copytree(doctrees, copy)
+            cmd = list(cmd)
+            cmd[cmd.index('-d') + 1] = copy
+            log = tempfile.TemporaryFile()
+            proc = subprocess.Popen(cmd,
+                                    env=_environ(templates),
+                                    stdout=log,
+                                    stderr=subprocess.STDOUT,
+                                    )
+            running.append((name, proc, log))
+        failures = []
+        for name, proc, log in running:
+            if proc.wait():
+                failures.append(name)
+            log.seek(0)
+            print '---> sphinx-build for %s' % name
+            print log.read()
+            log.close()
+    except:
+        for name, proc, log in running:
+            if proc.poll() is None:
+                proc.kill()
+        raise
+    finally:
+        shutil.rmtree(workdir)
+    return failures
+
+
+def build_formats(options, option_sets):
+    """Run sphinx-build once for each option set, sharing the doctrees.
+
+    All of the option sets must use the same source and doctree
+    directories. The first build reads the new and changed sources
+    into the doctree cache as usual. After that the others have
+    nothing left to read, only the output to write, so they are run
+    at the same time, starting from copies of the cache.
+    """
+    builds = []
+    shared = set()
+    for name in option_sets:
+        options.order(name, 'sphinx', add_rest=False)
+        paths = get_paths(options)
+        shared.add((paths.srcdir, paths.doctrees))
+        cmd = [str(part) for part in sphinx_command(options)]
+        builds.append((name, cmd, options.get('templates', None)))
+        options.order()
+    if len(shared) > 1:
+        raise BuildFailure('%s do not use the same sources and doctrees'
+                           % ', '.join(option_sets))
+    srcdir, doctrees = shared.pop()
+
+    name, cmd, templates = builds[0]
+    rc = dry(' '.join(cmd), subprocess.call, cmd, env=_environ(templates))
+    if rc:
+        raise BuildFailure('sphinx-build for %s returned %s' % (name, rc))
+
+    # The environment was just refreshed, if asked, and we do not
+    # want every parallel build to read all of the sources again.
+    rest = [(name, [part for part in cmd if part != '-E'], templates)
+            for name, cmd, templates in builds[1:]]
+    if not rest:
+        return
+    failures = dry('sphinx-build for %s in parallel'
+                   % ', '.join(name for name, cmd, templates in rest),
+                   _run_in_parallel, rest, doctrees)
+    if failures:
+        raise BuildFailure('sphinx-build failed for %s' % ', '.join(failures))
+    return
@@ -0,0 +1,66 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Measure how long it takes to import PyMOTW and start the motw command.
+
+Each check runs a snippet of code in a fresh interpreter several
+times and keeps the fastest run, less the time for an interpreter
+that does nothing, so the budget covers only our own start-up work.
+The modules the snippet loads are also compared against a list that
+should only be imported when they are used.
+"""
+
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+import time
+
+
+def best_times(snippets, runs, python=sys.executable):
+    """Return the fastest wall-clock time, in seconds, to run each snippet.
+
+    The snippets take turns, so a busy moment on the machine does not
+    land on all of the runs of just one of them.
+    """
+    best = [None] * len(snippets)
+    with open(os.devnull, 'w') as devnull:
+        for i in range(runs):
+            for n, code in enumerate(snippets):
+                start = time.time()
+                subprocess.check_call([python, '-c', code], stdout=devnull)
+                elapsed = time.time() - start
+                if best[n] is None or elapsed < best[n]:
+                    best[n] = elapsed
+    return best
+
+
+def loaded_modules(code, python=sys.executable):
+    """Return the names of the modules loaded by running code."""
+    output = subprocess.Popen(
+        [python, '-c', code + '\nimport sys\nprint " ".join(sys.modules)'],
+        stdout=subprocess.PIPE,
+        ).communicate()[0]
+    return set(output.split())
+
+
+def check(code, budget, deferred, runs, python=sys.executable):
+    """Run code in a fresh interpreter and compare it to its budget.
+
+    budget is in seconds, over the time to start an interpreter that
+    does nothing. deferred lists modules the code should not import.
+    Returns the time taken and a list of problems, empty when the
+    check passes.
+    """
+    baseline, total = best_times(['pass', code], runs, python)
+    elapsed = max(0.0, total - baseline)
+    problems = []
+    if elapsed > budget:
+        problems.append('took %.1fms, over the budget of %.1fms'
+                        % (elapsed * 1000, budget * 1000))
+    imported = sorted(loaded_modules(code, python).intersection(deferred))
+    if imported:
+        problems.append('imported %s' % ', '.join(imported))
+    return elapsed, problems
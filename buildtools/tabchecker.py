@@ -0,0 +1,164 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Run tabnanny over many files at once, skipping the ones that passed.
+
+The files are found the same way tabnanny.check() finds them, and
+each one is checked in a pool of worker processes. The output of
+each check is printed in the order the files were found, so it does
+not depend on how the work was scheduled.
+
+Files that pass are saved in a cache with their size, modification
+time and a hash of their contents. On the next run, a file with the
+same size and modification time is not checked again, and neither
+is one that was touched without changing its contents.
+"""
+
+from __future__ import absolute_import
+
+from cStringIO import StringIO
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import tabnanny
+
+from buildtools.depgraph import file_signature
+
+# Bump this when the format of the saved cache changes.
+CACHE_FORMAT = 1
+
+# What tabnanny.check() prints for a file without problems when
+# tabnanny.verbose is set.
+CLEAN_MESSAGE = ': Clean bill of health.\n'
+
+
+def find_files(args):
+    """Return the files tabnanny.check() would look at for the args.
+
+    Directories are searched recursively for .py files. Anything else
+    named explicitly is checked whatever its name.
+    """
+    files = []
+    for name in args:
+        name = str(name)
+        if os.path.isdir(name) and not os.path.islink(name):
+            files.extend(find_files(
+                os.path.join(name, n) for n in sorted(os.listdir(name))
+                if n.endswith('.py')
+                or (os.path.isdir(os.path.join(name, n))
+                    and not os.path.islink(os.path.join(name, n)))
+                ))
+        else:
+            files.append(name)
+    return files
+
+
+def hash_file(filename):
+    """Return the SHA1 of the file's contents."""
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_cache(filename):
+    """Return the files that passed before, mapped to [mtime, size, sha1]."""
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'rt') as f:
+        data = json.load(f)
+    if data.get('format') != CACHE_FORMAT:
+        return {}
+    return data['files']
+
+
+def save_cache(filename, files):
+    """Write the files that passed to the cache."""
+    dirname = os.path.dirname(filename)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmpname = filename + '.tmp'
+    with open(tmpname, 'wt') as f:
+        json.dump({'format':CACHE_FORMAT,
+                   'files':files,
+                   },
+                  f, indent=1, sort_keys=True)
+    os.rename(tmpname, filename)
+    return
+
+
+def _check_file(filename):
+    """Worker function: run tabnanny on one file.
+
+    Returns (filename, output, errors, clean).
+    """
+    out = StringIO()
+    err = StringIO()
+    real_stdout, real_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = out, err
+    try:
+        tabnanny.verbose = 1
+        tabnanny.check(filename)
+    finally:
+        sys.stdout, sys.stderr = real_stdout, real_stderr
+    output = out.getvalue()
+    errors = err.getvalue()
+    clean = not errors and output.endswith(CLEAN_MESSAGE)
+    return (filename, output, errors, clean)
+
+
+def check(args, cache_file, jobs, use_cache=True):
+    """Run tabnanny over the files named by args.
+
+    Like tabnanny.check(), problems are printed but do not raise an
+    error. Returns the number of files found, the number checked and
+    the number with problems.
+    """
+    files = find_files(args)
+    cache = load_cache(cache_file) if use_cache else {}
+    signatures = {}
+    to_check = []
+    for filename in files:
+        signature = file_signature(filename)
+        signatures[filename] = signature
+        cached = cache.get(filename)
+        if signature is not None and cached is not None:
+            if cached[:2] == signature:
+                continue
+            if cached[2] == hash_file(filename):
+                cache[filename] = signature + [cached[2]]
+                continue
+        to_check.append(filename)
+
+    if jobs > 1 and len(to_check) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(to_check)))
+        # imap returns the results in the order of the inputs, even
+        # when the workers finish in a different order.
+        results = pool.imap(_check_file, to_check, chunksize=16)
+    else:
+        pool = None
+        results = (_check_file(f) for f in to_check)
+
+    problems = 0
+    try:
+        for filename, output, errors, clean in results:
+            sys.stdout.write(output)
+            sys.stderr.write(errors)
+            signature = signatures[filename]
+            if clean and signature is not None:
+                cache[filename] = signature + [hash_file(filename)]
+            else:
+                cache.pop(filename, None)
+                problems += 1
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+    save_cache(cache_file, cache)
+    return len(files), len(to_check), problems
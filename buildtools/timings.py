@@ -0,0 +1,122 @@
+# encoding: utf-8
+#
+# Copyright (c) 2011 Doug Hellmann All rights reserved.
+#
+"""Record how long each example takes to run during cog.
+"""
+
+from __future__ import absolute_import
+
+import json
+import os
+import sys
+
+
+def maxrss_kb(ru_maxrss):
+    """Convert the ru_maxrss value from a resource usage struct to KB.
+
+    Linux reports ru_maxrss in kilobytes, OS X in bytes.
+    """
+    if sys.platform == 'darwin':
+        return ru_maxrss // 1024
+    return ru_maxrss
+
+
+class ExampleTimer(object):
+    """Collects the wall time, CPU time and peak memory of each run.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def record(self, input_file, command, wall, usage, returncode):
+        """Save the measurements for one run_script() call.
+
+        usage is a dictionary with 'cpu' seconds, 'maxrss' kilobytes
+        and the 'timed_out' flag, or None if the executor could not
+        measure them.
+        """
+        usage = usage or {}
+        self.entries.append({
+            'input_file':input_file,
+            'command':command,
+            'wall':wall,
+            'cpu':usage.get('cpu'),
+            'maxrss_kb':usage.get('maxrss'),
+            'returncode':returncode,
+            'timed_out':usage.get('timed_out', False),
+            })
+        return
+
+
+def load_report(json_filename):
+    """Return the entries from a saved report, or [] if there is none."""
+    try:
+        with open(json_filename, 'rt') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return []
+
+
+def load_times(json_filename):
+    """Return the wall times from a saved report.
+
+    The result maps (input_file, command) to seconds.
+    """
+    return dict(((e['input_file'], e['command']), e['wall'])
+                for e in load_report(json_filename))
+
+
+def merge_entries(old, new):
+    """Combine two lists of entries, preferring the new measurements.
+
+    Cached examples are not run, so merging with the saved report
+    keeps the times of everything in the tree after a partial build.
+    """
+    measured = set((e['input_file'], e['command']) for e in new)
+    return [e for e in old
+            if (e['input_file'], e['command']) not in measured
+            ] + list(new)
+
+
+def over_budget(entries, budget):
+    """Return the entries that took longer than budget seconds."""
+    if not budget:
+        return []
+    return [e for e in entries if e['wall'] > budget]
+
+
+def format_entry(entry):
+    if entry['cpu'] is None:
+        cpu = '     -'
+    else:
+        cpu = '%6.2f' % entry['cpu']
+    if entry['maxrss_kb'] is None:
+        rss = '       -'
+    else:
+        rss = '%8d' % entry['maxrss_kb']
+    return '%7.2f %s %s  %s: %s' % (entry['wall'], cpu, rss,
+                                    entry['input_file'], entry['command'])
+
+
+def write_report(entries, json_filename, text_filename, top=20):
+    """Save all of the entries as JSON and the slowest as text.
+
+    Both files are sorted with the slowest examples first.
+    """
+    entries = sorted(entries, key=lambda e: e['wall'], reverse=True)
+    for filename in (json_filename, text_filename):
+        dirname = os.path.dirname(filename)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+    with open(json_filename, 'wt') as f:
+        json.dump(entries, f, indent=1, sort_keys=True)
+    total_wall = sum(e['wall'] for e in entries)
+    total_cpu = sum(e['cpu'] or 0 for e in entries)
+    with open(text_filename, 'wt') as f:
+        f.write('%d examples, %.2f seconds wall time, %.2f seconds CPU time\n\n'
+                % (len(entries), total_wall, total_cpu))
+        f.write('   wall    cpu  rss(KB)  example\n')
+        for entry in entries[:top]:
+            f.write(format_entry(entry) + '\n')
+    return
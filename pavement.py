@@ -7,7 +7,10 @@
 """
 
 # Standard library
+import multiprocessing
+import optparse
 import os
+import subprocess
 import sys
 import tabnanny
 import traceback
@@ -27,6 +30,12 @@ try:
 except:
     paverutils = None
 
+# Make the helpers in buildtools importable no matter where paver
+# itself is installed.
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from buildtools import (blogpost, buildbench, cogrunner, deltapublish,
+                        depgraph, sphinxbuild, startupcheck, tabchecker)
+
 # TODO
 # - move these variables to options?
 
@@ -54,6 +63,18 @@ PACKAGE_DATA = paver.setuputils.find_package_data(PROJECT,
                                                   only_in_packages=True,
                                                   )
 
+# Once the plain text docs are packed into one archive (see the text
+# task), install that instead of the separate files.
+DOC_ARCHIVE = '%s/docs.pack' % PROJECT
+# The full-text index used by "motw --search" is installed next to it.
+DOC_INDEX = '%s/docs.index' % PROJECT
+if os.path.exists(DOC_ARCHIVE):
+    PACKAGE_DATA[PROJECT] = [
+        f for f in PACKAGE_DATA.get(PROJECT, [])
+        if not (f.startswith('docs/') and f.endswith('.txt')
+                and not f.startswith('docs/_sources/'))
+        ]
+
 WEB_WORK_DIR = '/users/dhellmann/Devel/website/website'
 
 options(
@@ -83,7 +104,7 @@ options(
         keywords = ('python', 'PyMOTW', 'documentation'),
 
         # It seems wrong to have to list recursive packages explicitly.
-        packages = setuptools.find_packages(),
+        packages = setuptools.find_packages(exclude=['buildtools']),
         package_data=PACKAGE_DATA,
         zip_safe=False,
 
@@ -118,6 +139,10 @@ options(
         outdir='%s/docs' % PROJECT,
         templates='pkg',
         builder='text',
+        # Where to pack the text files for the motw command.
+        archive=DOC_ARCHIVE,
+        # Where to write the search index for "motw --search".
+        index=DOC_INDEX,
     ),
 
     website=Bunch(
@@ -128,6 +153,15 @@ options(
         server = 'pymotw.com',
         server_path = '/home/douhel3shell/pymotw.com/2/',
 
+        # Publish somewhere other than server:server_path, such as a
+        # local directory for testing.
+        publish_target = '',
+        # Where to save the hashes of the files published last time,
+        # so only the changed files are sent. Set publish_full to send
+        # everything anyway and remove anything else on the server.
+        publish_manifest = 'sphinx/publish_manifest.json',
+        publish_full = False,
+
         # What template should be used for the web site HTML?
         template_source = '%s/source/_templates/base.html' % WEB_WORK_DIR,
         template_dest = 'sphinx/templates/web/base.html',
@@ -151,6 +185,12 @@ options(
         docroot='.',
     ),
 
+    formats=Bunch(
+        # The option sets for the builds run by the formats task. The
+        # first one reads the sources, the rest run in parallel.
+        builds=['html', 'text', 'pdf'],
+    ),
+
     blog=Bunch(
         sourcedir=path(PROJECT)/MODULE,
         builddir='blog_posts',
@@ -160,6 +200,9 @@ options(
         in_file='index.html',
         out_file='blog.html',
         no_edit=False,
+        # Where blog_all renders every module, and the doctrees it uses.
+        all_outdir='blog_posts/all',
+        all_doctrees='blog_posts/all_doctrees',
     ),
 
     # Some of the files include [[[ as part of a nested list data structure,
@@ -169,6 +212,80 @@ options(
         endspec='}}}',
         endoutput='{{{end}}}',
         includedir='PyMOTW',
+        # How many worker processes to use (see --jobs).
+        jobs=1,
+        # Where to save the output of run_script() so unchanged
+        # examples do not have to be run again (see --no-cache).
+        cache_dir='sphinx/cogcache',
+        use_cache=True,
+        # How to run the examples: 'subprocess' starts a new
+        # interpreter each time, 'fork' forks a warm one (see
+        # --fork-server). With verify_fork_server both are run and
+        # any differences are reported.
+        executor='subprocess',
+        verify_fork_server=False,
+        # Where to write the time and memory used by each example
+        # (as .json and .txt), how many of the slowest examples to
+        # list in the text version, and how many seconds an example
+        # may take before the build fails (0 for no limit, see
+        # --time-budget).
+        timing_report='sphinx/cogtimes.json',
+        timing_report_top=20,
+        time_budget=0,
+        # Seconds an example may run before it and any processes it
+        # started are killed (see --timeout).
+        example_timeout=120,
+        # How many slow examples (server/client pairs, anything that
+        # took at least slow_example seconds last time) to run in the
+        # background while cog handles the rest (see
+        # --background-jobs).
+        background_jobs=0,
+        slow_example=1.0,
+    ),
+
+    update=Bunch(
+        # Where to save the rst dependency graph between runs.
+        graph_file='sphinx/depgraph.json',
+    ),
+
+    tabcheck=Bunch(
+        # How many worker processes to use, 0 for one per CPU (see
+        # --jobs).
+        jobs=0,
+        # Where to remember the files that passed, so they are not
+        # checked again until they change (see --no-cache).
+        cache_file='sphinx/tabcheck.json',
+        use_cache=True,
+    ),
+
+    benchmark=Bunch(
+        # The paver tasks to time, in the order a build runs them
+        # (see --stages).
+        stages=['cog', 'html', 'pdf', 'website'],
+        # Run them on a copy of the tree with just these modules, on
+        # a copy of the whole tree, or both (see --scope).
+        modules=['atexit', 'glob', 'json', 'os', 'socket', 'textwrap',
+                 'threading', 'zipfile'],
+        scopes=['subset', 'full'],
+        # Where to keep the results of each run and the baseline they
+        # are compared with, and where to write the output of the
+        # stages.
+        history_file='sphinx/benchmark.json',
+        log_file='sphinx/benchmark.log',
+        # How much slower (or bigger) than the baseline a stage can
+        # be before it is reported as a regression (see --threshold).
+        threshold=0.10,
+    ),
+
+    startup=Bunch(
+        # Milliseconds importing PyMOTW and loading the motw script
+        # may take, over starting a bare interpreter, and how many
+        # times to run each to find the fastest.
+        import_budget=10,
+        motw_budget=10,
+        runs=20,
+        # Modules that should only be imported when they are used.
+        deferred=['optparse', 'pydoc', 'webbrowser'],
     ),
 
     # Tell Paver to include extra parts that we use
@@ -184,28 +301,29 @@ options(
 __builtins__['path'] = path
 
 # Modified from paver.doctools._runcog
-from paver.doctools import Includer, _cogsh
 def _runcog(options, files, uncog=False):
     """Common function for the cog and runcog tasks."""
 
-    from paver.cog import Cog
     options.order('cog', 'sphinx', add_rest=True)
-    c = Cog()
-    if uncog:
-        c.options.bNoGenerate = True
-    c.options.bReplace = True
-    c.options.bDeleteCode = options.get("delete_code", False)
-    includedir = options.get('includedir', None)
-    if includedir:
-        include = Includer(includedir, cog=c,
-                           include_markers=options.get("include_markers"))
-        # load cog's namespace with our convenience functions.
-        c.options.defines['include'] = include
-        c.options.defines['sh'] = _cogsh(c)
-
-    c.sBeginSpec = options.get('beginspec', '[[[cog')
-    c.sEndSpec = options.get('endspec', ']]]')
-    c.sEndOutput = options.get('endoutput', '[[[end]]]')
+    settings = {
+        'uncog':uncog,
+        'delete_code':options.get("delete_code", False),
+        'includedir':options.get('includedir', None),
+        'include_markers':options.get("include_markers"),
+        'beginspec':options.get('beginspec', '[[[cog'),
+        'endspec':options.get('endspec', ']]]'),
+        'endoutput':options.get('endoutput', '[[[end]]]'),
+        'cache_dir':options.get('cache_dir', None),
+        'use_cache':options.get('use_cache', True),
+        'executor':options.get('executor', 'subprocess'),
+        'verify_fork_server':options.get('verify_fork_server', False),
+        'timing_report':options.get('timing_report', None),
+        'timing_report_top':int(options.get('timing_report_top', 20)),
+        'time_budget':float(options.get('time_budget', 0)),
+        'example_timeout':float(options.get('example_timeout', 0)),
+        'background_jobs':int(options.get('background_jobs', 0)),
+        'slow_example':float(options.get('slow_example', 1.0)),
+        }
 
     basedir = options.get('basedir', None)
     if basedir is None:
@@ -218,10 +336,75 @@ def _runcog(options, files, uncog=False):
             files = basedir.walkfiles(pattern)
         else:
             files = basedir.walkfiles()
-    for f in files:
-        dry("cog %s" % f, c.processOneFile, f)
+
+    jobs = int(options.get('jobs', 1))
+    if jobs > 1:
+        files = list(files)
+        dry("cog %d files using %d jobs" % (len(files), jobs),
+            cogrunner.cog_parallel, settings, files, jobs)
+    else:
+        files = list(files)
+        c = cogrunner.new_cog(settings)
+        try:
+            cogrunner.schedule_slow_examples(c, settings, files)
+            for f in files:
+                dry("cog %s" % f, c.processOneFile, f)
+        finally:
+            stats = cogrunner.finish_cog(c)
+        cogrunner.report(settings, stats)
 #
 
+def _parse_cog_args(options, parser=None):
+    """Pull the cog command line options out of options.args.
+
+    The tasks use consume_args so they can take file and directory
+    names, which means paver does not see the options. Pass a parser
+    to add options of your own, and use the return value to see them.
+    """
+    if parser is None:
+        parser = optparse.OptionParser()
+    parser.add_option('-j', '--jobs', type='int',
+                      default=int(options.get('jobs', 1)),
+                      help='Number of worker processes to use, 0 for one per CPU',
+                      )
+    parser.add_option('--no-cache',
+                      action='store_false',
+                      dest='use_cache',
+                      default=options.get('use_cache', True),
+                      help='Run every example, ignoring saved output',
+                      )
+    parser.add_option('--fork-server',
+                      action='store_const',
+                      const='fork',
+                      dest='executor',
+                      default=options.get('executor', 'subprocess'),
+                      help='Run examples by forking a pre-loaded interpreter',
+                      )
+    parser.add_option('--time-budget', type='float',
+                      default=float(options.get('time_budget', 0)),
+                      help='Fail if an example runs longer than this many seconds',
+                      )
+    parser.add_option('--timeout', type='float',
+                      dest='example_timeout',
+                      default=float(options.get('example_timeout', 0)),
+                      help='Kill examples that run longer than this many seconds',
+                      )
+    parser.add_option('-b', '--background-jobs', type='int',
+                      default=int(options.get('background_jobs', 0)),
+                      help='Number of slow examples to run in the background',
+                      )
+    cmd_options, args = parser.parse_args(list(getattr(options, 'args', [])))
+    if cmd_options.jobs < 1:
+        cmd_options.jobs = multiprocessing.cpu_count()
+    options.jobs = cmd_options.jobs
+    options.use_cache = cmd_options.use_cache
+    options.executor = cmd_options.executor
+    options.time_budget = cmd_options.time_budget
+    options.example_timeout = cmd_options.example_timeout
+    options.background_jobs = cmd_options.background_jobs
+    options.args = args
+    return cmd_options
+
 @task
 @consume_args
 def cog(options):
@@ -232,18 +415,46 @@ def cog(options):
       $ paver cog PyMOTW/atexit
       $ paver cog PyMOTW/atexit/index.rst
       $ paver cog
+      $ paver cog --jobs 8
+
+    With --jobs (or -j) the files are processed by a pool of worker
+    processes, one module directory at a time per worker.
+
+    The output of each run_script() call is saved under cache_dir and
+    replayed while the example and the files it uses are unchanged.
+    Use --no-cache to run every example anyway.
+
+    With --fork-server, python examples are run by forking a server
+    process that has already started the interpreter and imported the
+    common modules, instead of starting a new interpreter each time.
+
+    The wall time, CPU time and peak memory of each example run are
+    written to timing_report, with the slowest examples listed in a
+    text version next to it. With --time-budget SECONDS the build
+    fails if any example takes longer than that.
+
+    Each example runs in its own process group, and the group is
+    killed if the example is still running after --timeout SECONDS
+    (example_timeout, 0 for no limit). With --background-jobs N the
+    slow examples, like servers and client/server pairs, are started
+    early in up to N background threads while cog works through the
+    fast ones. Example directories with the slowest examples are
+    also started first when using --jobs.
 
     See help on paver.doctools.cog for details on the standard
     options.
     """
     options.order('cog', 'sphinx', add_rest=True)
+    _parse_cog_args(options)
     # Figure out if we were given a filename or
     # directory, and scan the directory for files
     # if we need to.
-    files_to_cog = getattr(options, 'args', [])
-    if files_to_cog and os.path.isdir(files_to_cog[0]):
-        dir_to_scan = path(files_to_cog[0])
-        files_to_cog = dir_to_scan.walkfiles(options.get("pattern", "*.rst"))
+    files_to_cog = []
+    for name in getattr(options, 'args', []):
+        if os.path.isdir(name):
+            files_to_cog.extend(path(name).walkfiles(options.get("pattern", "*.rst")))
+        else:
+            files_to_cog.append(name)
     _runcog(options, files_to_cog)
     return
 
@@ -270,13 +481,140 @@ def html(options):
 @consume_args
 def tabcheck(options):
     """Run tabnanny against the current module.
+
+    Give file or directory names to check just those, otherwise every
+    .py file in the PyMOTW tree is checked. The files are checked by a pool of
+    worker processes (--jobs, one per CPU by default), and files that
+    passed and have not changed since are skipped (--no-cache checks
+    everything again).
     """
-    args = getattr(options, 'args', [])
+    parser = optparse.OptionParser()
+    parser.add_option('-j', '--jobs', type='int',
+                      default=int(options.tabcheck.jobs),
+                      help='Number of worker processes to use, 0 for one per CPU',
+                      )
+    parser.add_option('--no-cache',
+                      action='store_false',
+                      dest='use_cache',
+                      default=options.tabcheck.use_cache,
+                      help='Check every file, ignoring the ones that passed before',
+                      )
+    cmd_options, args = parser.parse_args(list(getattr(options, 'args', [])))
     if not args:
-        args = path('PyMOTW').glob('*')
-    tabnanny.verbose = 1
-    for module in args:
-        tabnanny.check(module)
+        # Only the python files: the module directories are searched
+        # for .py files, but any other file named is checked too.
+        args = path('PyMOTW').dirs() + path('PyMOTW').glob('*.py')
+    jobs = cmd_options.jobs
+    if jobs < 1:
+        jobs = multiprocessing.cpu_count()
+    found, checked, problems = tabchecker.check(args,
+                                                options.tabcheck.cache_file,
+                                                jobs,
+                                                cmd_options.use_cache)
+    print 'tabcheck: %d files, %d checked, %d with problems' % (
+        found, checked, problems)
+    return
+
+@task
+@consume_args
+def benchmark(options):
+    """Time the build stages and compare them with the saved baseline.
+
+    Each stage (cog, html, pdf and website by default) is run in a
+    scratch copy of the tree with only a few modules, then in a copy
+    of the whole tree. The wall time, CPU time, peak memory and
+    number of files written are added to the history file. The task
+    fails if a stage fails or is more than --threshold (10%) worse
+    than the baseline. The first results for a stage on a host (and
+    for the subset, with a set of modules) become its baseline. Use
+    --set-baseline to replace it with the results of this run.
+
+    Examples::
+
+      $ paver benchmark
+      $ paver benchmark --stages cog,html --scope subset
+      $ paver benchmark --modules os,glob --scope subset
+      $ paver benchmark --set-baseline
+    """
+    opts = options.benchmark
+    parser = optparse.OptionParser()
+    parser.add_option('--stages',
+                      default=','.join(opts.stages),
+                      help='Comma separated list of the tasks to time',
+                      )
+    parser.add_option('--scope',
+                      default=','.join(opts.scopes),
+                      help='subset, full, or subset,full',
+                      )
+    parser.add_option('--modules',
+                      default=','.join(opts.modules),
+                      help='Comma separated list of the modules in the subset',
+                      )
+    parser.add_option('--threshold', type='float',
+                      default=float(opts.threshold),
+                      help='Fraction over the baseline to report as a regression',
+                      )
+    parser.add_option('--set-baseline',
+                      action='store_true',
+                      default=False,
+                      help='Save the results of this run as the baseline',
+                      )
+    cmd_options, args = parser.parse_args(list(getattr(options, 'args', [])))
+    stages = [s for s in cmd_options.stages.split(',') if s]
+    scopes = [s for s in cmd_options.scope.split(',') if s]
+    modules = [m for m in cmd_options.modules.split(',') if m]
+    for scope in scopes:
+        if scope not in ('subset', 'full'):
+            raise BuildFailure('Unknown scope %r' % scope)
+
+    with open(opts.log_file, 'wt') as log:
+        results, problems = dry(
+            'benchmark %s (%s)' % (', '.join(stages), ', '.join(scopes)),
+            buildbench.run,
+            os.getcwd(), PROJECT, stages, scopes, modules,
+            opts.history_file, cmd_options.threshold, log,
+            cmd_options.set_baseline,
+            ) or ({}, [])
+    if results:
+        print buildbench.format_report(results, opts.history_file, modules)
+        print 'Output of the stages is in %s' % opts.log_file
+    if problems:
+        raise BuildFailure('\n'.join(problems))
+    return
+
+@task
+def startup(options):
+    """Fail if importing PyMOTW or starting motw gets slower than its budget.
+    """
+    checks = [
+        ('import PyMOTW', 'import PyMOTW', options.startup.import_budget),
+        # Loading motw as a module would otherwise leave a motwc
+        # file behind, which changes the timing of the next run.
+        ('motw',
+         "import sys; sys.dont_write_bytecode = True; "
+         "import imp; imp.load_source('motw', 'motw')",
+         options.startup.motw_budget),
+        ]
+    failed = False
+    for name, code, budget in checks:
+        elapsed, problems = startupcheck.check(code,
+                                               float(budget) / 1000,
+                                               options.startup.deferred,
+                                               int(options.startup.runs))
+        print '%-15s %5.1fms (budget %sms)' % (name, elapsed * 1000, budget)
+        for problem in problems:
+            print '  %s' % problem
+            failed = True
+    if failed:
+        raise BuildFailure('start-up is over budget')
+    return
+
+def _html_pages(options, filenames):
+    """Write the HTML for only the named rst files."""
+    set_templates(options.html.templates)
+    options.order('html', 'sphinx')
+    sh(' '.join(sphinxbuild.sphinx_command(options, filenames)))
+    options.order()
     return
 
 @task
@@ -284,11 +622,33 @@ def tabcheck(options):
 def update(options):
     """Run cog against the named module, then re-build the HTML.
 
+    Only the documents that depend on a file changed since the last
+    update are cogged and rebuilt. The dependencies come from the
+    include() and run_script() calls in the cog blocks and from the
+    include and literalinclude directives, and are saved in
+    graph_file. Use --full to cog and build everything.
+
     Examples::
 
       $ paver update atexit
+      $ paver update --jobs 4 atexit
+      $ paver update --full atexit
     """
     options.order('update', 'sphinx', add_rest=True)
+    parser = optparse.OptionParser()
+    parser.add_option('--full', action='store_true', default=False,
+                      help='Cog and build every document in the module',
+                      )
+    cmd_options = _parse_cog_args(options, parser)
+    cog_args = ['--jobs', str(options.jobs)]
+    if not options.use_cache:
+        cog_args.append('--no-cache')
+    if options.executor == 'fork':
+        cog_args.append('--fork-server')
+    cog_args.extend(['--time-budget', str(options.time_budget),
+                     '--timeout', str(options.example_timeout),
+                     '--background-jobs', str(options.background_jobs),
+                     ])
     args = getattr(options, 'args', [])
     if args:
         module = args[0]
@@ -296,19 +656,59 @@ def update(options):
         module = MODULE
     module_dir = 'PyMOTW/' + module
     tabnanny.check(module_dir)
+
+    graph = depgraph.DependencyGraph(options.graph_file,
+                                     options.cog.includedir)
+    rst_files = [str(f) for f in path(module_dir).walkfiles('*.rst')]
+    if cmd_options.full:
+        outdated = dict((f, [f]) for f in rst_files)
+    else:
+        outdated = graph.outdated(rst_files)
+    if not outdated:
+        print 'Nothing has changed in %s' % module_dir
+        return
+    to_build = sorted(outdated)
+    for rst_file in to_build:
+        print '%s: %s' % (rst_file, ', '.join(outdated[rst_file]))
+
     options.order('cog', 'sphinx', add_rest=True)
-    options.args = [module_dir]
+    options.args = cog_args + to_build
     cog(options)
-    html(options)
+    if cmd_options.full:
+        html(options)
+    else:
+        _html_pages(options, to_build)
+
+    for rst_file in to_build:
+        graph.update(rst_file)
+    graph.save()
     return
 
 
+def _make_text_archive(options):
+    """Pack the text output into the archive and search index read by
+    the motw command.
+    """
+    from PyMOTW import docarchive, docsearch
+    count = dry('pack %s into %s' % (options.text.outdir, options.text.archive),
+                docarchive.write_archive,
+                options.text.outdir, options.text.archive)
+    if count is not None:
+        print 'Packed %d documents' % count
+    counts = dry('index %s into %s' % (options.text.outdir, options.text.index),
+                 docsearch.write_index,
+                 options.text.outdir, options.text.index)
+    if counts is not None:
+        print 'Indexed %d documents, %d terms' % counts
+    return
+
 @task
 def text(options):
     "Generate text files from rst input."
     if paverutils is None:
         raise RuntimeError('Could not find sphinxcontrib.paverutils, will not be able to build text output.')
     paverutils.run_sphinx(options, 'text')
+    _make_text_archive(options)
     return
 
 @task
@@ -356,12 +756,44 @@ def pdf():
     paverutils.pdf(options)
     return
 
+def _make_pdf(options):
+    """Convert the LaTeX output of the pdf build to a PDF.
+    """
+    options.order('pdf', 'sphinx')
+    outdir = sphinxbuild.get_paths(options).outdir
+    sh('cd %s; PDFLATEX="%s" make -e' % (outdir, options.get('pdflatex', 'pdflatex')))
+    options.order()
+    return
+
+@task
+def formats(options):
+    """Generate several output formats at once.
+
+    The sources are read once into the shared doctree cache, then the
+    writers for the other formats run in parallel. The option sets
+    to build come from options.formats.builds (html, text and pdf by
+    default).
+    """
+    builds = options.formats.builds
+    if isinstance(builds, basestring):
+        # Set on the command line, as formats.builds=html,text
+        builds = builds.split(',')
+    sphinxbuild.build_formats(options, builds)
+    if 'text' in builds:
+        _make_text_archive(options)
+    if 'pdf' in builds:
+        _make_pdf(options)
+    return
+
 @task
 def website(options):
     """Create local copy of website files.
+
+    The HTML and LaTeX output are written in parallel from the same
+    doctrees.
     """
-    pdf(options)
-    webhtml(options)
+    sphinxbuild.build_formats(options, ['website', 'pdf'])
+    _make_pdf(options)
     # Copy the PDF to the files to be copied to the directory to install
     pdf_file = path(options.pdf.builddir) / 'latex' / (PROJECT + '-' + VERSION + '.pdf')
     pdf_file.copy(path(options.website.builddir) / 'html')
@@ -386,11 +818,27 @@ def installwebsite(options):
 
 @task
 def rsyncwebsite(options):
+    """Copy the website files that changed to the server.
+
+    Only files whose contents differ from the last time the site was
+    published are sent (see buildtools/deltapublish.py), which needs
+    rsync 3.1 or later. The first publish, and every publish with
+    website.publish_full set, replaces the whole tree on the server.
+    Set website.publish_target to a local directory to publish there
+    instead.
+    """
     # Copy to the server
     os.environ['RSYNC_RSH'] = '/usr/bin/ssh'
     src_path = path(options.website.builddir) / 'html'
-    sh('(cd %s; rsync --archive --delete --verbose . %s:%s)' %
-        (src_path, options.website.server, options.website.server_path))
+    target = (options.website.publish_target or
+              '%s:%s' % (options.website.server, options.website.server_path))
+    stats = dry('publish %s to %s' % (src_path, target),
+                deltapublish.publish, src_path, target,
+                options.website.publish_manifest,
+                full=options.website.publish_full,
+                )
+    if stats:
+        print deltapublish.format_report(stats)
     return
 
 
@@ -435,66 +883,16 @@ def webhtml(options):
 
 
 def get_post_title(filename):
-    f = open(filename, 'rt')
-    try:
-        body = f.read()
-    finally:
-        f.close()
-
-    # Clean up the HTML
-    from BeautifulSoup import BeautifulSoup, Tag
-
-    # The post body is passed to stdin.
-    soup = BeautifulSoup(body)
-
-    # Get the heading(s)
-    h1 = soup.find('h1')
-
-    # Get BeautifulSoup's version of the string
-    #title = ' '.join(h1.string)
-    title = ' '.join(s for s in h1 if type(s) != Tag)
-
-    return title
+    """Return the title of the rendered page in filename."""
+    return blogpost.extract(filename)[0]
 
 
 def gen_blog_post(outdir, input_base, blog_base, url_base):
     """Generate the blog post body.
     """
     outdir = path(outdir)
-    input_file = outdir / input_base
-    blog_file = outdir/ blog_base
-
-    canonical_url = "http://www.doughellmann.com/" + url_base
-    if not canonical_url.endswith('/'):
-        canonical_url += '/'
-    if input_base != "index.html":
-        canonical_url += input_base
-
-    module_name = MODULE
-    title = '%s - ' % module_name
-
-    # Get the intro paragraph
-    from BeautifulSoup import BeautifulSoup, Tag
-    raw_body = input_file.text().strip()
-    soup = BeautifulSoup(raw_body)
-    intro = soup.find('p')
-
-    # Strip hyperlinks by replacing those nodes with their contents.
-    for link in intro.findAll('a'):
-        new_span = Tag(soup, 'span')
-        for c in link.contents:
-            new_span.append(c)
-        link.replaceWith(new_span)
-
-    output_body = '''%(intro)s
-<p><a href="%(canonical_url)s">Read more...</a></p>
-''' % locals()
-    blog_file.write_text(output_body)
-
-    home_page_reference = '''<p><a class="reference external" href="http://www.doughellmann.com/PyMOTW/">PyMOTW Home</a></p>'''
-    canonical_reference = '''<p>The <a class="reference external" href="%(canonical_url)s">canonical version</a> of this article</p>''' % locals()
-
-    blog_file.write_text(output_body)
+    blogpost.write_post(outdir / input_base, outdir / blog_base,
+                        url_base, input_base)
     return
 
 @task
@@ -550,6 +948,35 @@ def blog(options):
     return
 
 
+@task
+def blog_all(options):
+    """Generate the blog post body for every module in one build.
+
+    All of the modules are rendered with the blog templates by a single
+    sphinx-build run, then <module>/blog.html is written next to each
+    <module>/index.html in options.blog.all_outdir.
+    """
+    build = Bunch(docroot='.',
+                  sourcedir=PROJECT,
+                  confdir=options.blog.confdir,
+                  outdir=options.blog.all_outdir,
+                  doctrees=options.blog.all_doctrees,
+                  builder='html',
+                  # The blog configuration expects a single module.
+                  config_args={'master_doc':'contents'},
+                  )
+    cmd = [str(part) for part in sphinxbuild.sphinx_command(build)]
+    rc = dry(' '.join(cmd), subprocess.call, cmd)
+    if rc:
+        raise BuildFailure('sphinx-build returned %s' % rc)
+    count = dry('Write blog post bodies under %s' % options.blog.all_outdir,
+                blogpost.write_all_posts,
+                options.blog.all_outdir, PROJECT, options.blog.out_file)
+    if count is not None:
+        print 'Wrote %d blog posts' % count
+    return
+
+
 @task
 @needs(['uncog'])
 def commit():